@@ -19,6 +19,7 @@ from . import dependency
 from . import ui
 from . import props
 from . import image
+from . import raycast
 
 
 class PNP_OT_install_dependencies(bpy.types.Operator):
@@ -94,9 +95,11 @@ def register_classes(unregister=False):
         Defaults to False.
     """
 
-    # pnp is imported inside this function (and not at top of doc)
-    # as it is dependent on opencv installation
+    # pnp / live / propagate are imported inside this function (and not at
+    # top of doc) as they are dependent on opencv installation
     from . import pnp
+    from . import live
+    from . import propagate
 
     classes = [
         props.PointMatch,
@@ -107,14 +110,21 @@ def register_classes(unregister=False):
         export.OBJECT_OT_export_matches,
         pnp.PNP_OT_calibrate_camera,
         pnp.PNP_OT_pose_camera,
+        pnp.PNP_OT_pose_all_cameras,
+        pnp.PNP_OT_pose_camera_video,
+        pnp.PNP_OT_bundle_adjust,
         pnp.PNP_OT_reset_camera,
         ui.ImagePanel,
         ui.PointsPanel,
+        ui.PropagatePanel,
+        ui.GuidedMatchingPanel,
         ui.CalibratePanel,
         ui.SolvePanel,
+        ui.BundlePanel,
         ui.CurrentCameraSettings,
         ui.ExportPanel,
         image.IMAGE_OT_add_image,
+        image.IMAGE_OT_add_images,
         image.IMAGE_OT_swap_image,
         image.IMAGE_OT_point_mode,
         image.IMAGE_OT_add_3d_point,
@@ -123,9 +133,21 @@ def register_classes(unregister=False):
         image.IMAGE_OT_delete_2d_point,
         image.IMAGE_OT_toggle_camera_view,
         image.IMAGE_OT_update_3d_point_size,
+        image.IMAGE_OT_update_proxies,
+        propagate.IMAGE_OT_propagate_points,
+        propagate.IMAGE_OT_predict_points,
+        propagate.IMAGE_OT_accept_predicted_points,
+        propagate.IMAGE_OT_reject_predicted_points,
     ]
 
     if unregister:
+        live.unregister_handlers()
+        raycast.unregister_handlers()
+        image.unregister_handlers()
+        pnp.result_cache.invalidate()
+        pnp.track_indices.clear()
+        propagate.feature_cache.invalidate()
+
         for cls in reversed(classes):
             bpy.utils.unregister_class(cls)
 
@@ -138,6 +160,10 @@ def register_classes(unregister=False):
             type=props.ImageMatchSettings
         )
 
+        live.register_handlers()
+        raycast.register_handlers()
+        image.register_handlers()
+
 
 def register():
     print("registering...")
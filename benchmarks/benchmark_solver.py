@@ -0,0 +1,555 @@
+""" Benchmark the solver core (solver.py) on synthetic scenes.
+
+Generates random cameras and 2D-3D point sets with known ground truth, then
+records runtime and accuracy of pose solving and camera calibration while
+sweeping point counts, pixel noise, outlier rates, distortion and solver
+options. Only needs numpy and OpenCV (not Blender), so can run headless e.g.
+
+    python benchmarks/benchmark_solver.py --output report.json
+
+Pass a previous report with --baseline to flag configurations whose median
+runtime has regressed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+
+# solver.py has no bpy / relative imports, so can be imported directly from
+# the add-on folder
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ADDON_DIRECTORY)
+import solver  # noqa: E402
+
+
+IMAGE_SIZE = (1920, 1080)
+FOCAL_LENGTH = 1500.0
+CAMERA_DISTANCE = 10.0
+SCENE_DEPTH = 4.0
+
+# Named solver configurations to compare - options for solver.SolverOptions
+POSE_CONFIGS = {
+    "SQPNP": {"pnp_solver": "SQPNP"},
+    "EPNP": {"pnp_solver": "EPNP"},
+    "IPPE": {"pnp_solver": "IPPE"},
+    "ITERATIVE": {"pnp_solver": "ITERATIVE"},
+    "BEST": {"pnp_solver": "BEST"},
+    "SQPNP+LM": {"pnp_solver": "SQPNP", "refine_method": "LM"},
+    "SQPNP+RANSAC": {"pnp_solver": "SQPNP", "use_ransac": True},
+    "SQPNP+RANSAC+LM": {
+        "pnp_solver": "SQPNP",
+        "use_ransac": True,
+        "refine_method": "LM",
+    },
+}
+
+# Named sets of intrinsics to calibrate - options for
+# solver.calibration_flags
+CALIBRATION_CONFIGS = {
+    "focal": {"focal_length": True},
+    "focal+k1": {"focal_length": True, "distortion_k1": True},
+    "focal+k1+k2": {
+        "focal_length": True,
+        "distortion_k1": True,
+        "distortion_k2": True,
+    },
+    "all": {
+        "focal_length": True,
+        "principal_point": True,
+        "distortion_k1": True,
+        "distortion_k2": True,
+        "distortion_k3": True,
+    },
+}
+
+FULL_SWEEP = {
+    "point_counts": [4, 6, 10, 30, 100, 300, 1000, 3000, 10000],
+    "noise_levels": [0.0, 0.5, 2.0],
+    "outlier_rates": [0.0, 0.1, 0.3],
+    "distortions": [0.0, -0.1, 0.2],
+    "view_counts": [1, 3],
+    "repeats": 5,
+}
+
+QUICK_SWEEP = {
+    "point_counts": [4, 10, 100, 1000, 10000],
+    "noise_levels": [0.0, 1.0],
+    "outlier_rates": [0.0, 0.2],
+    "distortions": [0.0, -0.1],
+    "view_counts": [1],
+    "repeats": 3,
+}
+
+# Keys of benchmark records that describe the settings (rather than the
+# measurements)
+RECORD_SETTINGS = (
+    "config",
+    "npoints",
+    "nviews",
+    "noise",
+    "outlier_rate",
+    "distortion_k1",
+)
+
+
+def get_camera_intrinsics(focal_length=FOCAL_LENGTH, image_size=IMAGE_SIZE):
+    """Get numpy array of intrinsics for a camera with a centred principal
+    point"""
+
+    return np.array(
+        [
+            [focal_length, 0, image_size[0] / 2],
+            [0, focal_length, image_size[1] / 2],
+            [0, 0, 1],
+        ],
+        dtype="double",
+    )
+
+
+def make_scene(
+    rng,
+    npoints,
+    camera_intrinsics,
+    distortion_coefficients,
+    noise,
+    outlier_rate,
+):
+    """Generate a random camera pose, and 2D-3D point pairs seen by it
+
+    Args:
+        rng: numpy random generator
+        npoints: number of point pairs
+        camera_intrinsics: numpy array of true camera intrinsics
+        distortion_coefficients: numpy array of true distortion coefficients
+        noise: standard deviation of pixel noise added to the 2D points
+        outlier_rate: fraction of 2D points replaced by random positions
+
+    Returns:
+        points_3d_coords, points_2d_coords, true rvec, true tvec
+    """
+
+    # Camera looks at the origin from a random direction
+    rvec = rng.normal(0, 0.5, 3)
+    rmat, _ = cv.Rodrigues(rvec)
+    tvec = np.array([0, 0, CAMERA_DISTANCE]) + rng.normal(0, 0.5, 3)
+
+    # Place 3D points by back-projecting random pixels to random depths, so
+    # they're spread over the whole image
+    pixels = rng.uniform((0, 0), IMAGE_SIZE, (npoints, 2))
+    normalised = cv.undistortPoints(
+        pixels.reshape(-1, 1, 2),
+        camera_intrinsics,
+        distortion_coefficients,
+    ).reshape(-1, 2)
+    depths = CAMERA_DISTANCE + rng.uniform(
+        -SCENE_DEPTH / 2, SCENE_DEPTH / 2, npoints
+    )
+    points_camera = np.column_stack([normalised, np.ones(npoints)])
+    points_camera *= depths[:, None]
+    points_3d_coords = (points_camera - tvec) @ rmat
+
+    projected_points, _ = cv.projectPoints(
+        points_3d_coords,
+        rvec,
+        tvec,
+        camera_intrinsics,
+        distortion_coefficients,
+    )
+    points_2d_coords = projected_points.reshape(-1, 2)
+    points_2d_coords += rng.normal(0, noise, points_2d_coords.shape)
+
+    outliers = rng.random(npoints) < outlier_rate
+    points_2d_coords[outliers] = rng.uniform(
+        (0, 0), IMAGE_SIZE, (np.sum(outliers), 2)
+    )
+
+    return points_3d_coords, points_2d_coords, rvec, tvec
+
+
+def pose_errors(rvec, tvec, true_rvec, true_tvec):
+    """Get rotation error (in degrees) and camera position error (in scene
+    units) of a solved pose compared to the true pose"""
+
+    rmat, _ = cv.Rodrigues(np.asarray(rvec, dtype="double"))
+    true_rmat, _ = cv.Rodrigues(np.asarray(true_rvec, dtype="double"))
+
+    rotation_difference, _ = cv.Rodrigues(rmat @ true_rmat.T)
+    rotation_error = np.degrees(np.linalg.norm(rotation_difference))
+
+    position = -rmat.T @ np.ravel(tvec)
+    true_position = -true_rmat.T @ np.ravel(true_tvec)
+    position_error = np.linalg.norm(position - true_position)
+
+    return float(rotation_error), float(position_error)
+
+
+def summarise(values):
+    """Get median of the given values, or None if there are none"""
+
+    if len(values) == 0:
+        return None
+    return float(np.median(values))
+
+
+def benchmark_pose(rng, config_name, npoints, noise, outlier_rate, repeats):
+    """Time solver.solve_image on random scenes with the given settings
+
+    Returns:
+        Dictionary of the settings, and median runtime / errors
+    """
+
+    camera_intrinsics = get_camera_intrinsics()
+    distortion_coefficients = np.zeros(5)
+    options = solver.SolverOptions(**POSE_CONFIGS[config_name])
+
+    runtimes = []
+    rotation_errors = []
+    position_errors = []
+    reprojection_errors = []
+    successes = 0
+
+    for _ in range(repeats):
+        points_3d_coords, points_2d_coords, true_rvec, true_tvec = make_scene(
+            rng,
+            npoints,
+            camera_intrinsics,
+            distortion_coefficients,
+            noise,
+            outlier_rate,
+        )
+        snapshot = solver.ImageSnapshot(
+            "benchmark",
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            IMAGE_SIZE,
+        )
+
+        start_time = time.perf_counter()
+        result = solver.solve_image(snapshot, options)
+        runtimes.append(time.perf_counter() - start_time)
+
+        if not result.success:
+            continue
+
+        successes += 1
+        rotation_error, position_error = pose_errors(
+            result.rvec, result.tvec, true_rvec, true_tvec
+        )
+        rotation_errors.append(rotation_error)
+        position_errors.append(position_error)
+        reprojection_errors.append(result.error)
+
+    return {
+        "config": config_name,
+        "npoints": npoints,
+        "noise": noise,
+        "outlier_rate": outlier_rate,
+        "repeats": repeats,
+        "success_rate": successes / repeats,
+        "runtime": summarise(runtimes),
+        "rotation_error_deg": summarise(rotation_errors),
+        "position_error": summarise(position_errors),
+        "reprojection_error": summarise(reprojection_errors),
+    }
+
+
+def benchmark_calibration(
+    rng, config_name, npoints, nviews, noise, distortion, repeats
+):
+    """Time solver.calibrate_images on random scenes with the given settings.
+    Calibration starts from a focal length 10% off the true value, and no
+    distortion.
+
+    Returns:
+        Dictionary of the settings, and median runtime / errors
+    """
+
+    true_intrinsics = get_camera_intrinsics()
+    true_distortion = np.array([distortion, 0, 0, 0, 0])
+    initial_intrinsics = get_camera_intrinsics(FOCAL_LENGTH * 1.1)
+    flags = solver.calibration_flags(**CALIBRATION_CONFIGS[config_name])
+
+    runtimes = []
+    focal_errors = []
+    principal_point_errors = []
+    k1_errors = []
+    reprojection_errors = []
+    successes = 0
+
+    for _ in range(repeats):
+        snapshots = []
+        for view in range(nviews):
+            points_3d_coords, points_2d_coords, _, _ = make_scene(
+                rng, npoints, true_intrinsics, true_distortion, noise, 0
+            )
+            snapshots.append(
+                solver.ImageSnapshot(
+                    f"view {view}",
+                    points_3d_coords,
+                    points_2d_coords,
+                    initial_intrinsics,
+                    np.zeros(5),
+                    IMAGE_SIZE,
+                )
+            )
+
+        start_time = time.perf_counter()
+        try:
+            result = solver.calibrate_images(snapshots, flags)
+        except cv.error:
+            runtimes.append(time.perf_counter() - start_time)
+            continue
+        runtimes.append(time.perf_counter() - start_time)
+
+        successes += 1
+        calibrated = result.camera_intrinsics
+        focal_errors.append(
+            abs(calibrated[0, 0] - FOCAL_LENGTH) / FOCAL_LENGTH
+        )
+        principal_point_errors.append(
+            np.linalg.norm(calibrated[:2, 2] - true_intrinsics[:2, 2])
+        )
+        k1_errors.append(abs(result.distortion_coefficients[0] - distortion))
+        reprojection_errors.append(result.error)
+
+    return {
+        "config": config_name,
+        "npoints": npoints,
+        "nviews": nviews,
+        "noise": noise,
+        "distortion_k1": distortion,
+        "repeats": repeats,
+        "success_rate": successes / repeats,
+        "runtime": summarise(runtimes),
+        "focal_relative_error": summarise(focal_errors),
+        "principal_point_error": summarise(principal_point_errors),
+        "k1_error": summarise(k1_errors),
+        "reprojection_error": summarise(reprojection_errors),
+    }
+
+
+def run_benchmarks(sweep, pose_configs, calibration_configs, seed):
+    """Run the pose and calibration benchmarks over every combination of
+    the sweep settings
+
+    Returns:
+        Report dictionary, with metadata and a list of records for each of
+        pose and calibration
+    """
+
+    rng = np.random.default_rng(seed)
+    repeats = sweep["repeats"]
+
+    pose_records = []
+    for config_name in pose_configs:
+        for npoints in sweep["point_counts"]:
+            for noise in sweep["noise_levels"]:
+                for outlier_rate in sweep["outlier_rates"]:
+                    record = benchmark_pose(
+                        rng,
+                        config_name,
+                        npoints,
+                        noise,
+                        outlier_rate,
+                        repeats,
+                    )
+                    pose_records.append(record)
+                    print_record("pose", record)
+
+    calibration_records = []
+    for config_name in calibration_configs:
+        # OpenCV needs at least 6 points per view to calibrate
+        for npoints in [n for n in sweep["point_counts"] if n >= 6]:
+            for nviews in sweep["view_counts"]:
+                for noise in sweep["noise_levels"]:
+                    for distortion in sweep["distortions"]:
+                        record = benchmark_calibration(
+                            rng,
+                            config_name,
+                            npoints,
+                            nviews,
+                            noise,
+                            distortion,
+                            repeats,
+                        )
+                        calibration_records.append(record)
+                        print_record("calibration", record)
+
+    return {
+        "metadata": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "sweep": sweep,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "pose": pose_records,
+        "calibration": calibration_records,
+    }
+
+
+def format_value(value, format_spec):
+    if value is None:
+        return "-"
+    return format(value, format_spec)
+
+
+def print_record(kind, record):
+    """Print a one line summary of a benchmark record"""
+
+    settings = ", ".join(
+        f"{key}={record[key]}" for key in RECORD_SETTINGS if key in record
+    )
+    runtime = format_value(
+        None if record["runtime"] is None else record["runtime"] * 1000,
+        ".2f",
+    )
+    print(
+        f"{kind}: {settings} | {runtime} ms, "
+        f"success {record['success_rate']:.0%}, "
+        f"reprojection {format_value(record['reprojection_error'], '.3f')}"
+    )
+
+
+def get_record_key(kind, record):
+    """Get key identifying the settings of a benchmark record (i.e.
+    everything apart from the measurements)"""
+
+    return (kind,) + tuple(record.get(key) for key in RECORD_SETTINGS)
+
+
+def find_regressions(report, baseline, threshold):
+    """Compare median runtimes against a baseline report
+
+    Args:
+        report: report dictionary from run_benchmarks
+        baseline: report dictionary from a previous run
+        threshold: runtime ratio (new / baseline) above which a
+            configuration counts as a regression
+
+    Returns:
+        List of (key, baseline runtime, new runtime) for each regression
+    """
+
+    baseline_runtimes = {
+        get_record_key(kind, record): record["runtime"]
+        for kind in ("pose", "calibration")
+        for record in baseline.get(kind, [])
+    }
+
+    regressions = []
+    for kind in ("pose", "calibration"):
+        for record in report[kind]:
+            key = get_record_key(kind, record)
+            baseline_runtime = baseline_runtimes.get(key)
+            if not baseline_runtime or record["runtime"] is None:
+                continue
+            if record["runtime"] > baseline_runtime * threshold:
+                regressions.append((key, baseline_runtime, record["runtime"]))
+
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark pose solving and camera calibration on "
+        "synthetic scenes"
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_report.json",
+        help="Path to write the JSON report to",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Run a smaller sweep (e.g. for a quick regression check)",
+    )
+    parser.add_argument(
+        "--pose-configs",
+        nargs="+",
+        choices=list(POSE_CONFIGS),
+        default=list(POSE_CONFIGS),
+        help="Solver configurations to benchmark",
+    )
+    parser.add_argument(
+        "--calibration-configs",
+        nargs="+",
+        choices=list(CALIBRATION_CONFIGS),
+        default=list(CALIBRATION_CONFIGS),
+        help="Sets of calibrated intrinsics to benchmark",
+    )
+    parser.add_argument(
+        "--point-counts",
+        nargs="+",
+        type=int,
+        help="Override the point counts to sweep",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        help="Override the number of random scenes per configuration",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--baseline",
+        help="Previous JSON report to compare runtimes against",
+    )
+    parser.add_argument(
+        "--regression-threshold",
+        type=float,
+        default=1.5,
+        help="Runtime ratio (new / baseline) that counts as a regression",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    sweep = dict(QUICK_SWEEP if args.quick else FULL_SWEEP)
+    if args.point_counts:
+        sweep["point_counts"] = args.point_counts
+    if args.repeats:
+        sweep["repeats"] = args.repeats
+
+    report = run_benchmarks(
+        sweep, args.pose_configs, args.calibration_configs, args.seed
+    )
+
+    with open(args.output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Wrote report to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = find_regressions(
+            report, baseline, args.regression_threshold
+        )
+        for key, baseline_runtime, runtime in regressions:
+            print(
+                f"Regression: {key} {baseline_runtime * 1000:.2f} ms -> "
+                f"{runtime * 1000:.2f} ms"
+            )
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
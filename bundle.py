@@ -0,0 +1,512 @@
+""" Sparse bundle adjustment of camera poses, intrinsics and 3D points. Like
+solver.py, this only depends on numpy and OpenCV (not bpy) """
+
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+
+# Columns of the cv.projectPoints jacobian (with 5 distortion coefficients)
+# for each intrinsic parameter that can be refined. The aspect ratio is fixed,
+# so the focal length is the sum of the fx / fy columns.
+INTRINSIC_JACOBIAN_COLUMNS = {
+    "focal": (6, 7),
+    "cx": (8,),
+    "cy": (9,),
+    "k1": (10,),
+    "k2": (11,),
+    "k3": (14,),
+}
+
+BundleResult = namedtuple(
+    "BundleResult",
+    [
+        "rvecs",
+        "tvecs",
+        "camera_intrinsics",
+        "distortion_coefficients",
+        "points_3d_coords",
+        "initial_rms",
+        "final_rms",
+        "iterations",
+    ],
+)
+
+
+def merge_close_points(points_3d_coords, distance):
+    """Label 3D points so that points closer than distance to each other
+    (directly, or via a chain of other points) share a label
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        distance: maximum distance between merged points. If 0, no points
+            are merged.
+
+    Returns:
+        Numpy array of integer labels (0 to number of merged points - 1), one
+        per point
+    """
+
+    npoints = points_3d_coords.shape[0]
+    parents = np.arange(npoints)
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    if distance > 0 and npoints > 0:
+        # Hash points into a grid with cells of size distance, so each point
+        # only needs to be compared to those in neighbouring cells
+        cells = {}
+        cell_indices = np.floor(points_3d_coords / distance).astype(int)
+        for i, cell in enumerate(map(tuple, cell_indices)):
+            cells.setdefault(cell, []).append(i)
+
+        offsets = np.stack(
+            np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1]), axis=-1
+        ).reshape(-1, 3)
+
+        for i, cell in enumerate(cell_indices):
+            for offset in offsets:
+                for j in cells.get(tuple(cell + offset), ()):
+                    if j <= i:
+                        continue
+                    separation = points_3d_coords[i] - points_3d_coords[j]
+                    if np.linalg.norm(separation) <= distance:
+                        parents[find(i)] = find(j)
+
+    roots = np.array([find(i) for i in range(npoints)], dtype=int)
+    _, labels = np.unique(roots, return_inverse=True)
+    return labels.reshape(-1)
+
+
+def get_intrinsic_params(camera_intrinsics, distortion_coefficients, names):
+    """Get vector of the named intrinsic parameters"""
+
+    values = {
+        "focal": camera_intrinsics[0, 0],
+        "cx": camera_intrinsics[0, 2],
+        "cy": camera_intrinsics[1, 2],
+        "k1": distortion_coefficients[0],
+        "k2": distortion_coefficients[1],
+        "k3": distortion_coefficients[4],
+    }
+    return np.array([values[name] for name in names], dtype="double")
+
+
+def set_intrinsic_params(
+    camera_intrinsics, distortion_coefficients, names, params
+):
+    """Get copies of camera_intrinsics and distortion_coefficients, with the
+    named intrinsic parameters set to params"""
+
+    camera_intrinsics = camera_intrinsics.copy()
+    distortion_coefficients = distortion_coefficients.copy()
+
+    for name, value in zip(names, params):
+        if name == "focal":
+            camera_intrinsics[0, 0] = value
+            camera_intrinsics[1, 1] = value
+        elif name == "cx":
+            camera_intrinsics[0, 2] = value
+        elif name == "cy":
+            camera_intrinsics[1, 2] = value
+        elif name == "k1":
+            distortion_coefficients[0] = value
+        elif name == "k2":
+            distortion_coefficients[1] = value
+        elif name == "k3":
+            distortion_coefficients[4] = value
+
+    return camera_intrinsics, distortion_coefficients
+
+
+class BundleProblem:
+    """Fixed structure of a bundle adjustment problem - which camera and
+    point each observation belongs to, and where each camera's parameters
+    are in the reduced (Schur complement) system"""
+
+    def __init__(
+        self,
+        camera_groups,
+        observations_camera,
+        observations_point,
+        free_points,
+        intrinsic_names,
+    ):
+        ncameras = len(camera_groups)
+        ngroups = int(np.max(camera_groups)) + 1 if ncameras > 0 else 0
+        nintrinsics = len(intrinsic_names)
+
+        self.intrinsic_names = tuple(intrinsic_names)
+        self.ncamera_params = 6 * ncameras + nintrinsics * ngroups
+
+        # Observations of each camera
+        order = np.argsort(observations_camera, kind="stable")
+        counts = np.bincount(observations_camera, minlength=ncameras)
+        self.camera_observations = np.split(order, np.cumsum(counts)[:-1])
+
+        # Parameter indices in the reduced system for each observation - 6
+        # pose parameters of its camera, then intrinsics of its group
+        pose_indices = 6 * observations_camera[:, None] + np.arange(6)
+        intrinsic_indices = (
+            6 * ncameras
+            + nintrinsics * camera_groups[observations_camera][:, None]
+            + np.arange(nintrinsics)
+        )
+        self.param_indices = np.hstack([pose_indices, intrinsic_indices])
+
+        # Free points, and the observations of them
+        self.free_point_index = np.full(len(free_points), -1, dtype=int)
+        self.free_point_index[free_points] = np.arange(
+            np.count_nonzero(free_points)
+        )
+        self.free_observations = np.flatnonzero(
+            free_points[observations_point]
+        )
+        self.free_observations_point = self.free_point_index[
+            observations_point[self.free_observations]
+        ]
+        self.nfree_points = np.count_nonzero(free_points)
+
+        # Pairs of free observations that see the same point - these couple
+        # camera parameters in the reduced system
+        order = np.argsort(self.free_observations_point, kind="stable")
+        sorted_points = self.free_observations_point[order]
+        boundaries = np.flatnonzero(np.diff(sorted_points)) + 1
+        pairs_first = []
+        pairs_second = []
+        for group in np.split(order, boundaries):
+            if len(group) == 0:
+                continue
+            first, second = np.meshgrid(group, group, indexing="ij")
+            pairs_first.append(first.ravel())
+            pairs_second.append(second.ravel())
+
+        if pairs_first:
+            self.pairs_first = np.concatenate(pairs_first)
+            self.pairs_second = np.concatenate(pairs_second)
+        else:
+            self.pairs_first = np.zeros(0, dtype=int)
+            self.pairs_second = np.zeros(0, dtype=int)
+
+
+def linearise(
+    problem,
+    poses,
+    camera_groups,
+    camera_intrinsics,
+    distortion_coefficients,
+    points_3d_coords,
+    observations_point,
+    observations_2d,
+):
+    """Calculate residuals of all observations, and their jacobian with
+    respect to the camera parameters (A) and point coordinates (B)
+
+    Returns:
+        residuals - numpy array (observations, 2)
+        A - numpy array (observations, 2, camera parameters per observation)
+        B - numpy array (observations, 2, 3)
+    """
+
+    nobservations = observations_2d.shape[0]
+    residuals = np.zeros((nobservations, 2))
+    A = np.zeros((nobservations, 2, 6 + len(problem.intrinsic_names)))
+    B = np.zeros((nobservations, 2, 3))
+
+    for camera, observations in enumerate(problem.camera_observations):
+        if len(observations) == 0:
+            continue
+
+        group = camera_groups[camera]
+        rvec = poses[camera, :3]
+        tvec = poses[camera, 3:]
+
+        projected_points, jacobian = cv.projectPoints(
+            points_3d_coords[observations_point[observations]],
+            rvec,
+            tvec,
+            camera_intrinsics[group],
+            distortion_coefficients[group],
+        )
+        jacobian = jacobian.reshape(len(observations), 2, -1)
+
+        residuals[observations] = (
+            projected_points.reshape(-1, 2) - observations_2d[observations]
+        )
+
+        A[observations, :, :6] = jacobian[:, :, :6]
+        column = 6
+        for name in problem.intrinsic_names:
+            A[observations, :, column] = jacobian[
+                :, :, list(INTRINSIC_JACOBIAN_COLUMNS[name])
+            ].sum(axis=2)
+            column += 1
+
+        # Points move the projection the same way as translation, rotated
+        # into the camera frame
+        rmat, _ = cv.Rodrigues(rvec)
+        B[observations] = jacobian[:, :, 3:6] @ rmat
+
+    return residuals, A, B
+
+
+def bundle_adjust(
+    rvecs,
+    tvecs,
+    camera_groups,
+    camera_intrinsics,
+    distortion_coefficients,
+    points_3d_coords,
+    observations_camera,
+    observations_point,
+    observations_2d,
+    free_points,
+    intrinsic_names=(),
+    point_weight=100.0,
+    max_iterations=50,
+    tolerance=1e-8,
+):
+    """Jointly refine camera poses, camera intrinsics and 3D points to
+    minimise the reprojection error over all images, with a sparse
+    Levenberg-Marquardt solver. Points are eliminated from the normal
+    equations with the Schur complement, so each iteration only needs a dense
+    solve over the camera parameters.
+
+    Args:
+        rvecs: numpy array (cameras, 3) of initial rotation vectors
+        tvecs: numpy array (cameras, 3) of initial translation vectors
+        camera_groups: numpy array, intrinsics group index of each camera.
+            Cameras in the same group share intrinsics.
+        camera_intrinsics: numpy array (groups, 3, 3) of initial intrinsics
+        distortion_coefficients: numpy array (groups, 5) of initial
+            distortion coefficients
+        points_3d_coords: numpy array (points, 3) of initial 3D points
+        observations_camera: numpy array, camera index of each observation
+        observations_point: numpy array, point index of each observation
+        observations_2d: numpy array (observations, 2) of observed 2D points
+        free_points: boolean numpy array, true for each point to refine. Other
+            points are fixed.
+        intrinsic_names: names of intrinsics to refine (keys of
+            INTRINSIC_JACOBIAN_COLUMNS)
+        point_weight: weight (in pixels per scene unit) keeping refined points
+            close to their initial position
+        max_iterations: maximum number of iterations
+        tolerance: stop once the relative decrease in error is below this
+
+    Returns:
+        BundleResult
+    """
+
+    camera_groups = np.asarray(camera_groups, dtype=int)
+    observations_camera = np.asarray(observations_camera, dtype=int)
+    observations_point = np.asarray(observations_point, dtype=int)
+    observations_2d = np.asarray(observations_2d, dtype="double")
+    free_points = np.asarray(free_points, dtype=bool)
+
+    problem = BundleProblem(
+        camera_groups,
+        observations_camera,
+        observations_point,
+        free_points,
+        intrinsic_names,
+    )
+
+    ncameras = len(camera_groups)
+    ngroups = len(camera_intrinsics)
+    nintrinsics = len(intrinsic_names)
+
+    poses = np.hstack(
+        [
+            np.asarray(rvecs, dtype="double").reshape(-1, 3),
+            np.asarray(tvecs, dtype="double").reshape(-1, 3),
+        ]
+    )
+    intrinsic_params = np.array(
+        [
+            get_intrinsic_params(
+                camera_intrinsics[group],
+                distortion_coefficients[group],
+                intrinsic_names,
+            )
+            for group in range(ngroups)
+        ]
+    ).reshape(ngroups, nintrinsics)
+    initial_points = np.asarray(points_3d_coords, dtype="double")
+    points = initial_points.copy()
+
+    def unpack_intrinsics(intrinsic_params):
+        unpacked = [
+            set_intrinsic_params(
+                np.asarray(camera_intrinsics[group], dtype="double"),
+                np.asarray(distortion_coefficients[group], dtype="double"),
+                intrinsic_names,
+                intrinsic_params[group],
+            )
+            for group in range(ngroups)
+        ]
+        return [K for K, _ in unpacked], [dist for _, dist in unpacked]
+
+    def evaluate(poses, intrinsic_params, points):
+        intrinsics, distortions = unpack_intrinsics(intrinsic_params)
+        residuals, A, B = linearise(
+            problem,
+            poses,
+            camera_groups,
+            intrinsics,
+            distortions,
+            points,
+            observations_point,
+            observations_2d,
+        )
+        prior_residuals = point_weight * (
+            points[free_points] - initial_points[free_points]
+        )
+        cost = np.sum(np.square(residuals)) + np.sum(
+            np.square(prior_residuals)
+        )
+        return cost, residuals, prior_residuals, A, B
+
+    cost, residuals, prior_residuals, A, B = evaluate(
+        poses, intrinsic_params, points
+    )
+    initial_rms = float(np.sqrt(np.mean(np.sum(np.square(residuals), axis=1))))
+
+    damping = 1e-3
+    iteration = 0
+    free = problem.free_observations
+    free_point = problem.free_observations_point
+    param_indices = problem.param_indices
+
+    for iteration in range(1, max_iterations + 1):
+        # Camera block of the normal equations (U) and gradient
+        U = np.zeros((problem.ncamera_params, problem.ncamera_params))
+        np.add.at(
+            U,
+            (param_indices[:, :, None], param_indices[:, None, :]),
+            np.einsum("nji,njk->nik", A, A),
+        )
+        camera_gradient = np.zeros(problem.ncamera_params)
+        np.add.at(
+            camera_gradient,
+            param_indices,
+            -np.einsum("nji,nj->ni", A, residuals),
+        )
+
+        # Point blocks (V), gradient and camera-point coupling (W)
+        V = np.zeros((problem.nfree_points, 3, 3))
+        V += point_weight**2 * np.eye(3)
+        np.add.at(V, free_point, np.einsum("nji,njk->nik", B[free], B[free]))
+        point_gradient = -point_weight * prior_residuals
+        np.add.at(
+            point_gradient,
+            free_point,
+            -np.einsum("nji,nj->ni", B[free], residuals[free]),
+        )
+        W = np.einsum("nji,njk->nik", A[free], B[free])
+
+        while True:
+            # Levenberg-Marquardt damping of the diagonal
+            U_damped = U + damping * np.diag(np.diag(U) + 1e-9)
+            V_diagonal = np.einsum("nii->ni", V) + 1e-9
+            V_damped = V + damping * V_diagonal[:, :, None] * np.eye(3)
+            V_inverse = np.linalg.inv(V_damped)
+
+            # Eliminate points with the Schur complement
+            Y = W @ V_inverse[free_point]
+            S = U_damped.copy()
+            np.add.at(
+                S,
+                (
+                    param_indices[free][problem.pairs_first][:, :, None],
+                    param_indices[free][problem.pairs_second][:, None, :],
+                ),
+                -Y[problem.pairs_first]
+                @ W[problem.pairs_second].transpose(0, 2, 1),
+            )
+            reduced_gradient = camera_gradient.copy()
+            np.add.at(
+                reduced_gradient,
+                param_indices[free],
+                -np.einsum("nij,nj->ni", Y, point_gradient[free_point]),
+            )
+
+            try:
+                camera_step = np.linalg.solve(S, reduced_gradient)
+            except np.linalg.LinAlgError:
+                camera_step = np.linalg.lstsq(S, reduced_gradient, rcond=None)[
+                    0
+                ]
+
+            # Back-substitute to get the point step
+            point_rhs = point_gradient.copy()
+            np.add.at(
+                point_rhs,
+                free_point,
+                -np.einsum(
+                    "nij,ni->nj", W, camera_step[param_indices[free]]
+                ),
+            )
+            point_step = np.einsum("nij,nj->ni", V_inverse, point_rhs)
+
+            new_poses = poses + camera_step[: 6 * ncameras].reshape(-1, 6)
+            new_intrinsic_params = intrinsic_params + camera_step[
+                6 * ncameras :
+            ].reshape(ngroups, nintrinsics)
+            new_points = points.copy()
+            new_points[free_points] += point_step
+
+            (
+                new_cost,
+                new_residuals,
+                new_prior_residuals,
+                new_A,
+                new_B,
+            ) = evaluate(new_poses, new_intrinsic_params, new_points)
+
+            if new_cost < cost:
+                break
+
+            damping *= 10
+            if damping > 1e10:
+                break
+
+        if new_cost >= cost:
+            # No step reduces the error any further
+            break
+
+        relative_decrease = (cost - new_cost) / cost
+        poses, intrinsic_params, points = (
+            new_poses,
+            new_intrinsic_params,
+            new_points,
+        )
+        cost, residuals, prior_residuals, A, B = (
+            new_cost,
+            new_residuals,
+            new_prior_residuals,
+            new_A,
+            new_B,
+        )
+        damping = max(damping / 10, 1e-9)
+
+        if relative_decrease < tolerance:
+            break
+
+    intrinsics, distortions = unpack_intrinsics(intrinsic_params)
+    final_rms = float(np.sqrt(np.mean(np.sum(np.square(residuals), axis=1))))
+
+    return BundleResult(
+        rvecs=poses[:, :3],
+        tvecs=poses[:, 3:],
+        camera_intrinsics=intrinsics,
+        distortion_coefficients=distortions,
+        points_3d_coords=points,
+        initial_rms=initial_rms,
+        final_rms=final_rms,
+        iterations=iteration,
+    )
@@ -0,0 +1,99 @@
+""" Bounded least-recently-used cache of solver results. Results are keyed
+by a hash of the solver inputs (point coordinates, intrinsics, distortion
+and solver options), so a result is only reused when all inputs are
+unchanged. Only depends on numpy (not bpy). """
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Maximum number of results kept, over all images
+MAX_CACHED_RESULTS = 256
+
+
+def get_inputs_key(*snapshots, options=None):
+    """Get a hash of the solver inputs in the given image snapshots and
+    options
+
+    Args:
+        snapshots: solver.ImageSnapshots that are solved together
+        options: solver options - a solver.SolverOptions, or calibration
+            flags. Warm-start guesses and the previous error are included, as
+            they decide whether the warm-started pose is returned.
+
+    Returns:
+        Bytes digest of the inputs
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+
+    for snapshot in snapshots:
+        for array in (
+            snapshot.points_3d_coords,
+            snapshot.points_2d_coords,
+            snapshot.camera_intrinsics,
+            snapshot.distortion_coefficients,
+        ):
+            array = np.ascontiguousarray(array, dtype="double")
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(repr(tuple(snapshot.image_size)).encode())
+
+    digest.update(repr(options).encode())
+
+    return digest.digest()
+
+
+class ResultCache:
+    """Least-recently-used cache of results for each image match. Entries
+    are keyed by image name, type of result (e.g. "pose" or "calibration")
+    and inputs key (see get_inputs_key)."""
+
+    def __init__(self, max_entries=MAX_CACHED_RESULTS):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, image_name, result_type, inputs_key):
+        """Get cached result, or None if there isn't one"""
+
+        entry_key = (image_name, result_type, inputs_key)
+        result = self.entries.get(entry_key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(entry_key)
+        return result
+
+    def put(self, image_name, result_type, inputs_key, result):
+        """Add result to the cache, evicting the least recently used
+        entries if it's full"""
+
+        entry_key = (image_name, result_type, inputs_key)
+        self.entries[entry_key] = result
+        self.entries.move_to_end(entry_key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, image_name=None):
+        """Remove all results for the given image name (or all results, if
+        no name is given)"""
+
+        if image_name is None:
+            self.entries.clear()
+            return
+
+        for entry_key in [
+            key for key in self.entries if key[0] == image_name
+        ]:
+            del self.entries[entry_key]
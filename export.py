@@ -3,6 +3,7 @@ from bpy.types import Operator
 from mathutils import Vector, Quaternion
 import json
 import math
+from . import raycast
 
 
 def get_camera_position(camera_object, three_js=False):
@@ -107,7 +108,8 @@ def calculate_camera_intersection(camera_object, model, three_js):
         three_js: Exports for three-js if true, otherwise for Blender.
 
     Returns:
-        3D point as [X, Y, Z]
+        3D point as [X, Y, Z], or None if the camera's central ray misses
+        the model
     """
 
     # vector along direction camera points
@@ -115,19 +117,16 @@ def calculate_camera_intersection(camera_object, model, three_js):
     camera_direction.rotate(camera_object.rotation_euler)
     camera_direction.normalize()
 
-    # get the position/direction relative to the model
+    # Get hit position (the ray is moved relative to the model, and cast
+    # against its cached BVH tree)
     matrix = model.matrix_world.copy()
-    matrix_inv = matrix.inverted()
     ray_origin = camera_object.location
     ray_target = ray_origin + camera_direction
-    
-    ray_origin_obj = matrix_inv @ ray_origin
-    ray_target_obj = matrix_inv @ ray_target
-    ray_direction_obj = ray_target_obj - ray_origin_obj
-
-    # Get hit position
-    cast_result = model.ray_cast(ray_origin_obj, ray_direction_obj)
-    hit_position = matrix @ cast_result[1]
+
+    hit, _, _ = raycast.model_ray_cast(ray_origin, ray_target, model, matrix)
+    if hit is None:
+        return None
+    hit_position = matrix @ hit
 
     if three_js:
         # Account for Y-UP axis orientation
@@ -0,0 +1,280 @@
+""" Feature detection and matching functions that only depend on numpy and
+OpenCV (not bpy). Used to transfer 2D points from already matched images to
+a new, overlapping image. """
+
+from dataclasses import dataclass
+
+import cv2 as cv
+import numpy as np
+
+
+# Images are downscaled so their largest side is at most this many pixels
+# before detecting features (coordinates are scaled back to full size)
+MAX_FEATURE_IMAGE_SIZE = 2048
+
+# FLANN index parameters - KD-trees for float descriptors (SIFT), and
+# locality sensitive hashing for binary descriptors (ORB, AKAZE)
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+
+@dataclass(slots=True, frozen=True)
+class ImageFeatures:
+    """Keypoints and descriptors of one image
+
+    Attributes:
+        keypoints: numpy array of keypoint coordinates (in full size image
+            pixels)
+        descriptors: numpy array of descriptors, one row per keypoint
+        is_binary: whether descriptors are binary (compared by Hamming
+            distance) rather than float
+    """
+
+    keypoints: np.ndarray
+    descriptors: np.ndarray
+    is_binary: bool
+
+    @property
+    def nfeatures(self):
+        return self.keypoints.shape[0]
+
+
+def load_grayscale_image(filepath):
+    """Load an image (or the first frame of a video) as a grayscale numpy
+    array. Returns None if it can't be read."""
+
+    image = cv.imread(filepath, cv.IMREAD_GRAYSCALE)
+    if image is not None:
+        return image
+
+    capture = cv.VideoCapture(filepath)
+    success, frame = capture.read()
+    capture.release()
+    if not success:
+        return None
+
+    return cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+
+
+def create_detector(detector_name, max_features):
+    """Create OpenCV feature detector - "ORB", "SIFT" or "AKAZE" """
+
+    if detector_name == "SIFT":
+        return cv.SIFT_create(nfeatures=max_features)
+    if detector_name == "AKAZE":
+        return cv.AKAZE_create()
+
+    return cv.ORB_create(nfeatures=max_features)
+
+
+def detect_features(image, detector_name="ORB", max_features=5000):
+    """Detect keypoints and compute their descriptors
+
+    Args:
+        image: grayscale numpy array of the image
+        detector_name: "ORB", "SIFT" or "AKAZE"
+        max_features: maximum number of features to keep
+
+    Returns:
+        ImageFeatures of the image
+    """
+
+    scale = min(1.0, MAX_FEATURE_IMAGE_SIZE / max(image.shape))
+    if scale < 1.0:
+        image = cv.resize(
+            image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA
+        )
+
+    detector = create_detector(detector_name, max_features)
+    keypoints, descriptors = detector.detectAndCompute(image, None)
+
+    is_binary = detector_name != "SIFT"
+    if descriptors is None:
+        return ImageFeatures(
+            np.zeros((0, 2), dtype=np.float32),
+            np.zeros((0, 32), dtype=np.uint8 if is_binary else np.float32),
+            is_binary,
+        )
+
+    # AKAZE has no limit on the number of features, so keep the strongest
+    if len(keypoints) > max_features:
+        strongest = np.argsort([-keypoint.response for keypoint in keypoints])
+        strongest = strongest[:max_features]
+        keypoints = [keypoints[i] for i in strongest]
+        descriptors = descriptors[strongest]
+
+    coordinates = np.array(
+        [keypoint.pt for keypoint in keypoints], dtype=np.float32
+    )
+
+    return ImageFeatures(coordinates / scale, descriptors, is_binary)
+
+
+def create_matcher(is_binary):
+    """Create FLANN matcher suitable for binary or float descriptors"""
+
+    if is_binary:
+        index_params = {
+            "algorithm": FLANN_INDEX_LSH,
+            "table_number": 6,
+            "key_size": 12,
+            "multi_probe_level": 1,
+        }
+    else:
+        index_params = {"algorithm": FLANN_INDEX_KDTREE, "trees": 5}
+
+    return cv.FlannBasedMatcher(index_params, {"checks": 50})
+
+
+def create_trained_matcher(image_features):
+    """Create FLANN matcher with its index built for the descriptors of one
+    image, so it can be matched against many other images without
+    rebuilding the index each time"""
+
+    matcher = create_matcher(image_features.is_binary)
+    matcher.add([image_features.descriptors])
+    matcher.train()
+
+    return matcher
+
+
+def match_features(features_a, features_b, ratio=0.75, matcher_b=None):
+    """Match features of two images with FLANN, keeping only matches that
+    pass Lowe's ratio test
+
+    Args:
+        features_a: ImageFeatures of image a
+        features_b: ImageFeatures of image b
+        ratio: maximum ratio of the distances to the nearest and second
+            nearest match
+        matcher_b: matcher from create_trained_matcher for features_b, or
+            None to build a new index
+
+    Returns:
+        Two numpy arrays of matched keypoint coordinates - in image a, and
+        in image b
+    """
+
+    empty = np.zeros((0, 2), dtype=np.float32)
+    if features_a.nfeatures < 2 or features_b.nfeatures < 2:
+        return empty, empty
+
+    if matcher_b is None:
+        matcher_b = create_trained_matcher(features_b)
+    knn_matches = matcher_b.knnMatch(features_a.descriptors, k=2)
+
+    # LSH can return fewer than 2 neighbours for some descriptors
+    good_matches = [
+        match[0]
+        for match in knn_matches
+        if len(match) == 2 and match[0].distance < ratio * match[1].distance
+    ]
+    if not good_matches:
+        return empty, empty
+
+    indices_a = np.array([match.queryIdx for match in good_matches])
+    indices_b = np.array([match.trainIdx for match in good_matches])
+
+    return features_a.keypoints[indices_a], features_b.keypoints[indices_b]
+
+
+def transfer_points(
+    points_2d_coords,
+    matched_a,
+    matched_b,
+    image_size,
+    method="HOMOGRAPHY",
+    threshold=4.0,
+    support_radius=100.0,
+    min_inliers=15,
+):
+    """Transfer 2D points from image a to image b, using the feature matches
+    between them
+
+    With "HOMOGRAPHY", points are mapped by a homography fitted to the
+    matches (best when the images are related by a camera rotation, or show
+    a mostly planar surface). With "FUNDAMENTAL", a fundamental matrix is
+    fitted instead, and each point is moved by the median offset of its
+    nearby matches, then checked against its epipolar line. In both cases,
+    only points with at least 3 inlier matches within support_radius are
+    transferred, so points outside the overlap of the images are skipped.
+
+    Args:
+        points_2d_coords: numpy array of 2D point coordinates in image a
+        matched_a: numpy array of matched keypoint coordinates in image a
+        matched_b: numpy array of matched keypoint coordinates in image b
+        image_size: (width, height) of image b in pixels
+        method: "HOMOGRAPHY" or "FUNDAMENTAL"
+        threshold: maximum RANSAC reprojection / epipolar error in pixels
+        support_radius: radius (in pixels of image a) to look for
+            supporting matches around each point
+        min_inliers: minimum number of RANSAC inlier matches to transfer any
+            points
+
+    Returns:
+        transferred - numpy array of 2D point coordinates in image b
+        valid - boolean numpy array, true for each successfully transferred
+            point
+        ninliers - number of RANSAC inlier matches
+    """
+
+    npoints = points_2d_coords.shape[0]
+    transferred = np.zeros((npoints, 2))
+    valid = np.zeros(npoints, dtype=bool)
+
+    if npoints == 0 or matched_a.shape[0] < max(min_inliers, 8):
+        return transferred, valid, 0
+
+    if method == "FUNDAMENTAL":
+        model, mask = cv.findFundamentalMat(
+            matched_a, matched_b, cv.FM_RANSAC, threshold, 0.99
+        )
+    else:
+        model, mask = cv.findHomography(
+            matched_a, matched_b, cv.RANSAC, threshold
+        )
+
+    if model is None or model.shape != (3, 3):
+        return transferred, valid, 0
+
+    inliers = mask.ravel().astype(bool)
+    ninliers = int(np.sum(inliers))
+    if ninliers < min_inliers:
+        return transferred, valid, ninliers
+
+    inliers_a = matched_a[inliers].astype("double")
+    inliers_b = matched_b[inliers].astype("double")
+
+    # Distance from every point to every inlier match
+    distances = np.linalg.norm(
+        points_2d_coords[:, None, :] - inliers_a[None, :, :], axis=2
+    )
+    is_nearby = distances < support_radius
+    valid = np.sum(is_nearby, axis=1) >= 3
+
+    if method == "FUNDAMENTAL":
+        offsets = inliers_b - inliers_a
+        for i in np.flatnonzero(valid):
+            transferred[i] = points_2d_coords[i] + np.median(
+                offsets[is_nearby[i]], axis=0
+            )
+
+        # Reject points that end up too far from their epipolar line
+        lines = cv.computeCorrespondEpilines(
+            points_2d_coords.reshape(-1, 1, 2), 1, model
+        ).reshape(-1, 3)
+        epipolar_distance = np.abs(
+            np.sum(lines[:, :2] * transferred, axis=1) + lines[:, 2]
+        ) / np.linalg.norm(lines[:, :2], axis=1)
+        valid &= epipolar_distance < threshold * 2
+    else:
+        transferred = cv.perspectiveTransform(
+            points_2d_coords.reshape(-1, 1, 2), model
+        ).reshape(-1, 2)
+
+    within_image = np.all(
+        (transferred >= 0) & (transferred < np.asarray(image_size)), axis=1
+    )
+    valid &= within_image
+
+    return transferred, valid, ninliers
@@ -1,7 +1,45 @@
 import bpy
+import heapq
 import os
+import time
+import numpy as np
 from bpy_extras import view3d_utils
 from mathutils import Vector
+from . import imageinfo
+from . import props
+from . import raycast
+
+
+# JPEG quality of downsampled proxy images
+PROXY_QUALITY = 90
+
+# Seconds between checks for finished proxy builds, and seconds after which
+# a build that hasn't written its proxy is given up on (cancelled / failed)
+PROXY_CHECK_INTERVAL = 1.0
+PROXY_BUILD_TIMEOUT = 300.0
+
+# Size of marker grid cells, from 0 to 1 of the image size
+MARKER_GRID_CELL_SIZE = 0.05
+
+# Marker grid of each movie clip (by name)
+marker_grids = {}
+
+# Track name -> index of its point match, and 3D point (empty) name ->
+# index of its point match, for each image match (by name)
+point_2d_indices = {}
+point_3d_indices = {}
+
+# Names of image matches whose individually hidden 3D points (from files
+# saved by older versions) have been shown again this session
+images_with_points_shown = set()
+
+# Names of image matches whose proxy is being built -> (proxy size being
+# built, time the build started), see apply_built_proxies
+pending_proxy_builds = {}
+
+# Heaps of indices of point matches missing a 2D point, and missing a 3D
+# point, for each image match (by name)
+open_point_slots = {}
 
 
 def open_movie_clip(movie_clip):
@@ -17,13 +55,288 @@ def check_if_image_already_added(context, image_filename):
     added. Have to check against the saved full name, as Blender
     shortens filenames over a certain character limit"""
     settings = context.scene.match_settings
-    for image in settings.image_matches:
-        if image_filename == image.full_name:
-            return True
+    image_match = props.find_image_match(
+        settings, image_filename, by_full_name=True
+    )
+
+    return image_match is not None
+
+
+def get_result_collection(context, settings):
+    """Get collection to hold all image match results, creating it if it
+    doesn't already exist"""
+
+    result_collection = settings.image_match_collection
+    if result_collection is None:
+        collection_name = settings.image_match_collection_name
+        result_collection = bpy.data.collections.new(collection_name)
+        context.scene.collection.children.link(result_collection)
+        settings.image_match_collection = result_collection
+
+    return result_collection
+
+
+def set_camera_from_image_info(clip_camera, image_info):
+    """Set sensor width and focal length of a tracking camera from the 35mm
+    equivalent focal length in an image's EXIF data (if it has one)"""
+
+    if image_info is None:
+        return
+
+    sensor_width = image_info.get_sensor_width()
+    if sensor_width is None:
+        return
+
+    clip_camera.sensor_width = sensor_width
+    clip_camera.focal_length = image_info.focal_length_35mm
+
+
+def add_image_match(settings, result_collection, filepath, image_info=None):
+    """Load an image, and create its image match (with a movie clip,
+    collections, camera and background image)
+
+    Args:
+        settings: image match settings
+        result_collection: collection holding all image match results
+        filepath: path of the image file
+        image_info: imageinfo.ImageInfo of the image, or None. If given (and
+            use_exif_focal_length is on), it's used to set the focal length.
+
+    Returns:
+        The new image match
+
+    Raises:
+        RuntimeError: if Blender can't load the image
+    """
+
+    movie_clip = bpy.data.movieclips.load(filepath)
+    # Blender may shorten the name if it is over a certain number
+    # of characters
+    short_name = movie_clip.name
+
+    # Fake user so clip won't be deleted if not referenced in blend file
+    movie_clip.use_fake_user = True
+
+    if settings.use_exif_focal_length:
+        set_camera_from_image_info(movie_clip.tracking.camera, image_info)
+
+    # Collection for this specific image
+    image_collection = bpy.data.collections.new(short_name)
+    result_collection.children.link(image_collection)
+
+    # Collection for 3D points
+    point_collection = bpy.data.collections.new(
+        settings.points_3d_collection_name
+    )
+    image_collection.children.link(point_collection)
+
+    camera_data = bpy.data.cameras.new(name="Camera")
+    camera_data.show_background_images = True
+
+    # Set up background image
+    if not camera_data.background_images:
+        background_image = camera_data.background_images.new()
+    else:
+        background_image = camera_data.background_images[0]
+    background_image.source = "MOVIE_CLIP"
+    background_image.clip = movie_clip
+    background_image.frame_method = "FIT"
+    background_image.display_depth = "FRONT"
+    background_image.clip_user.use_render_undistorted = True
 
+    camera_object = bpy.data.objects.new("Camera", camera_data)
+    image_collection.objects.link(camera_object)
+
+    image_match = settings.image_matches.add()
+    image_match.name = short_name
+    image_match.full_name = os.path.basename(os.path.normpath(filepath))
+    image_match.movie_clip = movie_clip
+    image_match.camera = camera_object
+    image_match.image_collection = image_collection
+    image_match.points_3d_collection = point_collection
+
+    return image_match
+
+
+def get_proxy_render_size(settings, clip):
+    """Get size to display the clip at - one of its proxy sizes if proxies
+    are enabled and the clip is large enough, otherwise "FULL" """
+
+    if not settings.use_proxies or max(clip.size) < settings.proxy_min_size:
+        return "FULL"
+
+    return f"PROXY_{settings.proxy_size}"
+
+
+def set_proxy_render_size(image_match, render_size):
+    """Display the image match's clip at render_size, in all clip editors
+    showing it and in its camera's background"""
+
+    clip = image_match.movie_clip
+
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "CLIP_EDITOR" and area.spaces.active.clip == clip:
+                area.spaces.active.clip_user.proxy_render_size = render_size
+
+    camera_data = image_match.camera.data
+    if camera_data.background_images:
+        background_image = camera_data.background_images[0]
+        background_image.clip_user.proxy_render_size = render_size
+
+
+def get_proxy_directory(clip, proxy_size):
+    """Get directory Blender writes the clip's proxy images of the given size
+    (e.g. "50") to - in BL_proxy next to the image, unless the clip uses a
+    custom proxy directory"""
+
+    clip_directory, clip_filename = os.path.split(
+        bpy.path.abspath(clip.filepath)
+    )
+    if clip.use_proxy_custom_directory:
+        proxy_directory = bpy.path.abspath(clip.proxy.directory)
+    else:
+        proxy_directory = os.path.join(clip_directory, "BL_proxy")
+
+    return os.path.join(proxy_directory, clip_filename, f"proxy_{proxy_size}")
+
+
+def is_proxy_built(clip, proxy_size):
+    """Check if a proxy image of the given size has been written for the
+    clip"""
+
+    try:
+        with os.scandir(get_proxy_directory(clip, proxy_size)) as entries:
+            return any(entry.name.endswith(".jpg") for entry in entries)
+    except OSError:
+        return False
+
+
+def apply_built_proxies():
+    """Timer that switches images to their proxy once its build has finished
+    (proxies are built by a background job). Images stay at full size until
+    their proxy file exists, so a cancelled / failed build is never recorded
+    as built.
+
+    Returns:
+        Seconds until the next check, or None once no builds are pending
+    """
+
+    settings = bpy.context.scene.match_settings
+
+    for name, (proxy_size, start_time) in list(pending_proxy_builds.items()):
+        image_match = props.find_image_match(settings, name)
+        if image_match is None or proxy_size != settings.proxy_size:
+            del pending_proxy_builds[name]
+        elif is_proxy_built(image_match.movie_clip, proxy_size):
+            image_match.proxy_size = proxy_size
+            set_proxy_render_size(
+                image_match,
+                get_proxy_render_size(settings, image_match.movie_clip),
+            )
+            del pending_proxy_builds[name]
+        elif time.perf_counter() - start_time > PROXY_BUILD_TIMEOUT:
+            # Build was cancelled or failed - it's started again the next
+            # time the image is made current
+            del pending_proxy_builds[name]
+
+    return PROXY_CHECK_INTERVAL if pending_proxy_builds else None
+
+
+def update_image_proxy(context, settings, image_match):
+    """Display the image match's clip with a downsampled proxy (if enabled in
+    the settings, and the image is large enough). The proxy is built by
+    Blender the first time it's needed, and stored next to the image - so
+    later swaps to this image are fast. The image is shown at full size until
+    the proxy has been written. Marker coordinates are always in the full
+    size image, whatever the display size.
+
+    Returns:
+        True if a proxy build was started
+    """
+
+    clip = image_match.movie_clip
+    render_size = get_proxy_render_size(settings, clip)
+
+    if render_size == "FULL":
+        clip.use_proxy = False
+        set_proxy_render_size(image_match, "FULL")
+        return False
+
+    clip.use_proxy = True
+    clip.proxy.quality = PROXY_QUALITY
+    setattr(clip.proxy, f"build_{settings.proxy_size}", True)
+    setattr(clip.proxy, f"build_undistorted_{settings.proxy_size}", True)
+
+    if image_match.proxy_size != settings.proxy_size:
+        # The proxy may have been built in an earlier session, or by a build
+        # that finished since the image was last current
+        if is_proxy_built(clip, settings.proxy_size):
+            image_match.proxy_size = settings.proxy_size
+        else:
+            set_proxy_render_size(image_match, "FULL")
+            return start_proxy_build(context, settings, image_match)
+
+    set_proxy_render_size(image_match, render_size)
     return False
 
 
+def start_proxy_build(context, settings, image_match):
+    """Start building the proxy of the image match's clip, and check for it
+    to finish with apply_built_proxies
+
+    Returns:
+        True if a proxy build was started
+    """
+
+    pending_build = pending_proxy_builds.get(image_match.name)
+    if pending_build is not None and pending_build[0] == settings.proxy_size:
+        return False
+
+    # Proxies are built for the clip shown in the clip editor
+    window_clip, area_clip, region_clip = find_area(context, "CLIP_EDITOR")
+    if (
+        area_clip is None
+        or area_clip.spaces.active.clip != image_match.movie_clip
+    ):
+        return False
+
+    with context.temp_override(
+        window=window_clip, area=area_clip, region=region_clip
+    ):
+        bpy.ops.clip.rebuild_proxy()
+
+    pending_proxy_builds[image_match.name] = (
+        settings.proxy_size,
+        time.perf_counter(),
+    )
+    if not bpy.app.timers.is_registered(apply_built_proxies):
+        bpy.app.timers.register(
+            apply_built_proxies, first_interval=PROXY_CHECK_INTERVAL
+        )
+
+    return True
+
+
+def set_current_image(context, settings, image_match):
+    """Make image_match the current image - open it in the clip editor, show
+    only its 3D points and make its camera active"""
+
+    open_movie_clip(image_match.movie_clip)
+    update_image_proxy(context, settings, image_match)
+
+    # Hide any currently shown 3D points
+    swap_point_matches(
+        context.view_layer,
+        settings,
+        settings.current_image_name,
+        image_match.name,
+    )
+    settings.current_image_name = image_match.name
+
+    context.scene.camera = image_match.camera
+
+
 class IMAGE_OT_add_image(bpy.types.Operator):
     """Add a new image"""
 
@@ -32,15 +345,6 @@ class IMAGE_OT_add_image(bpy.types.Operator):
 
     def execute(self, context):
         settings = context.scene.match_settings
-        result_collection = settings.image_match_collection
-
-        # Create collection to hold all image match results
-        # (if doesn't already exist)
-        if result_collection is None:
-            collection_name = settings.image_match_collection_name
-            result_collection = bpy.data.collections.new(collection_name)
-            context.scene.collection.children.link(result_collection)
-            settings.image_match_collection = result_collection
 
         if settings.image_filepath == "":
             self.report({"ERROR"}, "Please input image filepath")
@@ -53,56 +357,117 @@ class IMAGE_OT_add_image(bpy.types.Operator):
             self.report({"ERROR"}, "Image of same name already loaded")
             return {"CANCELLED"}
 
-        movie_clip = bpy.data.movieclips.load(settings.image_filepath)
-        # Blender may shorten the name if it is over a certain number
-        # of characters
-        short_name = movie_clip.name
+        # Create collection to hold all image match results
+        # (if doesn't already exist)
+        result_collection = get_result_collection(context, settings)
+
+        image_match = add_image_match(
+            settings,
+            result_collection,
+            settings.image_filepath,
+            imageinfo.read_image_info(absolute_image_path),
+        )
+        set_current_image(context, settings, image_match)
+
+        return {"FINISHED"}
 
-        # Fake user so clip won't be deleted if not referenced in blend file
-        movie_clip.use_fake_user = True
 
-        open_movie_clip(movie_clip)
+class IMAGE_OT_add_images(bpy.types.Operator):
+    """Add all selected images (or every image in the folder, if none are
+    selected)"""
 
-        # Collection for this specific image
-        image_collection = bpy.data.collections.new(short_name)
-        result_collection.children.link(image_collection)
+    bl_idname = "imagematches.add_images"
+    bl_label = "Add images"
 
-        # Collection for 3D points
-        point_collection = bpy.data.collections.new(
-            settings.points_3d_collection_name
+    directory: bpy.props.StringProperty(subtype="DIR_PATH")
+
+    files: bpy.props.CollectionProperty(
+        type=bpy.types.OperatorFileListElement
+    )
+
+    filter_image: bpy.props.BoolProperty(default=True, options={"HIDDEN"})
+    filter_movie: bpy.props.BoolProperty(default=True, options={"HIDDEN"})
+    filter_folder: bpy.props.BoolProperty(default=True, options={"HIDDEN"})
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {"RUNNING_MODAL"}
+
+    def get_filenames(self, directory):
+        """Get names of the selected files, or of every image / movie in
+        directory (the absolute path of self.directory) if none are
+        selected"""
+
+        filenames = [file.name for file in self.files if file.name != ""]
+        if filenames:
+            return filenames
+
+        extensions = bpy.path.extensions_image | bpy.path.extensions_movie
+        return sorted(
+            filename
+            for filename in os.listdir(directory)
+            if os.path.splitext(filename)[1].lower() in extensions
+            and os.path.isfile(os.path.join(directory, filename))
         )
-        image_collection.children.link(point_collection)
 
-        camera_data = bpy.data.cameras.new(name="Camera")
-        camera_data.show_background_images = True
+    def execute(self, context):
+        settings = context.scene.match_settings
+        start_time = time.perf_counter()
 
-        # Set up background image
-        if not camera_data.background_images:
-            background_image = camera_data.background_images.new()
-        else:
-            background_image = camera_data.background_images[0]
-        background_image.source = "MOVIE_CLIP"
-        background_image.clip = movie_clip
-        background_image.frame_method = "FIT"
-        background_image.display_depth = "FRONT"
-        background_image.clip_user.use_render_undistorted = True
-
-        camera_object = bpy.data.objects.new("Camera", camera_data)
-        image_collection.objects.link(camera_object)
-        context.scene.camera = camera_object
-
-        image_match = settings.image_matches.add()
-        image_match.name = short_name
-        image_match.full_name = image_filename
-        image_match.movie_clip = movie_clip
-        image_match.camera = camera_object
-        image_match.image_collection = image_collection
-        image_match.points_3d_collection = point_collection
-
-        # Hide any currently shown 3D points
-        swap_point_matches(settings.image_matches,
-                           settings.current_image_name, image_match.name)
-        settings.current_image_name = image_match.name
+        directory = bpy.path.abspath(self.directory)
+        if not os.path.isdir(directory):
+            self.report({"ERROR"}, "Please select a folder or images")
+            return {"CANCELLED"}
+
+        # Skip images that are already loaded (or selected twice)
+        filenames = []
+        seen_filenames = set()
+        nduplicates = 0
+        for filename in self.get_filenames(directory):
+            if filename in seen_filenames or check_if_image_already_added(
+                context, filename
+            ):
+                nduplicates += 1
+            else:
+                filenames.append(filename)
+                seen_filenames.add(filename)
+
+        filepaths = [
+            os.path.join(directory, filename) for filename in filenames
+        ]
+
+        # Read headers in parallel, then create all datablocks
+        image_infos = imageinfo.read_image_infos(filepaths)
+        result_collection = get_result_collection(context, settings)
+
+        image_match = None
+        nfailed = 0
+        for filepath, image_info in zip(filepaths, image_infos):
+            if image_info is None:
+                nfailed += 1
+                continue
+
+            try:
+                image_match = add_image_match(
+                    settings, result_collection, filepath, image_info
+                )
+            except RuntimeError:
+                nfailed += 1
+
+        if image_match is None:
+            self.report({"ERROR"}, "No new images could be added")
+            return {"CANCELLED"}
+
+        set_current_image(context, settings, image_match)
+
+        elapsed_time = time.perf_counter() - start_time
+        nadded = len(filepaths) - nfailed
+        message = f"Added {nadded} images in {elapsed_time:.1f} s"
+        if nduplicates > 0:
+            message += f", {nduplicates} already loaded"
+        if nfailed > 0:
+            message += f", {nfailed} couldn't be read"
+        self.report({"INFO"}, message)
 
         return {"FINISHED"}
 
@@ -120,18 +485,12 @@ class IMAGE_OT_swap_image(bpy.types.Operator):
     def execute(self, context):
         settings = context.scene.match_settings
 
-        if self.image_name not in settings.image_matches:
+        image_match = props.find_image_match(settings, self.image_name)
+        if image_match is None:
             self.report({"ERROR"}, "Image doesn't exist")
             return {"CANCELLED"}
 
-        image_match = settings.image_matches[self.image_name]
-
-        open_movie_clip(image_match.movie_clip)
-        swap_point_matches(settings.image_matches,
-                           settings.current_image_name, self.image_name)
-        settings.current_image_name = self.image_name
-
-        context.scene.camera = image_match.camera
+        set_current_image(context, settings, image_match)
 
         return {"FINISHED"}
 
@@ -211,61 +570,435 @@ def empties_in_collection(collection):
 
 
 def obj_ray_cast(ray_origin, ray_target, obj, matrix):
-    """Wrapper for ray casting that moves the ray into object space"""
+    """Wrapper for ray casting that moves the ray into object space. Uses the
+    object's cached BVH tree, so repeated casts against large meshes are
+    fast."""
+
+    return raycast.model_ray_cast(ray_origin, ray_target, obj, matrix)
+
 
-    # get the ray relative to the object
-    matrix_inv = matrix.inverted()
-    ray_origin_obj = matrix_inv @ ray_origin
-    ray_target_obj = matrix_inv @ ray_target
-    ray_direction_obj = ray_target_obj - ray_origin_obj
+def locations_3d_to_region_2d(region, rv3d, locations):
+    """Project many 3D locations into 2D region coordinates at once (the same
+    as view3d_utils.location_3d_to_region_2d for each location)
 
-    # cast the ray
-    success, location, normal, face_index = obj.ray_cast(
-        ray_origin_obj, ray_direction_obj
+    Args:
+        region: Blender region of the 3D view
+        rv3d: Blender 3D view region data
+        locations: numpy array of 3D locations (one per row)
+
+    Returns:
+        region_coords - numpy array of 2D region coordinates
+        in_front - boolean numpy array, true for each location in front of
+            the view (region coordinates of other locations are meaningless)
+    """
+
+    perspective_matrix = np.array(rv3d.perspective_matrix, dtype="double")
+    projected = (
+        locations @ perspective_matrix[:3, :3].T + perspective_matrix[:3, 3]
     )
+    w = locations @ perspective_matrix[3, :3] + perspective_matrix[3, 3]
+
+    in_front = w > 0
+    w = np.where(in_front, w, 1)
+
+    half_size = np.array([region.width, region.height], dtype="double") / 2
+    region_coords = half_size + half_size * projected[:, :2] / w[:, None]
+
+    return region_coords, in_front
+
+
+def new_point_3d(settings, image_match, location):
+    """Create a new 3D point (spherical empty) at location, in the 3D points
+    collection of image_match"""
+
+    empty = bpy.data.objects.new("empty", None)
+    empty.empty_display_type = "SPHERE"
+    empty.empty_display_size = settings.point_3d_display_size
+    empty.location = location
+    image_match.points_3d_collection.objects.link(empty)
+
+    return empty
+
+
+def get_marker_bounds(track):
+    """Get bounding box of the pattern of a track's first marker, as
+    (min x, min y, max x, max y) from 0 to 1 on each axis of the image"""
+
+    marker = track.markers[0]
+    return (
+        marker.co[0] + marker.pattern_bound_box[0][0],
+        marker.co[1] + marker.pattern_bound_box[0][1],
+        marker.co[0] + marker.pattern_bound_box[1][0],
+        marker.co[1] + marker.pattern_bound_box[1][1],
+    )
+
+
+class MarkerGrid:
+    """Grid of the marker bounding boxes of one movie clip, so a click only
+    needs to be tested against markers in the same grid cell. Locked tracks
+    can't be moved in the clip editor, so they're stored in the grid - the
+    few unlocked tracks (e.g. predicted points) are always tested directly.
+    Results are checked against the current marker positions, so stale
+    entries are never returned - and a click that misses the grid falls back
+    to testing every track, so moved markers aren't missed."""
+
+    def __init__(self, tracks):
+        self.cells = {}
+        self.track_cells = {}
+        self.unlocked = set()
+
+        for track in tracks:
+            self.insert(track)
+
+    def __len__(self):
+        return len(self.track_cells) + len(self.unlocked)
+
+    def get_cells(self, bounds):
+        """Get all grid cells that overlap the given bounds"""
+
+        min_x, min_y, max_x, max_y = (
+            int(np.floor(bound / MARKER_GRID_CELL_SIZE)) for bound in bounds
+        )
+        return [
+            (x, y)
+            for x in range(min_x, max_x + 1)
+            for y in range(min_y, max_y + 1)
+        ]
+
+    def insert(self, track):
+        """Add (or update) track in the grid"""
+
+        self.remove(track.name)
+
+        if not track.lock:
+            self.unlocked.add(track.name)
+            return
+
+        cells = self.get_cells(get_marker_bounds(track))
+        self.track_cells[track.name] = cells
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(track.name)
+
+    def remove(self, track_name):
+        """Remove track from the grid, if it's there"""
+
+        self.unlocked.discard(track_name)
+
+        for cell in self.track_cells.pop(track_name, []):
+            self.cells[cell].discard(track_name)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def find(self, tracks, coordinates):
+        """Get names of all tracks whose marker bounding box contains the
+        given coordinates (from 0 to 1 on each axis of the image). If the
+        grid has no hit, every track is tested, in case a locked marker was
+        moved (e.g. unlocked, moved and locked again) - any tracks found are
+        re-inserted at their current position."""
+
+        cell = self.get_cells((*coordinates, *coordinates))[0]
+        candidates = self.cells.get(cell, set()) | self.unlocked
+
+        track_names = set()
+        for track_name in candidates:
+            track = tracks.get(track_name)
+            if track is not None and contains(
+                get_marker_bounds(track), coordinates
+            ):
+                track_names.add(track_name)
+        if track_names:
+            return track_names
+
+        for track in tracks:
+            if contains(get_marker_bounds(track), coordinates):
+                track_names.add(track.name)
+                self.insert(track)
+
+        return track_names
+
+
+def contains(bounds, coordinates):
+    """Is the point at coordinates inside bounds (min x, min y, max x,
+    max y)?"""
+
+    min_x, min_y, max_x, max_y = bounds
+    x, y = coordinates
+    return min_x <= x <= max_x and min_y <= y <= max_y
+
+
+def get_marker_grid(clip):
+    """Get marker grid of the clip. It's rebuilt if the number of tracks has
+    changed (e.g. tracks were added outside this addon), and on load / undo.
+    Hits are always checked against the current tracks by find."""
+
+    tracks = clip.tracking.objects[0].tracks
+    marker_grid = marker_grids.get(clip.name_full)
+
+    if marker_grid is None or len(marker_grid) != len(tracks):
+        marker_grid = MarkerGrid(tracks)
+        marker_grids[clip.name_full] = marker_grid
+
+    return marker_grid
+
+
+@bpy.app.handlers.persistent
+def clear_point_indices(*args):
+    """Load / undo handler that removes all marker grids, 2D point indices,
+    open point slots, shown image names and image match indices, so they're
+    rebuilt from the restored file"""
+
+    marker_grids.clear()
+    point_2d_indices.clear()
+    point_3d_indices.clear()
+    open_point_slots.clear()
+    images_with_points_shown.clear()
+    props.image_match_indices.clear()
+
+
+def register_handlers():
+    """Add the point index load / undo handlers"""
+
+    handlers = bpy.app.handlers
+    for handler_list in (
+        handlers.load_post,
+        handlers.undo_post,
+        handlers.redo_post,
+    ):
+        if clear_point_indices not in handler_list:
+            handler_list.append(clear_point_indices)
+
+
+def unregister_handlers():
+    """Remove the point index load / undo handlers, and all point indices"""
+
+    handlers = bpy.app.handlers
+    for handler_list in (
+        handlers.load_post,
+        handlers.undo_post,
+        handlers.redo_post,
+    ):
+        if clear_point_indices in handler_list:
+            handler_list.remove(clear_point_indices)
+
+    if bpy.app.timers.is_registered(apply_built_proxies):
+        bpy.app.timers.unregister(apply_built_proxies)
+    pending_proxy_builds.clear()
+
+    clear_point_indices()
+
+
+def new_point_2d(clip, frame, coordinates, lock=True):
+    """Create a new 2D point (track with a single marker) on the clip
+
+    Args:
+        clip: Blender movie clip
+        frame: frame to add the marker on
+        coordinates: position of the marker, from 0 to 1 on each axis of the
+            image
+        lock: whether to lock the track, so it can't be moved
+
+    Returns:
+        The new track
+    """
+
+    marker_grid = get_marker_grid(clip)
+
+    tracks = clip.tracking.objects[0].tracks
+    track = tracks.new(name="", frame=frame)
+    track.markers[0].co = Vector((coordinates[0], coordinates[1]))
+    track.lock = lock
+
+    marker_grid.insert(track)
+
+    return track
+
+
+def get_open_point_slots(image_match):
+    """Get heaps of indices of point matches missing a 2D point, and missing
+    a 3D point, for the image match (built from its point matches if needed).
+    Heaps may contain indices that have been filled since - these are skipped
+    by find_next_point."""
+
+    slots = open_point_slots.get(image_match.name)
+    if slots is not None:
+        return slots
+
+    point_matches = image_match.point_matches
+    npoints = len(point_matches)
+    is_point_2d_initialised = np.zeros(npoints, dtype=bool)
+    is_point_3d_initialised = np.zeros(npoints, dtype=bool)
+    point_matches.foreach_get(
+        "is_point_2d_initialised", is_point_2d_initialised
+    )
+    point_matches.foreach_get(
+        "is_point_3d_initialised", is_point_3d_initialised
+    )
+
+    # Sorted lists are already valid heaps
+    slots = (
+        np.flatnonzero(~is_point_2d_initialised).tolist(),
+        np.flatnonzero(~is_point_3d_initialised).tolist(),
+    )
+    open_point_slots[image_match.name] = slots
+
+    return slots
+
+
+def invalidate_open_point_slots(image_match):
+    """Remove open point slots (and the point indices) of the image match,
+    e.g. after point matches are removed (which changes the index of all
+    following point matches)"""
+
+    open_point_slots.pop(image_match.name, None)
+    point_2d_indices.pop(image_match.name, None)
+    point_3d_indices.pop(image_match.name, None)
+
+
+def get_point_name(point_match, is2D):
+    """Get name of the 2D point (track) or 3D point (empty) of a point
+    match, or None if it isn't initialised"""
+
+    if is2D:
+        if point_match.is_point_2d_initialised:
+            return point_match.point_2d
+    elif (
+        point_match.is_point_3d_initialised
+        and point_match.point_3d is not None
+    ):
+        return point_match.point_3d.name
+
+    return None
 
-    if success:
-        return location, normal, face_index
-    else:
-        return None, None, None
 
+def find_point_index(image_match, name, is2D):
+    """Get index of the point match whose 2D point (track) or 3D point
+    (empty) has the given name, or None if there isn't one. Indices are kept
+    in a map for each image match - hits are checked against the point
+    match, and the map is rebuilt if it's missing, out of date or has no
+    entry for the name."""
 
-def find_next_point(point_matches, is2D):
+    point_indices = point_2d_indices if is2D else point_3d_indices
+    point_matches = image_match.point_matches
+    indices = point_indices.get(image_match.name, {})
+
+    index = indices.get(name)
+    if (
+        index is not None
+        and index < len(point_matches)
+        and get_point_name(point_matches[index], is2D) == name
+    ):
+        return index
+
+    indices = {}
+    for i, point_match in enumerate(point_matches):
+        point_name = get_point_name(point_match, is2D)
+        if point_name is not None:
+            indices[point_name] = i
+    point_indices[image_match.name] = indices
+
+    return indices.get(name)
+
+
+def find_next_point(image_match, is2D):
     """Find the next point to update i.e. first in the list with
-    a missing 2D or 3D point. If none, make a new point.
-    Can likely be made more efficient as currently this loops
-    through the list from the start every time"""
-    if len(point_matches) > 0:
-        for point in point_matches:
-            if is2D and not point.is_point_2d_initialised:
-                return point
-            elif not is2D and not point.is_point_3d_initialised:
-                return point
-
-    return point_matches.add()
-
-
-def delete_point_if_empty(point_matches, index):
-    """Delete point at index in point_matches if it has no 2D or 3D
-    point inside"""
+    a missing 2D or 3D point. If none, make a new point."""
+
+    point_matches = image_match.point_matches
+    open_2d, open_3d = get_open_point_slots(image_match)
+    slots = open_2d if is2D else open_3d
+
+    while slots:
+        index = heapq.heappop(slots)
+        if index >= len(point_matches):
+            continue
+
+        point = point_matches[index]
+        if is2D and not point.is_point_2d_initialised:
+            return point
+        elif not is2D and not point.is_point_3d_initialised:
+            return point
+
+    # The new point will be missing the other type of point
+    point = point_matches.add()
+    heapq.heappush(open_3d if is2D else open_2d, len(point_matches) - 1)
+
+    return point
+
+
+def delete_point_if_empty(image_match, index):
+    """Delete point at index in the image match's point_matches if it has no
+    2D or 3D point inside. Otherwise, mark its missing point as open to be
+    filled by find_next_point."""
+
+    point_matches = image_match.point_matches
     point = point_matches[index]
     if not point.is_point_2d_initialised and not point.is_point_3d_initialised:
         point_matches.remove(index)
+        open_point_slots.pop(image_match.name, None)
+
+        # Shift the point indices past the removed point match, rather than
+        # reading every point match again
+        for point_indices in (point_2d_indices, point_3d_indices):
+            indices = point_indices.get(image_match.name)
+            if indices is None:
+                continue
+            for name, point_index in indices.items():
+                if point_index > index:
+                    indices[name] = point_index - 1
+        return
+
+    open_2d, open_3d = get_open_point_slots(image_match)
+    if not point.is_point_2d_initialised:
+        heapq.heappush(open_2d, index)
+    if not point.is_point_3d_initialised:
+        heapq.heappush(open_3d, index)
 
 
-def swap_point_matches(image_matches, old_image_name, new_image_name):
+def find_layer_collection(layer_collection, collection):
+    """Find the layer collection of the given collection, searching
+    layer_collection and all its children"""
+
+    if layer_collection.collection == collection:
+        return layer_collection
+
+    for child in layer_collection.children:
+        found = find_layer_collection(child, collection)
+        if found is not None:
+            return found
+
+    return None
+
+
+def set_points_3d_hidden(view_layer, image_match, hidden):
+    """Hide / show all 3D points of the image match, by hiding its 3D points
+    collection in the view layer (rather than each point)"""
+
+    layer_collection = find_layer_collection(
+        view_layer.layer_collection, image_match.points_3d_collection
+    )
+    if layer_collection is not None:
+        layer_collection.hide_viewport = hidden
+
+    # Files saved by older versions hid each point individually, so show
+    # these once the first time the image is shown
+    if not hidden and image_match.name not in images_with_points_shown:
+        for empty in image_match.points_3d_collection.objects:
+            if empty.hide_get(view_layer=view_layer):
+                empty.hide_set(False, view_layer=view_layer)
+        images_with_points_shown.add(image_match.name)
+
+
+def swap_point_matches(view_layer, settings, old_image_name, new_image_name):
     """Hide all point_matches of old_image_name, and show all point_matches
     of new_image_name"""
 
-    if old_image_name in image_matches:
-        for point_match in image_matches[old_image_name].point_matches:
-            if point_match.is_point_3d_initialised:
-                point_match.point_3d.hide_set(True)
+    old_image = props.find_image_match(settings, old_image_name)
+    if old_image is not None:
+        set_points_3d_hidden(view_layer, old_image, True)
 
-    if new_image_name in image_matches:
-        for point_match in image_matches[new_image_name].point_matches:
-            if point_match.is_point_3d_initialised:
-                point_match.point_3d.hide_set(False)
+    new_image = props.find_image_match(settings, new_image_name)
+    if new_image is not None:
+        set_points_3d_hidden(view_layer, new_image, False)
 
 
 class IMAGE_OT_add_3d_point(bpy.types.Operator):
@@ -315,20 +1048,11 @@ class IMAGE_OT_add_3d_point(bpy.types.Operator):
             if hit is not None:
                 best_hit = matrix @ hit
 
-                empty = bpy.data.objects.new("empty", None)
-                empty.empty_display_type = "SPHERE"
-                empty.empty_display_size = settings.point_3d_display_size
-                empty.location = best_hit
-
-                current_image = settings.image_matches[
-                    settings.current_image_name
-                ]
-                point_collection = current_image.points_3d_collection
-                point_collection.objects.link(empty)
+                current_image = props.get_current_image_match(settings)
+                empty = new_point_3d(settings, current_image, best_hit)
 
                 # Update record of 2D-3D point correspondances
-                point_matches = current_image.point_matches
-                next_point = find_next_point(point_matches, False)
+                next_point = find_next_point(current_image, False)
                 next_point.is_point_3d_initialised = True
                 next_point.point_3d = empty
 
@@ -353,62 +1077,71 @@ class IMAGE_OT_delete_3d_point(bpy.types.Operator):
         rv3d = context.region_data
         settings = context.scene.match_settings
 
-        current_image = settings.image_matches[settings.current_image_name]
+        current_image = props.get_current_image_match(settings)
         point_matches = current_image.point_matches
 
         # Coordinates within region are global coordinates - region location
         region_coord = self.point_x - region.x, self.point_y - region.y
 
-        for i in range(len(point_matches)):
-            point = point_matches[i]
-            if point.is_point_3d_initialised:
-                empty = point.point_3d
+        # Read every 3D point (empty) of the image in bulk
+        if current_image.points_3d_collection is None:
+            return {"FINISHED"}
+        empties = current_image.points_3d_collection.objects
+        nempties = len(empties)
+        if nempties == 0:
+            return {"FINISHED"}
 
-                # Coordinate of empty in 2D region
-                empty_region_coord = view3d_utils.location_3d_to_region_2d(
-                    region, rv3d, empty.location
-                )
+        locations = np.empty(nempties * 3, dtype=np.float32)
+        display_sizes = np.empty(nempties, dtype=np.float32)
+        empties.foreach_get("location", locations)
+        empties.foreach_get("empty_display_size", display_sizes)
+        locations = locations.reshape(-1, 3).astype("double")
+        display_sizes = display_sizes.astype("double")
 
-                # Get radius of the empty sphere (in 2D coords).
-                # First, get vector of current view in 3D space. Then add a vector
-                # of length == empty display size in a direction orthogonal to
-                # this (i.e. get a point on the edge of the sphere, in the 3D
-                # plane corresponding to the current 2D view). Convert this back to
-                # 2D space and get distance between this and the empty centre.
-                view_vector = view3d_utils.region_2d_to_vector_3d(
-                    region, rv3d, empty_region_coord
-                )
-                orthogonal_vector = view_vector.orthogonal()
-                orthogonal_vector = orthogonal_vector.normalized()
-                empty_edge_point = empty.location + (
-                    orthogonal_vector * empty.empty_display_size
-                )
+        # Coordinate of every empty in 2D region
+        empty_region_coords, in_front = locations_3d_to_region_2d(
+            region, rv3d, locations
+        )
 
-                empty_edge_region_coord = (
-                    view3d_utils.location_3d_to_region_2d(
-                        region, rv3d, empty_edge_point
-                    )
-                )
-                region_radius = (
-                    empty_region_coord - empty_edge_region_coord
-                ).length
-
-                # Use a bounding box of width == diameter of empty sphere to
-                # detect clicks inside
-                empty_min_x = empty_region_coord[0] - region_radius
-                empty_max_x = empty_region_coord[0] + region_radius
-                empty_min_y = empty_region_coord[1] - region_radius
-                empty_max_y = empty_region_coord[1] + region_radius
-
-                if (
-                    empty_min_x <= region_coord[0] <= empty_max_x
-                    and empty_min_y <= region_coord[1] <= empty_max_y
-                ):
-                    bpy.data.objects.remove(empty, do_unlink=True)
+        # Get radius of each empty sphere (in 2D coords), by projecting a
+        # point on the edge of the sphere - offset from the centre along the
+        # view's x axis (i.e. orthogonal to the view direction)
+        view_x_axis = np.array(rv3d.view_matrix)[0, :3]
+        empty_edge_points = (
+            locations + display_sizes[:, None] * view_x_axis[None, :]
+        )
+        empty_edge_region_coords, _ = locations_3d_to_region_2d(
+            region, rv3d, empty_edge_points
+        )
+        region_radii = np.linalg.norm(
+            empty_region_coords - empty_edge_region_coords, axis=1
+        )
 
-                    point.is_point_3d_initialised = False
-                    delete_point_if_empty(point_matches, i)
-                    break
+        # Use a bounding box of width == diameter of empty sphere to
+        # detect clicks inside
+        offsets = np.abs(empty_region_coords - np.array(region_coord))
+        is_inside = in_front & np.all(
+            offsets <= region_radii[:, None], axis=1
+        )
+        if not is_inside.any():
+            return {"FINISHED"}
+
+        # Delete the empty (of a point match) with its centre closest to the
+        # click
+        inside = np.flatnonzero(is_inside)
+        inside = inside[np.argsort(np.sum(offsets[inside] ** 2, axis=1))]
+        for closest in inside:
+            empty = empties[closest]
+            i = find_point_index(current_image, empty.name, False)
+            if i is not None:
+                break
+        else:
+            return {"FINISHED"}
+
+        point_3d_indices[current_image.name].pop(empty.name, None)
+        bpy.data.objects.remove(empty, do_unlink=True)
+        point_matches[i].is_point_3d_initialised = False
+        delete_point_if_empty(current_image, i)
 
         return {"FINISHED"}
 
@@ -442,16 +1175,12 @@ class IMAGE_OT_add_2d_point(bpy.types.Operator):
             current_movie_clip = context.edit_movieclip
             current_frame = context.scene.frame_current
 
-            tracks = current_movie_clip.tracking.objects[0].tracks
-            track = tracks.new(name="", frame=current_frame)
-            track.markers[0].co = Vector((view_coord[0], view_coord[1]))
-            track.lock = True
+            track = new_point_2d(current_movie_clip, current_frame, view_coord)
 
             # Update record of 2D-3D point correspondances
             settings = context.scene.match_settings
-            current_image = settings.image_matches[settings.current_image_name]
-            point_matches = current_image.point_matches
-            next_point = find_next_point(point_matches, True)
+            current_image = props.get_current_image_match(settings)
+            next_point = find_next_point(current_image, True)
             next_point.is_point_2d_initialised = True
             next_point.point_2d = track.name
 
@@ -489,43 +1218,32 @@ class IMAGE_OT_delete_2d_point(bpy.types.Operator):
         if 0 <= view_coord[0] <= 1 and 0 <= view_coord[1] <= 1:
             current_movie_clip = context.edit_movieclip
             tracks = current_movie_clip.tracking.objects[0].tracks
+            marker_grid = get_marker_grid(current_movie_clip)
 
-            current_image = settings.image_matches[settings.current_image_name]
-            point_matches = current_image.point_matches
+            track_names = marker_grid.find(tracks, view_coord)
+            if not track_names:
+                return {"FINISHED"}
 
-            for i in range(len(point_matches)):
-                point = point_matches[i]
-                if point.is_point_2d_initialised:
-                    track = tracks[point.point_2d]
+            current_image = props.get_current_image_match(settings)
 
-                    marker = track.markers[0]
-                    marker_min_x = (
-                        marker.co[0] + marker.pattern_bound_box[0][0]
-                    )
-                    marker_max_x = (
-                        marker.co[0] + marker.pattern_bound_box[1][0]
-                    )
-                    marker_min_y = (
-                        marker.co[1] + marker.pattern_bound_box[0][1]
-                    )
-                    marker_max_y = (
-                        marker.co[1] + marker.pattern_bound_box[1][1]
-                    )
+            for track_name in track_names:
+                i = find_point_index(current_image, track_name, True)
+                if i is None:
+                    continue
 
-                    if (
-                        marker_min_x <= view_coord[0] <= marker_max_x
-                        and marker_min_y <= view_coord[1] <= marker_max_y
-                    ):
-                        track.select = True
-                        # Couldn't see a simple way to delete a track directly,
-                        # so use an ops call
-                        bpy.ops.clip.delete_track(False)
+                tracks[track_name].select = True
+                # Couldn't see a simple way to delete a track directly, so
+                # use an ops call
+                bpy.ops.clip.delete_track(False)
+                marker_grid.remove(track_name)
 
-                        point.is_point_2d_initialised = False
-                        point.point_2d = ""
-                        delete_point_if_empty(point_matches, i)
+                point = current_image.point_matches[i]
+                point.is_point_2d_initialised = False
+                point.point_2d = ""
+                point_2d_indices[current_image.name].pop(track_name, None)
+                delete_point_if_empty(current_image, i)
 
-                        break
+                break
 
         return {"FINISHED"}
 
@@ -659,6 +1377,45 @@ class IMAGE_OT_toggle_camera_view(bpy.types.Operator):
         return {"FINISHED"}
 
 
+class IMAGE_OT_update_proxies(bpy.types.Operator):
+    """Apply proxy settings to the current image (and to the camera
+    backgrounds of all images whose proxies are already built)"""
+
+    bl_idname = "imagematches.update_proxies"
+    bl_label = "Update proxies"
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+        current_image = props.get_current_image_match(settings)
+        if current_image is None:
+            self.report({"ERROR"}, "No image loaded")
+            return {"CANCELLED"}
+
+        open_movie_clip(current_image.movie_clip)
+        is_build_started = update_image_proxy(context, settings, current_image)
+
+        # Other images only show proxies that are already built (the rest
+        # are built when the image is next made current)
+        for image_match in settings.image_matches:
+            if image_match == current_image:
+                continue
+
+            render_size = get_proxy_render_size(
+                settings, image_match.movie_clip
+            )
+            if image_match.proxy_size != settings.proxy_size:
+                if is_proxy_built(image_match.movie_clip, settings.proxy_size):
+                    image_match.proxy_size = settings.proxy_size
+                else:
+                    render_size = "FULL"
+            set_proxy_render_size(image_match, render_size)
+
+        if is_build_started:
+            self.report({"INFO"}, "Building proxy for current image")
+
+        return {"FINISHED"}
+
+
 class IMAGE_OT_update_3d_point_size(bpy.types.Operator):
     """Update size of all 3D points (spherical empties)"""
 
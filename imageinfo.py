@@ -0,0 +1,272 @@
+""" Reads the size and camera EXIF data of image files from their headers,
+without decoding the pixels (JPEG, PNG and TIFF). Only uses the standard
+library (not bpy), so files can be probed in parallel threads. """
+
+import io
+import math
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+# Diagonal of a 35mm film frame (36 x 24mm), in mm
+FILM_35MM_DIAGONAL = math.hypot(36, 24)
+
+# Maximum number of bytes read while searching JPEG headers
+MAX_JPEG_HEADER_SIZE = 1 << 20
+
+# TIFF tags
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_EXIF_IFD = 0x8769
+TAG_FOCAL_LENGTH = 0x920A
+TAG_FOCAL_LENGTH_35MM = 0xA405
+
+# Size in bytes of each TIFF field type
+TIFF_TYPE_SIZES = {
+    1: 1,
+    2: 1,
+    3: 2,
+    4: 4,
+    5: 8,
+    6: 1,
+    7: 1,
+    8: 2,
+    9: 4,
+    10: 8,
+    11: 4,
+    12: 8,
+}
+
+
+@dataclass(slots=True, frozen=True)
+class ImageInfo:
+    """Header information of one image file. Values are None if they're not
+    in the header, or the file format isn't supported.
+
+    Attributes:
+        filepath: path of the image file
+        width: width in pixels
+        height: height in pixels
+        focal_length: focal length of the lens in mm
+        focal_length_35mm: focal length in mm of the lens that would give
+            the same field of view on a 35mm film camera
+    """
+
+    filepath: str
+    width: int = None
+    height: int = None
+    focal_length: float = None
+    focal_length_35mm: float = None
+
+    def get_sensor_width(self):
+        """Get width (in mm) of the sensor that gives the image's field of
+        view with its 35mm equivalent focal length. None if unknown."""
+
+        if not (self.width and self.height and self.focal_length_35mm):
+            return None
+
+        # 35mm equivalent focal lengths are defined by the diagonal field of
+        # view, so scale the 35mm film diagonal to the image's aspect ratio
+        return FILM_35MM_DIAGONAL * self.width / math.hypot(
+            self.width, self.height
+        )
+
+
+def read_tiff_value(stream, byte_order, offset, field_type, count):
+    """Read the first value of a TIFF field, whose 4 byte value / offset is at
+    offset in the stream. Returns None for unsupported types."""
+
+    size = TIFF_TYPE_SIZES.get(field_type)
+    if size is None or count < 1:
+        return None
+
+    stream.seek(offset)
+    if size * count > 4:
+        (value_offset,) = struct.unpack(byte_order + "I", stream.read(4))
+        stream.seek(value_offset)
+
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+
+    if field_type == 3:
+        return struct.unpack(byte_order + "H", data)[0]
+    if field_type == 4:
+        return struct.unpack(byte_order + "I", data)[0]
+    if field_type in (5, 10):
+        numerator, denominator = struct.unpack(
+            byte_order + ("II" if field_type == 5 else "ii"), data
+        )
+        return numerator / denominator if denominator else None
+
+    return None
+
+
+def read_tiff_ifd(stream, byte_order, offset):
+    """Read all supported tag values of the TIFF image file directory at
+    offset in the stream, as a dictionary of tag: value"""
+
+    stream.seek(offset)
+    data = stream.read(2)
+    if len(data) < 2:
+        return {}
+    (nentries,) = struct.unpack(byte_order + "H", data)
+
+    values = {}
+    for i in range(nentries):
+        entry_offset = offset + 2 + i * 12
+        stream.seek(entry_offset)
+        entry = stream.read(8)
+        if len(entry) < 8:
+            break
+
+        tag, field_type, count = struct.unpack(byte_order + "HHI", entry)
+        if tag in (
+            TAG_IMAGE_WIDTH,
+            TAG_IMAGE_LENGTH,
+            TAG_EXIF_IFD,
+            TAG_FOCAL_LENGTH,
+            TAG_FOCAL_LENGTH_35MM,
+        ):
+            values[tag] = read_tiff_value(
+                stream, byte_order, entry_offset + 8, field_type, count
+            )
+
+    return values
+
+
+def read_tiff(stream):
+    """Read the first image file directory of a TIFF stream (a TIFF file, or
+    the EXIF data of a JPEG), along with its EXIF directory
+
+    Returns:
+        Dictionary of tag: value, empty if the stream isn't a valid TIFF
+    """
+
+    header = stream.read(8)
+    if len(header) < 8 or header[:2] not in (b"II", b"MM"):
+        return {}
+
+    byte_order = "<" if header[:2] == b"II" else ">"
+    magic, ifd_offset = struct.unpack(byte_order + "HI", header[2:])
+    if magic != 42:
+        return {}
+
+    values = read_tiff_ifd(stream, byte_order, ifd_offset)
+    if values.get(TAG_EXIF_IFD):
+        exif_values = read_tiff_ifd(stream, byte_order, values[TAG_EXIF_IFD])
+        values.update(exif_values)
+
+    return values
+
+
+def get_exif_focal_lengths(values):
+    """Get focal length and 35mm equivalent focal length from TIFF / EXIF
+    tag values (0 means unknown in EXIF, so is returned as None)"""
+
+    focal_length = values.get(TAG_FOCAL_LENGTH) or None
+    focal_length_35mm = values.get(TAG_FOCAL_LENGTH_35MM) or None
+
+    return focal_length, focal_length_35mm
+
+
+def read_jpeg_info(file, filepath):
+    """Read size (from the start of frame segment) and EXIF focal lengths
+    (from the APP1 segment) of a JPEG file"""
+
+    width = height = None
+    exif_values = {}
+
+    file.seek(2)
+    while file.tell() < MAX_JPEG_HEADER_SIZE:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+
+        # Padding bytes
+        while len(marker) == 2 and marker[1] == 0xFF:
+            marker = marker[1:] + file.read(1)
+        if len(marker) < 2:
+            break
+
+        marker_type = marker[1]
+        if marker_type == 0xD9 or marker_type == 0xDA:
+            # End of image / start of scan - no more headers
+            break
+        if 0xD0 <= marker_type <= 0xD7 or marker_type == 0x01:
+            # Markers without a segment
+            continue
+
+        data = file.read(2)
+        if len(data) < 2:
+            break
+        (length,) = struct.unpack(">H", data)
+        if length < 2:
+            # Corrupt segment length (it includes its own 2 bytes)
+            break
+        segment = file.read(length - 2)
+
+        if marker_type == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            exif_values = read_tiff(io.BytesIO(segment[6:]))
+        elif (
+            0xC0 <= marker_type <= 0xCF
+            and marker_type not in (0xC4, 0xC8, 0xCC)
+            and len(segment) >= 5
+        ):
+            height, width = struct.unpack(">HH", segment[1:5])
+            break
+
+    return ImageInfo(
+        filepath, width, height, *get_exif_focal_lengths(exif_values)
+    )
+
+
+def read_image_info(filepath):
+    """Read size and EXIF focal lengths of an image file from its header
+
+    Returns:
+        ImageInfo of the file (with values of None where unknown), or None
+        if the file can't be read
+    """
+
+    try:
+        with open(filepath, "rb") as file:
+            signature = file.read(8)
+
+            if signature[:2] == b"\xff\xd8":
+                return read_jpeg_info(file, filepath)
+
+            if signature == b"\x89PNG\r\n\x1a\n":
+                data = file.read(16)
+                if len(data) < 16 or data[4:8] != b"IHDR":
+                    return ImageInfo(filepath)
+                width, height = struct.unpack(">II", data[8:16])
+                return ImageInfo(filepath, width, height)
+
+            if signature[:2] in (b"II", b"MM"):
+                file.seek(0)
+                values = read_tiff(file)
+                return ImageInfo(
+                    filepath,
+                    values.get(TAG_IMAGE_WIDTH),
+                    values.get(TAG_IMAGE_LENGTH),
+                    *get_exif_focal_lengths(values),
+                )
+
+            return ImageInfo(filepath)
+    except (OSError, struct.error):
+        return None
+
+
+def read_image_infos(filepaths, max_workers=None):
+    """Read header information of many image files in parallel threads
+    (reading headers is limited by file access, not the GIL)
+
+    Returns:
+        List of ImageInfo (or None, for files that can't be read), in the
+        same order as filepaths
+    """
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_image_info, filepaths))
@@ -0,0 +1,119 @@
+import bpy
+from . import cache
+from . import pnp
+from . import props
+
+
+# Signature of the points last solved in live mode, for each image name
+last_solved_signatures = {}
+
+
+class LiveSolveReporter:
+    """Stands in for the operator that pnp functions normally report to, when
+    solving in live mode. Warnings are ignored (they would be repeated on
+    every solve), and errors are printed to the console."""
+
+    def report(self, type, message):
+        if "ERROR" in type:
+            print(f"Live solve: {message}")
+
+
+def live_solve():
+    """Timer callback that re-solves the current image, if its points have
+    changed since the last live solve"""
+
+    context = bpy.context
+    settings = context.scene.match_settings
+
+    if (
+        not settings.use_live_solve
+        or props.get_current_image_match(settings) is None
+        or settings.model is None
+        or settings.model.mode != "OBJECT"
+    ):
+        return None
+
+    reporter = LiveSolveReporter()
+    current_image = props.get_current_image_match(settings)
+    snapshot = pnp.get_image_snapshot(reporter, current_image)
+
+    if snapshot.npoints < 4:
+        return None
+
+    signature = cache.get_inputs_key(snapshot)
+    if last_solved_signatures.get(settings.current_image_name) == signature:
+        return None
+
+    last_solved_signatures[settings.current_image_name] = signature
+    pnp.solve_pnp(reporter, context, snapshot)
+
+    # Don't repeat timer
+    return None
+
+
+def is_relevant_update(update, image_match):
+    """Check if a depsgraph update affects the 2D or 3D points of the given
+    image match"""
+
+    updated_id = update.id.original
+
+    if isinstance(updated_id, bpy.types.MovieClip):
+        return updated_id == image_match.movie_clip
+
+    if isinstance(updated_id, bpy.types.Collection):
+        return updated_id == image_match.points_3d_collection
+
+    if isinstance(updated_id, bpy.types.Object):
+        return (
+            update.is_updated_transform
+            and updated_id.type == "EMPTY"
+            and updated_id.name in image_match.points_3d_collection.objects
+        )
+
+    return False
+
+
+@bpy.app.handlers.persistent
+def schedule_live_solve(scene, depsgraph):
+    """Depsgraph handler that (re)starts the live solve timer whenever the
+    current image's points change. Restarting the timer means the solve only
+    runs once changes have stopped for live_solve_delay seconds."""
+
+    settings = scene.match_settings
+    if (
+        not settings.use_live_solve
+        or props.get_current_image_match(settings) is None
+    ):
+        return
+
+    current_image = props.get_current_image_match(settings)
+    if not any(
+        is_relevant_update(update, current_image)
+        for update in depsgraph.updates
+    ):
+        return
+
+    if bpy.app.timers.is_registered(live_solve):
+        bpy.app.timers.unregister(live_solve)
+    bpy.app.timers.register(
+        live_solve, first_interval=settings.live_solve_delay
+    )
+
+
+def register_handlers():
+    """Add the live solve depsgraph handler"""
+
+    if schedule_live_solve not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(schedule_live_solve)
+
+
+def unregister_handlers():
+    """Remove the live solve depsgraph handler (and any pending solve)"""
+
+    if schedule_live_solve in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(schedule_live_solve)
+
+    if bpy.app.timers.is_registered(live_solve):
+        bpy.app.timers.unregister(live_solve)
+
+    last_solved_signatures.clear()
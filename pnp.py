@@ -2,9 +2,22 @@
 https://rtstudios.gumroad.com/l/camera_pnpoint """
 
 import bpy
+import time
 import cv2 as cv
 import numpy as np
 from mathutils import Matrix, Vector
+from . import bundle
+from . import cache
+from . import props
+from . import solver
+
+
+# Movie clip name -> track name -> index map, see get_track_indices
+track_indices = {}
+
+# Results of previous solves / calibrations, so images whose inputs haven't
+# changed aren't solved again (e.g. when re-solving after undo)
+result_cache = cache.ResultCache()
 
 
 def get_optical_centre(clip_camera):
@@ -27,58 +40,212 @@ def set_optical_centre(clip_camera, optical_centre):
         clip_camera.principal_point_pixels = optical_centre
 
 
-def get_2D_3D_point_coordinates(self, point_matches, clip):
-    """Get coordinates of all 2D-3D point matches. Discards any matches with
-    only a 2D point or only a 3D point.
+def get_track_indices(clip, track_names):
+    """Get the index of each named track in the clip's tracks. Looking up
+    tracks by name is a linear search, so a name -> index map is kept for
+    each clip. Each index is checked against the name of the track it points
+    to, and the map is rebuilt if any doesn't match - e.g. after tracks are
+    deleted and added, which can reuse names at new indices.
 
     Args:
-        point_matches: current point matches
-        clip: current Blender movie clip
+        clip: Blender movie clip
+        track_names: list of track names
+
+    Returns:
+        Numpy array of track indices, one per name
+    """
+
+    tracks = clip.tracking.objects[0].tracks
+    ntracks = len(tracks)
+    name_to_index = track_indices.get(clip.name, {})
+
+    indices = [name_to_index.get(name) for name in track_names]
+    if not all(
+        index is not None and index < ntracks and tracks[index].name == name
+        for index, name in zip(indices, track_names)
+    ):
+        name_to_index = {track.name: i for i, track in enumerate(tracks)}
+        track_indices[clip.name] = name_to_index
+        indices = [name_to_index[name] for name in track_names]
+
+    return np.array(indices, dtype=int)
+
+
+def get_marker_coordinates(clip, indices):
+    """Get the coordinates of the first marker of the given tracks
+
+    Args:
+        clip: Blender movie clip
+        indices: numpy array of track indices
+
+    Returns:
+        Numpy array of marker coordinates (0 to 1 on each axis), one row per
+        track index
+    """
+
+    tracks = clip.tracking.objects[0].tracks
+    coords = np.empty((len(indices), 2), dtype="double")
+
+    for i, track_index in enumerate(indices):
+        coords[i] = tracks[track_index].markers[0].co
+
+    return coords
+
+
+def get_point_3d_locations(image_match, point_matches):
+    """Read the locations of the 3D points of the given point matches. The
+    locations of every empty in the image's 3D point collection are read in
+    one foreach_get call - only points outside it are read one by one.
+
+    Args:
+        image_match: image match that owns the point matches
+        point_matches: list of point matches with a 3D point
+
+    Returns:
+        Numpy array of 3D point locations, one row per point match
+    """
+
+    collection = image_match.points_3d_collection
+    objects = collection.objects if collection is not None else []
+
+    object_locations = np.empty(len(objects) * 3, dtype=np.float32)
+    name_to_row = {}
+    if objects:
+        objects.foreach_get("location", object_locations)
+        name_to_row = {name: i for i, name in enumerate(objects.keys())}
+    object_locations = object_locations.reshape(-1, 3)
+
+    locations = np.empty((len(point_matches), 3), dtype="double")
+    for i, point_match in enumerate(point_matches):
+        point_3d = point_match.point_3d
+        row = name_to_row.get(point_3d.name)
+        if row is not None:
+            locations[i] = object_locations[row]
+        else:
+            locations[i] = point_3d.location
+
+    return locations
+
+
+def get_2D_3D_point_coordinates(self, image_match):
+    """Get coordinates of all 2D-3D point matches of an image. Discards any
+    matches with only a 2D point or only a 3D point.
+
+    Args:
+        image_match: image match to read the points of
 
     Returns:
         Two numpy arrays of equal size - the first being the coordinates of all
         2D points, and the second the coordinates of all 3D points
     """
-    size = clip.size
+    point_matches = image_match.point_matches
+    clip = image_match.movie_clip
+    size = np.array(clip.size, dtype="double")
     tracks = clip.tracking.objects[0].tracks
 
     if not tracks:
         self.report({"ERROR"}, "Please add markers for the 2D points")
         return np.array([]), np.array([])
 
-    points_2d_coords = []
-    points_3d_coords = []
-    points_ignored = False
+    # Only process matches with both 2D and 3D point initialised (and not
+    # waiting to be accepted after guided matching) - rest ignored
+    complete = get_complete_point_mask(point_matches)
+    if not complete.all():
+        self.report(
+            {"WARNING"},
+            "Ignoring points with only 2D or only 3D, or not yet accepted",
+        )
 
-    for point_match in point_matches:
-        # Only process matches with both 2D and 3D point initialised -
-        # rest ignored
-        if (
-            point_match.is_point_2d_initialised
-            and point_match.is_point_3d_initialised
-        ):
-            points_3d_coords.append(point_match.point_3d.location)
+    complete_matches = get_complete_point_matches(point_matches, complete)
+    indices = get_track_indices(
+        clip, [point_match.point_2d for point_match in complete_matches]
+    )
 
-            track = tracks[point_match.point_2d]
-            # .co runs from 0 to 1 on each axis of the image, so multiply
-            # by image size to get full coordinates
-            point_2d_coordinates = [
-                track.markers[0].co[0] * size[0],
-                size[1] - track.markers[0].co[1] * size[1],
-            ]
+    points_2d_coords = get_marker_coordinates(clip, indices)
+    points_3d_coords = get_point_3d_locations(image_match, complete_matches)
 
-            points_2d_coords.append(point_2d_coordinates)
+    # .co runs from 0 to 1 on each axis of the image (with y going up), so
+    # scale by image size to get full pixel coordinates
+    points_2d_coords *= size
+    points_2d_coords[:, 1] = size[1] - points_2d_coords[:, 1]
 
-        else:
-            points_ignored = True
+    return points_2d_coords, points_3d_coords
 
-    if points_ignored:
-        self.report({"WARNING"}, "Ignoring points with only 2D or only 3D")
 
-    points_2d_coords = np.asarray(points_2d_coords, dtype="double")
-    points_3d_coords = np.asarray(points_3d_coords, dtype="double")
+def get_complete_point_mask(point_matches):
+    """Get boolean numpy array, true for each point match with both a 2D and
+    3D point initialised (i.e. those used by get_2D_3D_point_coordinates).
+    Points predicted by guided matching are excluded until accepted."""
 
-    return points_2d_coords, points_3d_coords
+    npoints = len(point_matches)
+    is_point_2d_initialised = np.zeros(npoints, dtype=bool)
+    is_point_3d_initialised = np.zeros(npoints, dtype=bool)
+    is_predicted = np.zeros(npoints, dtype=bool)
+    point_matches.foreach_get(
+        "is_point_2d_initialised", is_point_2d_initialised
+    )
+    point_matches.foreach_get(
+        "is_point_3d_initialised", is_point_3d_initialised
+    )
+    point_matches.foreach_get("is_predicted", is_predicted)
+
+    return is_point_2d_initialised & is_point_3d_initialised & ~is_predicted
+
+
+def get_complete_point_matches(point_matches, complete=None):
+    """Get list of point matches with both a 2D and 3D point initialised.
+    complete is the mask from get_complete_point_mask (calculated if not
+    given)."""
+
+    if complete is None:
+        complete = get_complete_point_mask(point_matches)
+
+    return [
+        point_match
+        for point_match, is_complete in zip(point_matches, complete)
+        if is_complete
+    ]
+
+
+def set_point_match_values(point_matches, attribute, values, default):
+    """Set an attribute of every point match in one bulk operation
+
+    Args:
+        point_matches: current point matches
+        attribute: name of the PointMatch property to set
+        values: numpy array, one value per complete 2D-3D point match (same
+            order as get_2D_3D_point_coordinates)
+        default: value to set for incomplete point matches
+    """
+
+    complete = get_complete_point_mask(point_matches)
+    all_values = np.full(len(point_matches), default, dtype=values.dtype)
+    all_values[complete] = values
+    point_matches.foreach_set(attribute, all_values)
+
+
+def set_point_inliers(point_matches, inliers):
+    """Set inlier state of each point match. Incomplete point matches are
+    always set as inliers."""
+
+    set_point_match_values(point_matches, "is_inlier", inliers, True)
+
+
+def set_point_residuals(image_match, residuals):
+    """Set reprojection error of each point match, as well as the summary
+    RMS / max error of the image match. Incomplete point matches are set to
+    -1 (i.e. no error calculated)"""
+
+    set_point_match_values(
+        image_match.point_matches,
+        "reprojection_error",
+        residuals.astype(np.float32),
+        -1,
+    )
+
+    rms, maximum = solver.summarise_residuals(residuals)
+    image_match.reprojection_rms = rms
+    image_match.reprojection_max = maximum
 
 
 def get_distortion_coefficients(self, clip_camera):
@@ -134,115 +301,139 @@ def get_camera_intrinsics(clip_camera, clip_size):
     return camera_intrinsics
 
 
-def get_scene_info(self, context):
+def get_image_snapshot(self, image_match):
     """Collect information from the movie clip and its camera, as well as
-    2D and 3D points from the current image match
+    2D and 3D points from the given image match, into a snapshot the solver
+    can use away from Blender's main thread
 
     Args:
-        context: Blender context
+        image_match: image match to snapshot
 
     Returns:
-        self - self from Blender operator
-        context - Blender context
-        clip - current Blender movie clip
-        points_3d_coords - numpy array of 3D point coordinates
-        points_2d_coords - numpy array of 2D point coordinates
-        camera_intrinsics - numpy array of camera intrinsics
-        distortion_coefficients - numpy array of camera distortion coefficients
+        solver.ImageSnapshot of the image match
     """
 
-    settings = context.scene.match_settings
-    current_image = settings.image_matches[settings.current_image_name]
-
-    clip = current_image.movie_clip
+    clip = image_match.movie_clip
 
     # get picture and camera metrics
     size = clip.size
     clip_camera = clip.tracking.camera
 
     points_2d_coords, points_3d_coords = get_2D_3D_point_coordinates(
-        self, current_image.point_matches, clip
+        self, image_match
     )
-    camera_intrinsics = get_camera_intrinsics(clip_camera, size)
-    distortion_coefficients = get_distortion_coefficients(self, clip_camera)
 
-    return (
-        self,
-        context,
-        clip,
+    return solver.ImageSnapshot(
+        image_match.name,
         points_3d_coords,
         points_2d_coords,
-        camera_intrinsics,
-        distortion_coefficients,
+        get_camera_intrinsics(clip_camera, size),
+        get_distortion_coefficients(self, clip_camera),
+        tuple(size),
     )
 
 
-def solve_pnp(
-    self,
-    context,
-    clip,
-    points_3d_coords,
-    points_2d_coords,
-    camera_intrinsics,
-    distortion_coefficients,
-):
-    """Solve camera pose with OpenCV's PNP solver. Set the current camera
-    intrinsics, extrinsics and background image to match
-
-    Args:
-        context: Blender context
-        clip: Blender movie clip
-        points_3d_coords: numpy array of 3D point coordinates
-        points_2d_coords: numpy array of 2D point coordinates
-        camera_intrinsics: numpy array of camera intrinsics
-        distortion_coefficients: numpy array of camera distortion coefficients
+def get_solver_options(settings, image_match):
+    """Get solver options from the current settings for the given image
+    match. When incremental solving is enabled, this includes its last solved
+    pose to warm-start from.
 
     Returns:
-        Status for operator - cancelled or finished
+        solver.SolverOptions
     """
 
-    npoints = points_3d_coords.shape[0]
-    size = clip.size
-
-    if npoints < 4:
-        self.report(
-            {"ERROR"},
-            "Not enough point pairs, use at least 4 markers to solve a camera pose.",
-        )
-        return {"CANCELLED"}
+    warm_start = {}
+    if settings.use_incremental_solve and image_match.is_pose_solved:
+        warm_start = {
+            "rvec_guess": tuple(image_match.pose_rvec),
+            "tvec_guess": tuple(image_match.pose_tvec),
+            "previous_error": image_match.pose_unrefined_error,
+        }
+
+    return solver.SolverOptions(
+        pnp_solver=settings.pnp_solver,
+        use_ransac=settings.use_ransac,
+        ransac_threshold=settings.ransac_threshold,
+        ransac_iterations=settings.ransac_iterations,
+        refine_method=settings.refine_method,
+        refine_max_iterations=settings.refine_max_iterations,
+        refine_epsilon=settings.refine_epsilon,
+        **warm_start,
+    )
 
-    # solve Perspective-n-Point
-    ret, rvec, tvec, error = cv.solvePnPGeneric(
-        points_3d_coords,
-        points_2d_coords,
-        camera_intrinsics,
-        distortion_coefficients,
-        flags=cv.SOLVEPNP_SQPNP,
-    )  # TODO: further investigation on other algorithms
-    rmat, _ = cv.Rodrigues(rvec[0])
 
-    settings = context.scene.match_settings
-    settings.pnp_solve_msg = (
-        ("Reprojection Error: %.2f" % error) if ret else "solvePnP failed!"
+def set_solved_pose(
+    image_match,
+    rvec,
+    tvec,
+    error,
+    solver_name,
+    solver_timings,
+    unrefined_error=None,
+):
+    """Store the solved pose on the image match, so later solves can be
+    warm-started from it. Also records which solver found the pose, and how
+    long each solver that was run took. unrefined_error is the error before
+    refinement (the same as error if not given)."""
+
+    image_match.pose_rvec = np.ravel(rvec)
+    image_match.pose_tvec = np.ravel(tvec)
+    image_match.pose_error = error
+    image_match.pose_unrefined_error = (
+        error if unrefined_error is None else unrefined_error
     )
+    image_match.is_pose_solved = True
 
-    # calculate projection errors for each point pair
-    print("dbg: calculating projections of 3d points...")
-    impoints, jacob = cv.projectPoints(
-        points_3d_coords,
-        rvec[0],
-        tvec[0],
-        camera_intrinsics,
-        distortion_coefficients,
+    image_match.pose_solver = solver_name
+    image_match.pose_solver_timings = ", ".join(
+        f"{name} {elapsed_time * 1000:.1f}ms"
+        for name, elapsed_time in solver_timings.items()
     )
-    print("dbg: projection finished")
-    print(impoints)
-    print(jacob)
+
+
+def set_pose_uncertainty(image_match, uncertainty):
+    """Store the pose uncertainty (position_sigma, rotation_sigma) returned
+    by solver.pose_uncertainty on the image match"""
+
+    image_match.position_sigma, image_match.rotation_sigma = uncertainty
+
+
+def get_solve_message(result):
+    """Get message summarising the reprojection error (before and after
+    refinement, if different) and number of inliers of a solver.PoseResult"""
+
+    if result.unrefined_error != result.error:
+        message = "Reprojection Error: %.2f -> %.2f" % (
+            result.unrefined_error,
+            result.error,
+        )
+    else:
+        message = "Reprojection Error: %.2f" % result.error
+
+    inliers = result.inliers
+    if not inliers.all():
+        message += f" ({inliers.sum()}/{len(inliers)} inliers)"
+
+    return message
+
+
+def get_camera_matrix_world(rvec, tvec):
+    """Get Blender world matrix of a camera with the given OpenCV pose
+
+    Args:
+        rvec: numpy array rotation vector (world to opencv camera)
+        tvec: numpy array translation vector (world to opencv camera)
+
+    Returns:
+        4x4 mathutils Matrix
+    """
+
+    rmat, _ = cv.Rodrigues(np.asarray(rvec, dtype="double"))
 
     # get R and T matrices
     # https://blender.stackexchange.com/questions/38009/3x4-camera-matrix-from-blender-camera
     R_world2cv = Matrix(rmat.tolist())
-    T_world2cv = Vector(tvec[0])
+    T_world2cv = Vector(np.ravel(tvec))
 
     # blender camera to opencv camera coordinate conversion
     R_bcam2cv = Matrix(((1, 0, 0), (0, -1, 0), (0, 0, -1)))
@@ -252,9 +443,25 @@ def solve_pnp(
     rot = R_cv2world @ R_bcam2cv
     loc = -1 * R_cv2world @ T_world2cv
 
+    return Matrix.Translation(loc) @ rot.to_4x4()
+
+
+def set_camera_pose(context, image_match, rvec, tvec):
+    """Set the camera of the given image match to the solved pose. Also sets
+    the camera intrinsics and background image to match its movie clip
+
+    Args:
+        context: Blender context
+        image_match: image match whose camera to update
+        rvec: numpy array rotation vector (world to opencv camera)
+        tvec: numpy array translation vector (world to opencv camera)
+    """
+
+    clip = image_match.movie_clip
+    size = clip.size
+
     # Set camera intrinsics, extrinsics and background
-    current_image = settings.image_matches[settings.current_image_name]
-    camera = current_image.camera
+    camera = image_match.camera
     tracking_camera = clip.tracking.camera
 
     camera_data = camera.data
@@ -296,78 +503,445 @@ def solve_pnp(
     background_image.display_depth = "FRONT"
     background_image.clip_user.use_render_undistorted = True
 
-    camera.matrix_world = Matrix.Translation(loc) @ rot.to_4x4()
-    context.scene.camera = camera
+    camera.matrix_world = get_camera_matrix_world(rvec, tvec)
+
+
+def apply_pose_result(context, image_match, result):
+    """Apply a successful solver.PoseResult to the given image match - its
+    point inliers / errors, solved pose and camera
+
+    Args:
+        context: Blender context
+        image_match: image match that was solved
+        result: solver.PoseResult for the image match
+    """
+
+    set_point_inliers(image_match.point_matches, result.inliers)
+    set_point_residuals(image_match, result.residuals)
+    set_solved_pose(
+        image_match,
+        result.rvec,
+        result.tvec,
+        result.error,
+        result.solver_name,
+        result.solver_timings,
+        result.unrefined_error,
+    )
+    set_pose_uncertainty(
+        image_match, (result.position_sigma, result.rotation_sigma)
+    )
+    set_camera_pose(context, image_match, result.rvec, result.tvec)
+
+
+def solve_images_cached(snapshots, options):
+    """Solve the camera pose of the given images, re-using cached results
+    for any whose inputs haven't changed since they were last solved
+
+    Args:
+        snapshots: list of solver.ImageSnapshots to solve
+        options: list of solver.SolverOptions, one per snapshot
+
+    Returns:
+        List of solver.PoseResults (in the same order as snapshots), and
+        the number of results that came from the cache
+    """
+
+    inputs_keys = [
+        cache.get_inputs_key(snapshot, options=image_options)
+        for snapshot, image_options in zip(snapshots, options)
+    ]
+    results = [
+        result_cache.get(snapshot.name, "pose", inputs_key)
+        for snapshot, inputs_key in zip(snapshots, inputs_keys)
+    ]
+
+    uncached = [i for i, result in enumerate(results) if result is None]
+    solved_results = solver.solve_image_batch(
+        [snapshots[i] for i in uncached], [options[i] for i in uncached]
+    )
+    for i, result in zip(uncached, solved_results):
+        result_cache.put(result.name, "pose", inputs_keys[i], result)
+        results[i] = result
+
+    return results, len(snapshots) - len(uncached)
+
+
+def calibrate_images_cached(image_name, snapshots, flags):
+    """Calibrate the camera shared by the given images, re-using the cached
+    result if the inputs haven't changed since the last calibration
+
+    Args:
+        image_name: name of the image match to cache the result under
+        snapshots: list of solver.ImageSnapshots to calibrate from
+        flags: OpenCV calibration flags
+
+    Returns:
+        solver.CalibrationResult, and whether it came from the cache
+    """
+
+    inputs_key = cache.get_inputs_key(*snapshots, options=flags)
+    result = result_cache.get(image_name, "calibration", inputs_key)
+    if result is not None:
+        return result, True
+
+    result = solver.calibrate_images(snapshots, flags)
+    result_cache.put(image_name, "calibration", inputs_key, result)
+
+    return result, False
+
+
+def solve_pnp(self, context, snapshot):
+    """Solve camera pose with OpenCV's PNP solver. Set the current camera
+    intrinsics, extrinsics and background image to match
+
+    Args:
+        context: Blender context
+        snapshot: solver.ImageSnapshot of the current image match
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    if snapshot.npoints < 4:
+        self.report(
+            {"ERROR"},
+            "Not enough point pairs, use at least 4 markers to solve a camera pose.",
+        )
+        return {"CANCELLED"}
+
+    settings = context.scene.match_settings
+    current_image = props.find_image_match(settings, snapshot.name)
+
+    # solve Perspective-n-Point
+    (result,), ncached = solve_images_cached(
+        [snapshot], [get_solver_options(settings, current_image)]
+    )
+
+    settings.pnp_solve_msg = (
+        get_solve_message(result) if result.success else "solvePnP failed!"
+    )
+    if ncached:
+        settings.pnp_solve_msg += " (cached)"
+
+    if not result.success:
+        return {"CANCELLED"}
+
+    apply_pose_result(context, current_image, result)
+    context.scene.camera = current_image.camera
 
     return {"FINISHED"}
 
 
-def calibrate_camera(
-    self,
-    context,
-    clip,
+def get_marker_table(clip, track_indices):
+    """Read every (unmuted) marker of the given tracks in bulk
+
+    Args:
+        clip: Blender movie clip
+        track_indices: numpy array of track indices, one per point
+
+    Returns:
+        frames - numpy array of (clip) frame number of each marker, sorted
+        points - numpy array of point index of each marker
+        points_2d_coords - numpy array of 2D coordinates (in pixels) of each
+            marker
+    """
+
+    tracks = clip.tracking.objects[0].tracks
+    size = np.array(clip.size, dtype="double")
+
+    all_frames = []
+    all_points = []
+    all_coords = []
+    for point_index, track_index in enumerate(track_indices):
+        markers = tracks[track_index].markers
+        nmarkers = len(markers)
+
+        frames = np.empty(nmarkers, dtype=np.int32)
+        coords = np.empty(nmarkers * 2, dtype=np.float32)
+        mute = np.empty(nmarkers, dtype=bool)
+        markers.foreach_get("frame", frames)
+        markers.foreach_get("co", coords)
+        markers.foreach_get("mute", mute)
+
+        all_frames.append(frames[~mute])
+        all_points.append(np.full(np.sum(~mute), point_index))
+        all_coords.append(coords.reshape(-1, 2)[~mute])
+
+    if not all_frames:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=int), np.zeros(
+            (0, 2), dtype="double"
+        )
+
+    frames = np.concatenate(all_frames)
+    points = np.concatenate(all_points)
+    points_2d_coords = np.concatenate(all_coords).astype("double")
+
+    # .co runs from 0 to 1 on each axis of the image (with y going up)
+    points_2d_coords *= size
+    points_2d_coords[:, 1] = size[1] - points_2d_coords[:, 1]
+
+    order = np.argsort(frames, kind="stable")
+    return frames[order], points[order], points_2d_coords[order]
+
+
+def iter_frame_snapshots(
+    image_name,
+    frames,
     points_3d_coords,
-    points_2d_coords,
+    marker_table,
     camera_intrinsics,
     distortion_coefficients,
+    size,
 ):
-    """Calibrate current tracking camera using openCV. Sets the intrinsics
-    that are currently specified in the settings.
+    """Generate a snapshot for each of the given frames of a movie clip, one
+    at a time
 
     Args:
-        context: Blender context
-        clip: Blender movie clip
-        points_3d_coords: numpy array of 3D point coordinates
-        points_2d_coords: numpy array of 2D point coordinates
+        image_name: name of the image match of the movie clip
+        frames: numpy array of (clip) frame numbers to snapshot
+        points_3d_coords: numpy array of 3D coordinates of each point
+        marker_table: frames, points and 2D coordinates of every marker (as
+            returned by get_marker_table)
         camera_intrinsics: numpy array of camera intrinsics
         distortion_coefficients: numpy array of camera distortion coefficients
+        size: (width, height) of the movie clip
+
+    Yields:
+        solver.ImageSnapshot of the points with markers on each frame
+    """
+
+    marker_frames, marker_points, marker_coords = marker_table
+    starts = np.searchsorted(marker_frames, frames, side="left")
+    ends = np.searchsorted(marker_frames, frames, side="right")
+
+    for start, end in zip(starts, ends):
+        yield solver.ImageSnapshot(
+            image_name,
+            points_3d_coords[marker_points[start:end]],
+            marker_coords[start:end],
+            camera_intrinsics,
+            distortion_coefficients,
+            tuple(size),
+        )
+
+
+def clip_to_scene_frames(clip, frames):
+    """Map clip frame numbers (as used by markers) to scene frames, the same
+    way as Blender (BKE_movieclip_remap_clip_to_scene_frame). The clip's
+    frame_offset isn't applied - it only changes which frame of the footage
+    is loaded for a clip frame, not the frames of its markers.
+
+    Args:
+        clip: Blender movie clip
+        frames: numpy array of clip frame numbers
+
+    Returns:
+        Numpy array of scene frame numbers
+    """
+
+    return np.asarray(frames) + clip.frame_start - 1
+
+
+def insert_keyframes(obj, data_path, frames, values):
+    """Insert keyframes on every component of an object property, with one
+    bulk foreach_set per f-curve. Existing keyframes on the same frames are
+    replaced, others are kept.
+
+    Args:
+        obj: Blender object
+        data_path: property to keyframe e.g. "location"
+        frames: numpy array of (scene) frame numbers
+        values: numpy array of shape (number of frames, number of
+            components)
+    """
+
+    animation_data = obj.animation_data or obj.animation_data_create()
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new(f"{obj.name}Action")
+    fcurves = animation_data.action.fcurves
+
+    for index in range(values.shape[1]):
+        keyframes = np.column_stack([frames, values[:, index]])
+
+        fcurve = fcurves.find(data_path, index=index)
+        if fcurve is not None:
+            existing = np.empty(
+                len(fcurve.keyframe_points) * 2, dtype=np.float32
+            )
+            fcurve.keyframe_points.foreach_get("co", existing)
+            existing = existing.reshape(-1, 2)
+            existing = existing[~np.isin(existing[:, 0], frames)]
+
+            keyframes = np.concatenate([existing, keyframes])
+            keyframes = keyframes[np.argsort(keyframes[:, 0], kind="stable")]
+            fcurves.remove(fcurve)
+
+        fcurve = fcurves.new(
+            data_path, index=index, action_group="Object Transforms"
+        )
+        fcurve.keyframe_points.add(len(keyframes))
+        fcurve.keyframe_points.foreach_set(
+            "co", keyframes.astype(np.float32).ravel()
+        )
+        fcurve.update()
+
+
+def set_camera_keyframes(camera, frames, matrices):
+    """Keyframe the camera's location and rotation (in its current rotation
+    mode) to the given world matrices
+
+    Args:
+        camera: Blender camera object
+        frames: numpy array of (scene) frame numbers
+        matrices: list of 4x4 mathutils world matrices, one per frame
+    """
+
+    locations = np.array([matrix.to_translation() for matrix in matrices])
+    insert_keyframes(camera, "location", frames, locations)
+
+    rotation_mode = camera.rotation_mode
+    if rotation_mode == "QUATERNION":
+        rotations = np.array([matrix.to_quaternion() for matrix in matrices])
+        insert_keyframes(camera, "rotation_quaternion", frames, rotations)
+    elif rotation_mode == "AXIS_ANGLE":
+        rotations = []
+        for matrix in matrices:
+            axis, angle = matrix.to_quaternion().to_axis_angle()
+            rotations.append([angle, *axis])
+        insert_keyframes(
+            camera, "rotation_axis_angle", frames, np.array(rotations)
+        )
+    else:
+        # Keep eulers compatible with the previous frame, to avoid flips
+        # between +-180 degrees
+        rotations = [matrices[0].to_euler(rotation_mode)]
+        for matrix in matrices[1:]:
+            rotations.append(matrix.to_euler(rotation_mode, rotations[-1]))
+        insert_keyframes(
+            camera, "rotation_euler", frames, np.array(rotations)
+        )
+
+
+def solve_pnp_video(self, context):
+    """Solve camera pose for every frame of the current image's movie clip
+    that has markers, warm-starting each frame from the previous one. The
+    camera is keyframed to the solved poses.
+
+    Args:
+        context: Blender context
 
     Returns:
         Status for operator - cancelled or finished
     """
 
     settings = context.scene.match_settings
-    npoints = points_3d_coords.shape[0]
-    size = clip.size
+    current_image = props.get_current_image_match(settings)
+    clip = current_image.movie_clip
+    size = tuple(clip.size)
+    start_time = time.perf_counter()
+
+    if not clip.tracking.objects[0].tracks:
+        self.report({"ERROR"}, "Please add markers for the 2D points")
+        return {"CANCELLED"}
 
-    if npoints < 6:
+    complete_matches = get_complete_point_matches(current_image.point_matches)
+    if len(complete_matches) < 4:
         self.report(
             {"ERROR"},
-            "Not enough point pairs, use at least 6 markers to calibrate a camera.",
+            "Not enough point pairs, use at least 4 markers to solve a camera pose.",
         )
         return {"CANCELLED"}
 
-    flags = (
-        cv.CALIB_USE_INTRINSIC_GUESS
-        + cv.CALIB_FIX_ASPECT_RATIO
-        + cv.CALIB_ZERO_TANGENT_DIST
-        + (
-            cv.CALIB_FIX_PRINCIPAL_POINT
-            if not settings.calibrate_principal_point
-            else 0
-        )
-        + (
-            cv.CALIB_FIX_FOCAL_LENGTH
-            if not settings.calibrate_focal_length
-            else 0
-        )
-        + (cv.CALIB_FIX_K1 if not settings.calibrate_distortion_k1 else 0)
-        + (cv.CALIB_FIX_K2 if not settings.calibrate_distortion_k2 else 0)
-        + (cv.CALIB_FIX_K3 if not settings.calibrate_distortion_k3 else 0)
+    points_3d_coords = get_point_3d_locations(current_image, complete_matches)
+    track_indices = get_track_indices(
+        clip, [point_match.point_2d for point_match in complete_matches]
     )
+    marker_table = get_marker_table(clip, track_indices)
+    frames = np.unique(marker_table[0])
 
-    ret, camera_intrinsics, distortion_coefficients, _, _ = cv.calibrateCamera(
-        np.asarray([points_3d_coords], dtype="float32"),
-        np.asarray([points_2d_coords], dtype="float32"),
-        size,
-        camera_intrinsics,
-        distortion_coefficients,
-        flags=flags,
+    clip_camera = clip.tracking.camera
+    results = solver.solve_image_sequence(
+        iter_frame_snapshots(
+            current_image.name,
+            frames,
+            points_3d_coords,
+            marker_table,
+            get_camera_intrinsics(clip_camera, size),
+            get_distortion_coefficients(self, clip_camera),
+            size,
+        ),
+        get_solver_options(settings, current_image),
     )
 
-    settings.pnp_calibrate_msg = "Reprojection Error: %.2f" % ret
+    # Only keep the pose of each frame (not the full results), so memory
+    # doesn't grow with the number of points per frame
+    solved_frames = []
+    matrices = []
+    errors = []
+    first_result = None
+    for frame, result in zip(frames, results):
+        if not result.success:
+            continue
+
+        if first_result is None:
+            first_result = result
+        solved_frames.append(frame)
+        matrices.append(get_camera_matrix_world(result.rvec, result.tvec))
+        errors.append(result.error)
+
+    if first_result is None:
+        settings.pnp_solve_video_msg = "solvePnP failed on every frame!"
+        self.report({"ERROR"}, settings.pnp_solve_video_msg)
+        return {"CANCELLED"}
 
-    # set picture and camera metrics
+    # Set up camera intrinsics / background, then animate its transform
+    set_camera_pose(
+        context, current_image, first_result.rvec, first_result.tvec
+    )
+    set_camera_keyframes(
+        current_image.camera,
+        clip_to_scene_frames(clip, solved_frames),
+        matrices,
+    )
+    context.scene.camera = current_image.camera
+
+    elapsed_time = time.perf_counter() - start_time
+    settings.pnp_solve_video_msg = (
+        f"Solved {len(solved_frames)}/{len(frames)} frames in "
+        f"{elapsed_time:.2f}s (median error {np.median(errors):.2f})"
+    )
+    self.report({"INFO"}, settings.pnp_solve_video_msg)
+
+    return {"FINISHED"}
+
+
+def get_calibration_flags(settings):
+    """Get OpenCV calibration flags for the intrinsics that are currently
+    specified in the settings"""
+
+    return solver.calibration_flags(
+        focal_length=settings.calibrate_focal_length,
+        principal_point=settings.calibrate_principal_point,
+        distortion_k1=settings.calibrate_distortion_k1,
+        distortion_k2=settings.calibrate_distortion_k2,
+        distortion_k3=settings.calibrate_distortion_k3,
+    )
+
+
+def set_camera_intrinsics(
+    settings, clip, camera_intrinsics, distortion_coefficients
+):
+    """Set the intrinsics that are currently specified in the settings on the
+    tracking camera of the given clip
+
+    Args:
+        settings: image match settings
+        clip: Blender movie clip
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+    """
+
+    size = clip.size
     tracking_camera = clip.tracking.camera
 
     if settings.calibrate_focal_length:
@@ -392,6 +966,360 @@ def calibrate_camera(
         tracking_camera.brown_k2 = distortion_coefficients[1]
         tracking_camera.brown_k3 = distortion_coefficients[4]
 
+
+def calibrate_camera(self, context, snapshot):
+    """Calibrate current tracking camera using openCV. Sets the intrinsics
+    that are currently specified in the settings.
+
+    Args:
+        context: Blender context
+        snapshot: solver.ImageSnapshot of the current image match
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    settings = context.scene.match_settings
+
+    if snapshot.npoints < 6:
+        self.report(
+            {"ERROR"},
+            "Not enough point pairs, use at least 6 markers to calibrate a camera.",
+        )
+        return {"CANCELLED"}
+
+    result, is_cached = calibrate_images_cached(
+        snapshot.name, [snapshot], get_calibration_flags(settings)
+    )
+
+    settings.pnp_calibrate_msg = "Reprojection Error: %.2f" % result.error
+    if is_cached:
+        settings.pnp_calibrate_msg += " (cached)"
+
+    # set picture and camera metrics
+    current_image = props.find_image_match(settings, snapshot.name)
+    set_camera_intrinsics(
+        settings,
+        current_image.movie_clip,
+        result.camera_intrinsics,
+        result.distortion_coefficients,
+    )
+    set_point_residuals(current_image, result.residuals[0])
+
+    return {"FINISHED"}
+
+
+def get_camera_group(settings, image_match):
+    """Get all image matches in the same camera group as image_match (i.e.
+    taken with the same physical camera). Includes image_match itself."""
+
+    if image_match.camera_group == "":
+        return [image_match]
+
+    return [
+        other_image
+        for other_image in settings.image_matches
+        if other_image.camera_group == image_match.camera_group
+    ]
+
+
+def calibrate_camera_group(self, context):
+    """Calibrate the tracking cameras of all images in the current image's
+    camera group using openCV, with one multi-view calibration. The shared
+    intrinsics (those currently specified in the settings) are set on every
+    image's tracking camera.
+
+    Args:
+        context: Blender context
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    settings = context.scene.match_settings
+    current_image = props.get_current_image_match(settings)
+    size = tuple(current_image.movie_clip.size)
+
+    # Current image goes first, so its camera is used as the initial guess
+    group = get_camera_group(settings, current_image)
+    group.sort(key=lambda image_match: image_match != current_image)
+
+    snapshots = []
+    for image_match in group:
+        if tuple(image_match.movie_clip.size) != size:
+            self.report(
+                {"WARNING"},
+                f"Ignoring {image_match.name}, image size differs from "
+                "current image",
+            )
+            continue
+
+        snapshot = get_image_snapshot(self, image_match)
+
+        # OpenCV needs at least 6 points to estimate the pose of each view
+        if snapshot.npoints < 6:
+            self.report(
+                {"WARNING"},
+                f"Ignoring {image_match.name}, use at least 6 markers "
+                "per image to calibrate a camera.",
+            )
+            continue
+
+        snapshots.append(snapshot)
+
+    if not snapshots:
+        self.report(
+            {"ERROR"},
+            "Not enough point pairs, use at least 6 markers to calibrate a camera.",
+        )
+        return {"CANCELLED"}
+
+    result, is_cached = calibrate_images_cached(
+        current_image.name, snapshots, get_calibration_flags(settings)
+    )
+
+    settings.pnp_calibrate_msg = "Reprojection Error: %.2f (%d images)" % (
+        result.error,
+        len(snapshots),
+    )
+    if is_cached:
+        settings.pnp_calibrate_msg += " (cached)"
+
+    for snapshot, residuals in zip(snapshots, result.residuals):
+        image_match = props.find_image_match(settings, snapshot.name)
+        set_camera_intrinsics(
+            settings,
+            image_match.movie_clip,
+            result.camera_intrinsics,
+            result.distortion_coefficients,
+        )
+        set_point_residuals(image_match, residuals)
+
+    return {"FINISHED"}
+
+
+def get_bundle_intrinsic_names(settings):
+    """Get names of intrinsics to refine in bundle adjustment - those that
+    are currently specified in the calibration settings"""
+
+    if not settings.bundle_refine_intrinsics:
+        return ()
+
+    names = []
+    if settings.calibrate_focal_length:
+        names.append("focal")
+    if settings.calibrate_principal_point:
+        names.extend(["cx", "cy"])
+    if settings.calibrate_distortion_k1:
+        names.append("k1")
+    if settings.calibrate_distortion_k2:
+        names.append("k2")
+    if settings.calibrate_distortion_k3:
+        names.append("k3")
+
+    return tuple(names)
+
+
+def bundle_adjust_images(self, context):
+    """Jointly refine the poses of all solved images (and optionally their
+    intrinsics and 3D points) with bundle adjustment. 3D points of different
+    images closer than the merge distance are treated as the same point.
+    Outliers of the last robust solve are left out.
+
+    Args:
+        context: Blender context
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    settings = context.scene.match_settings
+
+    images = []
+    group_keys = {}
+    camera_groups = []
+    group_intrinsics = []
+    group_distortions = []
+    rvecs = []
+    tvecs = []
+    points_2d = []
+    points_3d = []
+    empties = []
+    observations_camera = []
+    observations_inlier = []
+
+    for image_match in settings.image_matches:
+        if not image_match.is_pose_solved:
+            continue
+
+        snapshot = get_image_snapshot(self, image_match)
+        if snapshot.npoints < 4:
+            self.report(
+                {"WARNING"},
+                f"Ignoring {image_match.name}, use at least 4 markers "
+                "to solve a camera pose.",
+            )
+            continue
+
+        # Images in the same camera group (and with the same size) share
+        # intrinsics
+        group_key = (
+            image_match.camera_group or image_match.name,
+            snapshot.image_size,
+        )
+        if group_key not in group_keys:
+            group_keys[group_key] = len(group_keys)
+            group_intrinsics.append(snapshot.camera_intrinsics)
+            group_distortions.append(snapshot.distortion_coefficients)
+
+        complete = get_complete_point_mask(image_match.point_matches)
+        empties.extend(
+            point_match.point_3d
+            for point_match, is_complete in zip(
+                image_match.point_matches, complete
+            )
+            if is_complete
+        )
+        is_inlier = np.zeros(len(image_match.point_matches), dtype=bool)
+        image_match.point_matches.foreach_get("is_inlier", is_inlier)
+        observations_inlier.append(is_inlier[complete])
+
+        observations_camera.append(np.full(snapshot.npoints, len(images)))
+        camera_groups.append(group_keys[group_key])
+        rvecs.append(np.array(image_match.pose_rvec))
+        tvecs.append(np.array(image_match.pose_tvec))
+        points_2d.append(snapshot.points_2d_coords)
+        points_3d.append(snapshot.points_3d_coords)
+        images.append(image_match)
+
+    if not images:
+        self.report({"ERROR"}, "No solved images to bundle adjust")
+        return {"CANCELLED"}
+
+    all_observations_camera = np.concatenate(observations_camera)
+    all_observations_2d = np.concatenate(points_2d)
+    all_observations_3d = np.concatenate(points_3d)
+
+    # Only inliers of the last robust solve are adjusted
+    inliers = np.flatnonzero(np.concatenate(observations_inlier))
+    if inliers.shape[0] == 0:
+        self.report({"ERROR"}, "No inlier points to bundle adjust")
+        return {"CANCELLED"}
+    observations_camera = all_observations_camera[inliers]
+    observations_2d = all_observations_2d[inliers]
+    observations_3d = all_observations_3d[inliers]
+
+    # Merge 3D points of different images that lie close together
+    labels = bundle.merge_close_points(
+        observations_3d, settings.bundle_merge_distance
+    )
+    nlabels = np.max(labels) + 1 if labels.shape[0] > 0 else 0
+
+    # Only points seen by more than one image can be refined - the rest
+    # stay fixed, and anchor the solution to the 3D model
+    cameras_per_label = np.zeros(nlabels, dtype=int)
+    unique_pairs = np.unique(
+        np.stack([labels, observations_camera], axis=1), axis=0
+    )
+    np.add.at(cameras_per_label, unique_pairs[:, 0], 1)
+    is_free_label = (cameras_per_label > 1) & settings.bundle_refine_points
+    is_free = is_free_label[labels]
+
+    # Free points start at the average of their merged locations. Fixed
+    # points aren't merged, so each keeps its original location.
+    free_labels = np.flatnonzero(is_free_label)
+    nfree = free_labels.shape[0]
+    free_index = np.full(nlabels, -1, dtype=int)
+    free_index[free_labels] = np.arange(nfree)
+
+    observations_point = np.empty(labels.shape[0], dtype=int)
+    observations_point[is_free] = free_index[labels[is_free]]
+    observations_point[~is_free] = nfree + np.arange(np.sum(~is_free))
+
+    points_3d_coords = np.zeros((nfree + np.sum(~is_free), 3))
+    np.add.at(
+        points_3d_coords,
+        observations_point[is_free],
+        observations_3d[is_free],
+    )
+    points_3d_coords[:nfree] /= np.bincount(
+        observations_point[is_free], minlength=nfree
+    )[:, None]
+    points_3d_coords[nfree:] = observations_3d[~is_free]
+    free_points = np.arange(points_3d_coords.shape[0]) < nfree
+
+    result = bundle.bundle_adjust(
+        np.array(rvecs),
+        np.array(tvecs),
+        np.array(camera_groups),
+        np.array(group_intrinsics),
+        np.array(group_distortions),
+        points_3d_coords,
+        observations_camera,
+        observations_point,
+        observations_2d,
+        free_points,
+        intrinsic_names=get_bundle_intrinsic_names(settings),
+        point_weight=settings.bundle_point_weight,
+        max_iterations=settings.bundle_max_iterations,
+    )
+
+    # Set intrinsics first, as camera settings depend on them
+    if settings.bundle_refine_intrinsics:
+        for image_match, group in zip(images, camera_groups):
+            set_camera_intrinsics(
+                settings,
+                image_match.movie_clip,
+                result.camera_intrinsics[group],
+                result.distortion_coefficients[group],
+            )
+
+    # 3D point of every observation (outliers included) after adjusting
+    adjusted_3d = all_observations_3d.copy()
+    adjusted_3d[inliers] = result.points_3d_coords[observations_point]
+
+    for observation in inliers[is_free]:
+        empties[observation].location = adjusted_3d[observation]
+
+    for i, image_match in enumerate(images):
+        group = camera_groups[i]
+        observations = all_observations_camera == i
+        inlier_observations = inliers[observations_camera == i]
+        residuals = solver.reprojection_residuals(
+            adjusted_3d[observations],
+            all_observations_2d[observations],
+            result.rvecs[i],
+            result.tvecs[i],
+            result.camera_intrinsics[group],
+            result.distortion_coefficients[group],
+        )
+        set_point_residuals(image_match, residuals)
+        set_solved_pose(
+            image_match,
+            result.rvecs[i],
+            result.tvecs[i],
+            solver.pnp_reprojection_error(residuals),
+            "BUNDLE",
+            {},
+        )
+        set_pose_uncertainty(
+            image_match,
+            solver.pose_uncertainty(
+                adjusted_3d[inlier_observations],
+                all_observations_2d[inlier_observations],
+                result.rvecs[i],
+                result.tvecs[i],
+                result.camera_intrinsics[group],
+                result.distortion_coefficients[group],
+            ),
+        )
+        set_camera_pose(context, image_match, result.rvecs[i], result.tvecs[i])
+
+    settings.pnp_bundle_msg = (
+        f"RMS: {result.initial_rms:.2f} -> {result.final_rms:.2f} px "
+        f"({len(images)} images, {result.iterations} iterations)"
+    )
+
     return {"FINISHED"}
 
 
@@ -404,7 +1332,7 @@ class PNP_OT_reset_camera(bpy.types.Operator):
 
     def execute(self, context):
         settings = context.scene.match_settings
-        current_image = settings.image_matches[settings.current_image_name]
+        current_image = props.get_current_image_match(settings)
         clip = current_image.movie_clip
 
         tracking_camera = clip.tracking.camera
@@ -436,7 +1364,125 @@ class PNP_OT_pose_camera(bpy.types.Operator):
             return {"CANCELLED"}
 
         # call solver
-        return solve_pnp(*get_scene_info(self, context))
+        current_image = props.get_current_image_match(settings)
+        return solve_pnp(
+            self, context, get_image_snapshot(self, current_image)
+        )
+
+
+class PNP_OT_pose_all_cameras(bpy.types.Operator):
+    """Solve camera extrinsics of all images using their available 2D-3D
+    point matches. Images are solved in parallel"""
+
+    bl_idname = "pnp.solve_pnp_all"
+    bl_label = "Solve all camera extrinsics"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+
+        if settings.model.mode != "OBJECT":
+            self.report({"ERROR"}, "Please switch to Object Mode")
+            return {"CANCELLED"}
+
+        start_time = time.perf_counter()
+
+        # Snapshot all images on the main thread, as bpy can't be accessed
+        # from the workers
+        snapshots = []
+        options = []
+        failed_images = []
+        weak_images = []
+        for image_match in settings.image_matches:
+            snapshot = get_image_snapshot(self, image_match)
+            if snapshot.npoints < 4:
+                failed_images.append(image_match.name)
+                self.report(
+                    {"WARNING"},
+                    f"{image_match.name}: not enough point pairs, use at "
+                    "least 4 markers to solve a camera pose.",
+                )
+                continue
+
+            snapshots.append(snapshot)
+            options.append(get_solver_options(settings, image_match))
+
+        results, ncached = solve_images_cached(snapshots, options)
+
+        # Apply all results in one pass
+        for result in results:
+            name = result.name
+            if not result.success:
+                failed_images.append(name)
+                self.report({"WARNING"}, f"{name}: solvePnP failed!")
+                continue
+
+            image_match = props.find_image_match(settings, name)
+            apply_pose_result(context, image_match, result)
+            self.report({"INFO"}, f"{name}: {get_solve_message(result)}")
+
+            if props.is_weakly_constrained(settings, image_match):
+                weak_images.append(name)
+                self.report(
+                    {"WARNING"},
+                    f"{name}: weakly constrained camera (position sigma "
+                    f"{image_match.position_sigma:.3f}, rotation sigma "
+                    f"{image_match.rotation_sigma:.2f} deg)",
+                )
+
+        current_image = props.get_current_image_match(settings)
+        if current_image is not None:
+            context.scene.camera = current_image.camera
+
+        elapsed_time = time.perf_counter() - start_time
+        n_images = len(settings.image_matches)
+        settings.pnp_solve_all_msg = (
+            f"Solved {n_images - len(failed_images)}/{n_images} images "
+            f"in {elapsed_time:.2f}s"
+        )
+        if ncached:
+            settings.pnp_solve_all_msg += f", {ncached} cached"
+        if weak_images:
+            settings.pnp_solve_all_msg += f", {len(weak_images)} weak"
+        self.report({"INFO"}, settings.pnp_solve_all_msg)
+
+        return {"FINISHED"}
+
+
+class PNP_OT_pose_camera_video(bpy.types.Operator):
+    """Solve camera extrinsics for every frame of the current image's movie
+    clip that has markers, and keyframe the camera to match"""
+
+    bl_idname = "pnp.solve_pnp_video"
+    bl_label = "Solve camera extrinsics for every frame"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+
+        if settings.model.mode != "OBJECT":
+            self.report({"ERROR"}, "Please switch to Object Mode")
+            return {"CANCELLED"}
+
+        return solve_pnp_video(self, context)
+
+
+class PNP_OT_bundle_adjust(bpy.types.Operator):
+    """Jointly refine the poses of all solved images using bundle
+    adjustment"""
+
+    bl_idname = "pnp.bundle_adjust"
+    bl_label = "Bundle adjust all images"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+
+        if settings.model.mode != "OBJECT":
+            self.report({"ERROR"}, "Please switch to Object Mode")
+            return {"CANCELLED"}
+
+        return bundle_adjust_images(self, context)
 
 
 class PNP_OT_calibrate_camera(bpy.types.Operator):
@@ -453,5 +1499,14 @@ class PNP_OT_calibrate_camera(bpy.types.Operator):
             self.report({"ERROR"}, "Please switch to Object Mode")
             return {"CANCELLED"}
 
+        current_image = props.get_current_image_match(settings)
+        if (
+            settings.calibrate_camera_group
+            and current_image.camera_group != ""
+        ):
+            return calibrate_camera_group(self, context)
+
         # call solver
-        return calibrate_camera(*get_scene_info(self, context))
+        return calibrate_camera(
+            self, context, get_image_snapshot(self, current_image)
+        )
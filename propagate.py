@@ -0,0 +1,603 @@
+import bpy
+import os
+import cv2 as cv
+import numpy as np
+from mathutils import Vector
+from . import cache
+from . import features
+from . import image
+from . import pnp
+from . import props
+
+
+# Maximum number of images to keep features for. Adding a new image only
+# needs features of the new image to be calculated, as long as its
+# neighbours are still cached.
+MAX_CACHED_FEATURES = 64
+
+feature_cache = cache.ResultCache(max_entries=MAX_CACHED_FEATURES)
+
+# Colour of 2D points predicted by guided matching, until they're accepted
+PREDICTED_TRACK_COLOR = (1.0, 0.5, 0.0)
+
+# Fraction of the image size that candidate 3D points can project outside
+# the image (ignoring lens distortion) and still be projected properly
+VIEW_CULL_MARGIN = 0.1
+
+
+def get_image_features(image_match, detector_name, max_features):
+    """Get features of the image match's movie clip (from the cache, if the
+    image file hasn't changed since they were detected)
+
+    Returns:
+        features.ImageFeatures, or None if the image can't be read
+    """
+
+    clip = image_match.movie_clip
+    filepath = bpy.path.abspath(clip.filepath)
+    try:
+        modified_time = os.path.getmtime(filepath)
+    except OSError:
+        return None
+
+    inputs_key = (filepath, modified_time, detector_name, max_features)
+    image_features = feature_cache.get(
+        image_match.name, "features", inputs_key
+    )
+    if image_features is not None:
+        return image_features
+
+    image_pixels = features.load_grayscale_image(filepath)
+    if image_pixels is None:
+        return None
+
+    image_features = features.detect_features(
+        image_pixels, detector_name, max_features
+    )
+
+    # Make sure keypoints are in the same pixel coordinates as the clip's
+    # markers
+    scale = np.array(clip.size) / image_pixels.shape[::-1]
+    if not np.allclose(scale, 1):
+        image_features = features.ImageFeatures(
+            image_features.keypoints * scale.astype(np.float32),
+            image_features.descriptors,
+            image_features.is_binary,
+        )
+
+    feature_cache.put(image_match.name, "features", inputs_key, image_features)
+    return image_features
+
+
+def get_point_3d_locations(image_match):
+    """Get numpy array of the location of every 3D point of the image match,
+    and list of the corresponding point matches"""
+
+    point_matches = [
+        point_match
+        for point_match in image_match.point_matches
+        if point_match.is_point_3d_initialised
+    ]
+    locations = np.array(
+        [point_match.point_3d.location for point_match in point_matches],
+        dtype="double",
+    ).reshape(-1, 3)
+
+    return locations, point_matches
+
+
+def propagate_points(self, context):
+    """Place 2D points on the current image for 3D points of overlapping,
+    already matched images. Features are matched between the current image
+    and each other image to transfer their 2D points.
+
+    Args:
+        context: Blender context
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    settings = context.scene.match_settings
+    current_image = props.get_current_image_match(settings)
+    clip = current_image.movie_clip
+    size = tuple(clip.size)
+
+    current_features = get_image_features(
+        current_image, settings.feature_detector, settings.feature_max_count
+    )
+    if current_features is None:
+        self.report({"ERROR"}, f"Can't read image of {current_image.name}")
+        return {"CANCELLED"}
+
+    # Index of the current image's features, shared by every neighbour
+    current_matcher = None
+    if current_features.nfeatures >= 2:
+        current_matcher = features.create_trained_matcher(current_features)
+
+    # Transfer points from every other image with point pairs
+    transfers = []
+    for image_match in settings.image_matches:
+        if image_match == current_image:
+            continue
+        if not pnp.get_complete_point_mask(image_match.point_matches).any():
+            continue
+
+        points_2d_coords, points_3d_coords = pnp.get_2D_3D_point_coordinates(
+            self, image_match
+        )
+        if points_3d_coords.shape[0] == 0:
+            continue
+
+        neighbour_features = get_image_features(
+            image_match, settings.feature_detector, settings.feature_max_count
+        )
+        if neighbour_features is None:
+            self.report({"WARNING"}, f"Can't read image of {image_match.name}")
+            continue
+
+        matched_neighbour, matched_current = features.match_features(
+            neighbour_features, current_features, matcher_b=current_matcher
+        )
+        transferred, valid, ninliers = features.transfer_points(
+            points_2d_coords,
+            matched_neighbour,
+            matched_current,
+            size,
+            settings.propagate_method,
+            settings.propagate_threshold,
+            min_inliers=settings.propagate_min_inliers,
+        )
+        if np.any(valid):
+            transfers.append(
+                (ninliers, transferred[valid], points_3d_coords[valid])
+            )
+
+    if not transfers:
+        settings.propagate_msg = "No overlapping matched images found"
+        self.report({"WARNING"}, settings.propagate_msg)
+        return {"CANCELLED"}
+
+    # Use the neighbours with the most inlier matches first
+    transfers.sort(key=lambda transfer: transfer[0], reverse=True)
+    transfers = transfers[: settings.propagate_max_neighbours]
+
+    existing_locations, existing_matches = get_point_3d_locations(
+        current_image
+    )
+    added_locations = np.empty(
+        (sum(transfer[2].shape[0] for transfer in transfers), 3)
+    )
+    nadded_locations = 0
+    merge_distance = settings.propagate_merge_distance
+    frame = context.scene.frame_current
+    nadded = 0
+
+    for _, transferred, points_3d_coords in transfers:
+        for point_2d_coords, location in zip(transferred, points_3d_coords):
+            # Skip 3D points that were already added from another image
+            if np.any(
+                np.linalg.norm(
+                    added_locations[:nadded_locations] - location, axis=1
+                )
+                <= merge_distance
+            ):
+                continue
+            added_locations[nadded_locations] = location
+            nadded_locations += 1
+
+            # 0 to 1 on each axis, with y going up
+            marker_coordinates = (
+                point_2d_coords[0] / size[0],
+                1 - point_2d_coords[1] / size[1],
+            )
+
+            # Re-use a matching 3D point of the current image, if there is
+            # one without a 2D point
+            point_match = None
+            if existing_locations.shape[0] > 0:
+                distances = np.linalg.norm(
+                    existing_locations - location, axis=1
+                )
+                closest = np.argmin(distances)
+                if distances[closest] <= merge_distance:
+                    point_match = existing_matches[closest]
+                    if point_match.is_point_2d_initialised:
+                        continue
+
+            track = image.new_point_2d(clip, frame, marker_coordinates)
+            track.select = True
+
+            if point_match is None:
+                point_match = current_image.point_matches.add()
+                point_match.is_point_3d_initialised = True
+                point_match.point_3d = image.new_point_3d(
+                    settings, current_image, location
+                )
+
+            point_match.is_point_2d_initialised = True
+            point_match.point_2d = track.name
+            nadded += 1
+
+    settings.propagate_msg = (
+        f"Added {nadded} points from {len(transfers)} images"
+    )
+    self.report({"INFO"}, settings.propagate_msg)
+
+    return {"FINISHED"}
+
+
+class IMAGE_OT_propagate_points(bpy.types.Operator):
+    """Place 2D points on the current image, for 3D points already matched
+    in overlapping images (using feature matching between the images)"""
+
+    bl_idname = "imagematches.propagate_points"
+    bl_label = "Propagate points from matched images"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+
+        if settings.model is None:
+            self.report({"ERROR"}, "No 3D model selected")
+            return {"CANCELLED"}
+
+        return propagate_points(self, context)
+
+
+def get_candidate_points(settings, current_image):
+    """Get numpy array of 3D points to predict in the current image - either
+    3D points placed in other images, or vertices of the 3D model (in world
+    coordinates)"""
+
+    if settings.guided_source == "MODEL":
+        mesh = settings.model.data
+        vertices = np.empty(len(mesh.vertices) * 3, dtype="double")
+        mesh.vertices.foreach_get("co", vertices)
+        vertices = vertices.reshape(-1, 3)
+
+        matrix = np.array(settings.model.matrix_world, dtype="double")
+        return vertices @ matrix[:3, :3].T + matrix[:3, 3]
+
+    locations = [
+        point_match.point_3d.location
+        for image_match in settings.image_matches
+        if image_match != current_image
+        for point_match in image_match.point_matches
+        if point_match.is_point_3d_initialised
+        and not point_match.is_predicted
+    ]
+    return np.array(locations, dtype="double").reshape(-1, 3)
+
+
+def get_in_view_indices(
+    points_3d_coords, rvec, tvec, camera_intrinsics, size, max_points
+):
+    """Cheaply cull 3D points to those roughly in view of the camera (in
+    front of it, and inside the image with a margin for lens distortion),
+    before projecting them properly. If more than max_points remain, they're
+    evenly subsampled.
+
+    Returns:
+        Numpy array of indices of the points in view
+    """
+
+    rmat, _ = cv.Rodrigues(np.asarray(rvec, dtype="double"))
+    camera_coords = points_3d_coords @ rmat.T + np.ravel(tvec)
+    depths = camera_coords[:, 2]
+
+    in_front = np.flatnonzero(depths > 0)
+    image_coords = (
+        camera_coords[in_front, :2] / depths[in_front, None]
+    ) @ camera_intrinsics[:2, :2].T + camera_intrinsics[:2, 2]
+
+    margin = VIEW_CULL_MARGIN * size
+    in_view = in_front[
+        np.all(image_coords >= -margin, axis=1)
+        & np.all(image_coords < size + margin, axis=1)
+    ]
+
+    if in_view.shape[0] > max_points:
+        step = int(np.ceil(in_view.shape[0] / max_points))
+        in_view = in_view[::step]
+
+    return in_view
+
+
+def project_candidate_points(
+    points_3d_coords, rvec, tvec, camera_intrinsics, distortion_coefficients
+):
+    """Project 3D points into an image with the given pose
+
+    Returns:
+        points_2d_coords - numpy array of projected pixel coordinates
+        depths - numpy array of the depth of each point in front of the
+            camera (negative if behind)
+    """
+
+    rmat, _ = cv.Rodrigues(np.asarray(rvec, dtype="double"))
+    depths = points_3d_coords @ rmat[2] + np.ravel(tvec)[2]
+
+    points_2d_coords, _ = cv.projectPoints(
+        points_3d_coords,
+        np.asarray(rvec, dtype="double"),
+        np.asarray(tvec, dtype="double"),
+        camera_intrinsics,
+        distortion_coefficients,
+    )
+
+    return points_2d_coords.reshape(-1, 2), depths
+
+
+def get_nearest_in_grid(points_2d_coords, depths, spacing):
+    """Split the image into square cells of size spacing (in pixels), and
+    get indices of the nearest point (lowest depth) in each cell"""
+
+    if points_2d_coords.shape[0] == 0:
+        return np.zeros(0, dtype=int)
+
+    cells = np.floor(points_2d_coords / spacing).astype(np.int64)
+    order = np.lexsort((depths, cells[:, 1], cells[:, 0]))
+    _, first_in_cell = np.unique(cells[order], axis=0, return_index=True)
+
+    return order[first_in_cell]
+
+
+def is_point_visible(model, camera_centre, location, tolerance):
+    """Check if a 3D point can be seen from the camera centre, i.e. the model
+    isn't in the way"""
+
+    hit_location, _, _ = image.obj_ray_cast(
+        camera_centre, location, model, model.matrix_world
+    )
+    if hit_location is None:
+        return True
+
+    hit_location = model.matrix_world @ hit_location
+    return (hit_location - camera_centre).length >= (
+        location - camera_centre
+    ).length - tolerance
+
+
+def get_predicted_point_indices(point_matches):
+    """Get indices of all point matches predicted by guided matching"""
+
+    return [
+        i
+        for i, point_match in enumerate(point_matches)
+        if point_match.is_predicted
+    ]
+
+
+def remove_predicted_points(image_match):
+    """Delete all predicted points of the image match (their 2D tracks, 3D
+    empties and point matches)
+
+    Returns:
+        Number of point matches removed
+    """
+
+    point_matches = image_match.point_matches
+    predicted_indices = get_predicted_point_indices(point_matches)
+    if not predicted_indices:
+        return 0
+
+    tracks = image_match.movie_clip.tracking.objects[0].tracks
+    marker_grid = image.get_marker_grid(image_match.movie_clip)
+    bpy.ops.clip.select_all(action="DESELECT")
+    has_tracks = False
+
+    for i in predicted_indices:
+        point_match = point_matches[i]
+        if point_match.is_point_3d_initialised:
+            bpy.data.objects.remove(point_match.point_3d, do_unlink=True)
+        if point_match.is_point_2d_initialised:
+            tracks[point_match.point_2d].select = True
+            marker_grid.remove(point_match.point_2d)
+            has_tracks = True
+
+    # Couldn't see a simple way to delete a track directly, so use an ops
+    # call
+    if has_tracks:
+        bpy.ops.clip.delete_track(False)
+
+    for i in reversed(predicted_indices):
+        point_matches.remove(i)
+    image.invalidate_open_point_slots(image_match)
+
+    return len(predicted_indices)
+
+
+def predict_points(self, context):
+    """Project candidate 3D points through the solved camera of the current
+    image, and add those that are visible as predicted 2D-3D point matches.
+    Any previous predictions for the current image are replaced.
+
+    Args:
+        context: Blender context
+
+    Returns:
+        Status for operator - cancelled or finished
+    """
+
+    settings = context.scene.match_settings
+    current_image = props.get_current_image_match(settings)
+    clip = current_image.movie_clip
+    size = np.array(clip.size, dtype="double")
+
+    if not current_image.is_pose_solved:
+        self.report({"ERROR"}, "Solve the camera pose of this image first")
+        return {"CANCELLED"}
+
+    remove_predicted_points(current_image)
+
+    candidates = get_candidate_points(settings, current_image)
+    if candidates.shape[0] == 0:
+        settings.guided_msg = "No 3D points to predict"
+        self.report({"WARNING"}, settings.guided_msg)
+        return {"CANCELLED"}
+
+    clip_camera = clip.tracking.camera
+    rvec = np.array(current_image.pose_rvec, dtype="double")
+    tvec = np.array(current_image.pose_tvec, dtype="double")
+    camera_intrinsics = pnp.get_camera_intrinsics(clip_camera, clip.size)
+
+    # Only project candidates near the camera's view (e.g. a small part of a
+    # large model mesh)
+    candidates = candidates[
+        get_in_view_indices(
+            candidates,
+            rvec,
+            tvec,
+            camera_intrinsics,
+            size,
+            settings.guided_max_candidates,
+        )
+    ]
+    points_2d_coords, depths = project_candidate_points(
+        candidates,
+        rvec,
+        tvec,
+        camera_intrinsics,
+        pnp.get_distortion_coefficients(self, clip_camera),
+    )
+
+    in_view = (
+        (depths > 0)
+        & np.all(points_2d_coords >= 0, axis=1)
+        & np.all(points_2d_coords < size, axis=1)
+    )
+    in_view = np.flatnonzero(in_view)
+    nearest = in_view[
+        get_nearest_in_grid(
+            points_2d_coords[in_view],
+            depths[in_view],
+            settings.guided_min_spacing,
+        )
+    ]
+
+    # Skip candidates that already have a 3D point in the current image
+    existing_locations, _ = get_point_3d_locations(current_image)
+    if nearest.shape[0] > 0 and existing_locations.shape[0] > 0:
+        distances = np.linalg.norm(
+            candidates[nearest, None, :] - existing_locations[None, :, :],
+            axis=2,
+        )
+        nearest = nearest[
+            np.min(distances, axis=1) > settings.guided_merge_distance
+        ]
+
+    # Camera centre in world coordinates, for occlusion tests
+    rmat, _ = cv.Rodrigues(rvec)
+    camera_centre = Vector(-rmat.T @ tvec)
+
+    point_matches = current_image.point_matches
+    frame = context.scene.frame_current
+    npredicted = 0
+    for i in nearest:
+        location = Vector(candidates[i])
+        if settings.guided_check_occlusion and not is_point_visible(
+            settings.model,
+            camera_centre,
+            location,
+            settings.guided_occlusion_tolerance,
+        ):
+            continue
+
+        # 0 to 1 on each axis, with y going up
+        marker_coordinates = (
+            points_2d_coords[i][0] / size[0],
+            1 - points_2d_coords[i][1] / size[1],
+        )
+
+        # Predicted tracks are left unlocked, so they can be moved before
+        # being accepted
+        track = image.new_point_2d(
+            clip, frame, marker_coordinates, lock=False
+        )
+        track.use_custom_color = True
+        track.color = PREDICTED_TRACK_COLOR
+
+        point_match = point_matches.add()
+        point_match.is_predicted = True
+        point_match.is_point_2d_initialised = True
+        point_match.point_2d = track.name
+        point_match.is_point_3d_initialised = True
+        point_match.point_3d = image.new_point_3d(
+            settings, current_image, location
+        )
+        npredicted += 1
+
+    settings.guided_msg = f"Predicted {npredicted} points"
+    self.report({"INFO"}, settings.guided_msg)
+
+    return {"FINISHED"}
+
+
+class IMAGE_OT_predict_points(bpy.types.Operator):
+    """Predict where 3D points (from other images or the 3D model) appear in
+    the current image, using its solved camera pose"""
+
+    bl_idname = "imagematches.predict_points"
+    bl_label = "Predict points"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+
+        if settings.model is None:
+            self.report({"ERROR"}, "No 3D model selected")
+            return {"CANCELLED"}
+
+        return predict_points(self, context)
+
+
+class IMAGE_OT_accept_predicted_points(bpy.types.Operator):
+    """Accept all predicted points of the current image, so they're used
+    when solving"""
+
+    bl_idname = "imagematches.accept_predicted_points"
+    bl_label = "Accept predicted points"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+        current_image = props.get_current_image_match(settings)
+        point_matches = current_image.point_matches
+        tracks = current_image.movie_clip.tracking.objects[0].tracks
+        marker_grid = image.get_marker_grid(current_image.movie_clip)
+
+        predicted_indices = get_predicted_point_indices(point_matches)
+        for i in predicted_indices:
+            point_match = point_matches[i]
+            point_match.is_predicted = False
+
+            if point_match.is_point_2d_initialised:
+                track = tracks[point_match.point_2d]
+                track.lock = True
+                track.use_custom_color = False
+                marker_grid.insert(track)
+
+        settings.guided_msg = f"Accepted {len(predicted_indices)} points"
+        self.report({"INFO"}, settings.guided_msg)
+
+        return {"FINISHED"}
+
+
+class IMAGE_OT_reject_predicted_points(bpy.types.Operator):
+    """Delete all predicted points of the current image"""
+
+    bl_idname = "imagematches.reject_predicted_points"
+    bl_label = "Reject predicted points"
+    bl_options = {"UNDO"}
+
+    def execute(self, context):
+        settings = context.scene.match_settings
+        current_image = props.get_current_image_match(settings)
+
+        nremoved = remove_predicted_points(current_image)
+
+        settings.guided_msg = f"Rejected {nremoved} points"
+        self.report({"INFO"}, settings.guided_msg)
+
+        return {"FINISHED"}
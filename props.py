@@ -36,6 +36,139 @@ def update_active_point_match(self, context):
 
 export_types = [("BLENDER", "Blender", "", 1), ("THREEJS", "ThreeJS", "", 2)]
 
+pnp_solvers = [
+    ("SQPNP", "SQPnP", "SQPnP solver - a good general choice", 1),
+    ("EPNP", "EPnP", "EPnP solver - fast for many points", 2),
+    ("IPPE", "IPPE", "IPPE solver - for planar points only", 3),
+    ("ITERATIVE", "Iterative", "Iterative Levenberg-Marquardt solver", 4),
+    (
+        "BEST",
+        "Best of all",
+        "Run all solvers in parallel, and keep the pose with the lowest "
+        "reprojection error",
+        5,
+    ),
+]
+
+refine_methods = [
+    ("NONE", "None", "No refinement", 1),
+    ("LM", "Levenberg-Marquardt", "Levenberg-Marquardt refinement", 2),
+    (
+        "VVS",
+        "Virtual visual servoing",
+        "Virtual visual servoing refinement",
+        3,
+    ),
+]
+
+feature_detectors = [
+    ("ORB", "ORB", "ORB features - fast, good for most images", 1),
+    ("SIFT", "SIFT", "SIFT features - slower, but more robust to scale", 2),
+    ("AKAZE", "AKAZE", "AKAZE features - robust to blur and noise", 3),
+]
+
+propagate_methods = [
+    (
+        "HOMOGRAPHY",
+        "Homography",
+        "Map points with a homography - for images from a rotating camera, "
+        "or of mostly planar surfaces",
+        1,
+    ),
+    (
+        "FUNDAMENTAL",
+        "Fundamental",
+        "Move points with nearby feature matches, checked against the "
+        "fundamental matrix - for images from different positions",
+        2,
+    ),
+]
+
+guided_sources = [
+    (
+        "IMAGES",
+        "Other images",
+        "Predict 3D points already placed in other images",
+        1,
+    ),
+    ("MODEL", "Model vertices", "Predict vertices of the 3D model", 2),
+]
+
+proxy_sizes = [
+    ("25", "25%", "Proxy at 25% of the full image size", 1),
+    ("50", "50%", "Proxy at 50% of the full image size", 2),
+    ("75", "75%", "Proxy at 75% of the full image size", 3),
+]
+
+
+def is_weakly_constrained(settings, image_match):
+    """Check if the solved pose of the given image match has a larger
+    uncertainty than the thresholds in the settings"""
+
+    return image_match.is_pose_solved and (
+        image_match.position_sigma > settings.max_position_sigma
+        or image_match.rotation_sigma > settings.max_rotation_sigma
+    )
+
+
+
+# Index of image matches by name and by full name, for each settings (by
+# pointer). Rebuilt whenever the number of image matches changes or a hit is
+# out of date, and cleared on load / undo.
+image_match_indices = {}
+
+
+def get_image_match_indices(settings):
+    """Get dictionaries from image match name (and full name) to index in
+    settings.image_matches, building them if they're missing or out of date"""
+
+    key = settings.as_pointer()
+    nimages = len(settings.image_matches)
+    indices = image_match_indices.get(key)
+
+    if indices is None or indices[0] != nimages:
+        by_name = {}
+        by_full_name = {}
+        for i, image_match in enumerate(settings.image_matches):
+            by_name[image_match.name] = i
+            by_full_name[image_match.full_name] = i
+
+        indices = (nimages, by_name, by_full_name)
+        image_match_indices[key] = indices
+
+    return indices[1], indices[2]
+
+
+def find_image_match(settings, name, by_full_name=False):
+    """Get image match with the given name (or full name), or None if there
+    isn't one"""
+
+    for _ in range(2):
+        by_name, full_names = get_image_match_indices(settings)
+        index = (full_names if by_full_name else by_name).get(name)
+        if index is None:
+            # The index is rebuilt whenever the number of image matches
+            # changes, so a miss is final
+            return None
+
+        image_match = settings.image_matches[index]
+        found_name = (
+            image_match.full_name if by_full_name else image_match.name
+        )
+        if found_name == name:
+            return image_match
+
+        # Out of date (e.g. image matches were re-ordered) - rebuild
+        image_match_indices.pop(settings.as_pointer(), None)
+
+    return None
+
+
+def get_current_image_match(settings):
+    """Get the current image match, or None if no image is loaded"""
+
+    return find_image_match(settings, settings.current_image_name)
+
 
 class PointMatch(bpy.types.PropertyGroup):
     """Group of properties representing a 2D-3D point match"""
@@ -61,6 +194,27 @@ class PointMatch(bpy.types.PropertyGroup):
         description="Name of track for this 2D point",
     )
 
+    is_inlier: bpy.props.BoolProperty(
+        name="Inlier",
+        description="Was this point an inlier in the last robust solve?",
+        default=True,
+    )
+
+    reprojection_error: bpy.props.FloatProperty(
+        name="Reprojection error",
+        description="Distance (in pixels) between the 2D point and the "
+        "projected 3D point, from the last solve / calibration. -1 if not "
+        "calculated",
+        default=-1.0,
+    )
+
+    is_predicted: bpy.props.BoolProperty(
+        name="Predicted",
+        description="Was this point predicted by guided matching (and not "
+        "accepted yet)? Predicted points are ignored when solving",
+        default=False,
+    )
+
 
 class ImageMatch(bpy.types.PropertyGroup):
     """Group of properties representing an image to be matched"""
@@ -107,6 +261,93 @@ class ImageMatch(bpy.types.PropertyGroup):
         type=PointMatch, name="Current points", description="Current points"
     )
 
+    camera_group: bpy.props.StringProperty(
+        name="Camera group",
+        default="",
+        description="Images with the same camera group were taken with the "
+        "same physical camera, and can be calibrated together",
+    )
+
+    is_pose_solved: bpy.props.BoolProperty(
+        name="Pose solved",
+        description="Has the camera pose of this image been solved?",
+        default=False,
+    )
+
+    pose_rvec: bpy.props.FloatVectorProperty(
+        name="Pose rotation vector",
+        description="Rotation vector (world to OpenCV camera) of the last "
+        "solved pose",
+        size=3,
+    )
+
+    pose_tvec: bpy.props.FloatVectorProperty(
+        name="Pose translation vector",
+        description="Translation vector (world to OpenCV camera) of the last "
+        "solved pose",
+        size=3,
+    )
+
+    pose_error: bpy.props.FloatProperty(
+        name="Pose reprojection error",
+        description="Reprojection error of the last solved pose",
+        default=0.0,
+    )
+
+    pose_unrefined_error: bpy.props.FloatProperty(
+        name="Pose unrefined reprojection error",
+        description="Reprojection error of the last solved pose before "
+        "refinement, which warm-started solves are compared against",
+        default=0.0,
+    )
+
+    pose_solver: bpy.props.StringProperty(
+        name="Pose solver",
+        description="Solver that found the last solved pose",
+        default="",
+    )
+
+    pose_solver_timings: bpy.props.StringProperty(
+        name="Pose solver timings",
+        description="Time taken by each solver run for the last solved pose",
+        default="",
+    )
+
+    position_sigma: bpy.props.FloatProperty(
+        name="Position sigma",
+        description="Standard deviation of the solved camera position (in "
+        "scene units) along its least constrained direction",
+        default=0.0,
+    )
+
+    rotation_sigma: bpy.props.FloatProperty(
+        name="Rotation sigma",
+        description="Standard deviation of the solved camera rotation (in "
+        "degrees) around its least constrained axis",
+        default=0.0,
+    )
+
+    reprojection_rms: bpy.props.FloatProperty(
+        name="Reprojection RMS",
+        description="Root mean square reprojection error (in pixels) over "
+        "all point pairs, from the last solve / calibration",
+        default=0.0,
+    )
+
+    reprojection_max: bpy.props.FloatProperty(
+        name="Reprojection max",
+        description="Maximum reprojection error (in pixels) over all point "
+        "pairs, from the last solve / calibration",
+        default=0.0,
+    )
+
+    proxy_size: bpy.props.StringProperty(
+        name="Proxy size",
+        description="Size (percentage) of the proxy built for this image, or "
+        "empty if none has been built",
+        default="",
+    )
+
     active_point_index: bpy.props.IntProperty(
         name="Active point index",
         description="Active point index",
@@ -197,6 +438,13 @@ class ImageMatchSettings(bpy.types.PropertyGroup):
         default=False,
     )
 
+    calibrate_camera_group: bpy.props.BoolProperty(
+        name="Calibrate camera group",
+        description="Whether to calibrate all images in the current image's "
+        "camera group together, and set the shared intrinsics on all of them",
+        default=False,
+    )
+
     pnp_calibrate_msg: bpy.props.StringProperty(
         name="Information",
         description="Calibration Output Message",
@@ -209,6 +457,293 @@ class ImageMatchSettings(bpy.types.PropertyGroup):
         default="Reprojection Error: -"
     )
 
+    pnp_solve_all_msg: bpy.props.StringProperty(
+        name="Information",
+        description="Output message from solving all images",
+        default="",
+    )
+
+    pnp_solve_video_msg: bpy.props.StringProperty(
+        name="Information",
+        description="Output message from solving every frame of a movie clip",
+        default="",
+    )
+
+    pnp_solver: bpy.props.EnumProperty(
+        name="Solver",
+        description="OpenCV solver used to find the camera pose",
+        items=pnp_solvers,
+    )
+
+    use_ransac: bpy.props.BoolProperty(
+        name="Robust solve (RANSAC)",
+        description="Whether to solve the camera pose with RANSAC, ignoring "
+        "outlier points",
+        default=False,
+    )
+
+    ransac_threshold: bpy.props.FloatProperty(
+        name="RANSAC threshold",
+        description="Maximum reprojection error (in pixels) for a point to "
+        "be classed as an inlier",
+        default=8.0,
+        min=0.0,
+    )
+
+    ransac_iterations: bpy.props.IntProperty(
+        name="RANSAC iterations",
+        description="Number of RANSAC iterations",
+        default=100,
+        min=1,
+    )
+
+    use_incremental_solve: bpy.props.BoolProperty(
+        name="Incremental solve",
+        description="Whether to start solving from the last solved pose of "
+        "each image. Falls back to a full solve if the error gets worse",
+        default=False,
+    )
+
+    refine_method: bpy.props.EnumProperty(
+        name="Refinement",
+        description="Method to refine the camera pose after solving",
+        items=refine_methods,
+    )
+
+    refine_max_iterations: bpy.props.IntProperty(
+        name="Refinement iterations",
+        description="Maximum number of refinement iterations",
+        default=20,
+        min=1,
+    )
+
+    refine_epsilon: bpy.props.FloatProperty(
+        name="Refinement epsilon",
+        description="Stop refining once the change in the pose is smaller "
+        "than this",
+        default=1e-7,
+        min=0.0,
+        precision=9,
+    )
+
+    bundle_refine_intrinsics: bpy.props.BoolProperty(
+        name="Refine intrinsics",
+        description="Whether bundle adjustment also refines the camera "
+        "intrinsics selected for calibration. Images in the same camera "
+        "group share intrinsics",
+        default=False,
+    )
+
+    bundle_refine_points: bpy.props.BoolProperty(
+        name="Refine 3D points",
+        description="Whether bundle adjustment also refines the position of "
+        "3D points seen by more than one image",
+        default=False,
+    )
+
+    bundle_merge_distance: bpy.props.FloatProperty(
+        name="Merge distance",
+        description="3D points of different images closer than this are "
+        "treated as the same point",
+        default=0.01,
+        min=0.0,
+        subtype="DISTANCE",
+    )
+
+    bundle_point_weight: bpy.props.FloatProperty(
+        name="Point weight",
+        description="How strongly refined 3D points are kept near their "
+        "original position (in pixels of error per unit of distance)",
+        default=100.0,
+        min=0.0,
+    )
+
+    bundle_max_iterations: bpy.props.IntProperty(
+        name="Bundle adjustment iterations",
+        description="Maximum number of bundle adjustment iterations",
+        default=50,
+        min=1,
+    )
+
+    pnp_bundle_msg: bpy.props.StringProperty(
+        name="Information",
+        description="Bundle adjustment output message",
+        default="",
+    )
+
+    use_live_solve: bpy.props.BoolProperty(
+        name="Live solve",
+        description="Whether to automatically re-solve the current image's "
+        "camera pose whenever its 2D or 3D points change",
+        default=False,
+    )
+
+    live_solve_delay: bpy.props.FloatProperty(
+        name="Live solve delay",
+        description="Time (in seconds) to wait after the last point change "
+        "before re-solving",
+        default=0.3,
+        min=0.0,
+    )
+
+    max_position_sigma: bpy.props.FloatProperty(
+        name="Max position sigma",
+        description="Solved cameras with a larger position uncertainty (in "
+        "scene units) are flagged as weakly constrained",
+        default=0.1,
+        min=0.0,
+    )
+
+    max_rotation_sigma: bpy.props.FloatProperty(
+        name="Max rotation sigma",
+        description="Solved cameras with a larger rotation uncertainty (in "
+        "degrees) are flagged as weakly constrained",
+        default=1.0,
+        min=0.0,
+    )
+
+    feature_detector: bpy.props.EnumProperty(
+        name="Features",
+        description="Feature detector used to match images",
+        items=feature_detectors,
+    )
+
+    feature_max_count: bpy.props.IntProperty(
+        name="Max features",
+        description="Maximum number of features detected per image",
+        default=5000,
+        min=100,
+    )
+
+    propagate_method: bpy.props.EnumProperty(
+        name="Method",
+        description="How 2D points are transferred between matched images",
+        items=propagate_methods,
+    )
+
+    propagate_threshold: bpy.props.FloatProperty(
+        name="Threshold",
+        description="Maximum error (in pixels) of feature matches used to "
+        "transfer points",
+        default=4.0,
+        min=0.1,
+    )
+
+    propagate_max_neighbours: bpy.props.IntProperty(
+        name="Max images",
+        description="Maximum number of overlapping images to transfer points "
+        "from",
+        default=3,
+        min=1,
+    )
+
+    propagate_min_inliers: bpy.props.IntProperty(
+        name="Min matches",
+        description="Minimum number of feature matches for an image to be "
+        "treated as overlapping",
+        default=15,
+        min=8,
+    )
+
+    propagate_merge_distance: bpy.props.FloatProperty(
+        name="Merge distance",
+        description="3D points transferred from different images closer than "
+        "this are treated as the same point (and matched to existing 3D "
+        "points of the current image)",
+        default=0.01,
+        min=0.0,
+        subtype="DISTANCE",
+    )
+
+    propagate_msg: bpy.props.StringProperty(
+        name="Information",
+        description="Output message from propagating points",
+        default="",
+    )
+
+    guided_source: bpy.props.EnumProperty(
+        name="Source",
+        description="Where to get the 3D points to predict from",
+        items=guided_sources,
+    )
+
+    guided_min_spacing: bpy.props.FloatProperty(
+        name="Min spacing",
+        description="Minimum distance (in pixels) between predicted 2D "
+        "points - only the nearest 3D point is kept in each area of this size",
+        default=50.0,
+        min=1.0,
+    )
+
+    guided_max_candidates: bpy.props.IntProperty(
+        name="Max candidates",
+        description="Maximum number of 3D points in view of the camera to "
+        "project - larger sets (e.g. dense model meshes) are evenly "
+        "subsampled",
+        default=200000,
+        min=1000,
+    )
+
+    guided_merge_distance: bpy.props.FloatProperty(
+        name="Merge distance",
+        description="Candidate 3D points closer than this to an existing 3D "
+        "point of the current image aren't predicted",
+        default=0.01,
+        min=0.0,
+        subtype="DISTANCE",
+    )
+
+    guided_check_occlusion: bpy.props.BoolProperty(
+        name="Check occlusion",
+        description="Whether to skip 3D points hidden behind the 3D model",
+        default=True,
+    )
+
+    guided_occlusion_tolerance: bpy.props.FloatProperty(
+        name="Occlusion tolerance",
+        description="How far in front of a 3D point the model can be hit "
+        "before the point counts as hidden",
+        default=0.01,
+        min=0.0,
+        subtype="DISTANCE",
+    )
+
+    guided_msg: bpy.props.StringProperty(
+        name="Information",
+        description="Output message from guided matching",
+        default="",
+    )
+
+    use_proxies: bpy.props.BoolProperty(
+        name="Use proxies",
+        description="Whether to display large images with a downsampled "
+        "proxy, in the clip editor and camera background. 2D points are "
+        "still placed in full size image coordinates",
+        default=True,
+    )
+
+    proxy_size: bpy.props.EnumProperty(
+        name="Proxy size",
+        description="Size of proxies, as a percentage of the full image size",
+        items=proxy_sizes,
+        default="50",
+    )
+
+    proxy_min_size: bpy.props.IntProperty(
+        name="Min image size",
+        description="Only use proxies for images with a width or height (in "
+        "pixels) of at least this",
+        default=4000,
+        min=1,
+    )
+
+    use_exif_focal_length: bpy.props.BoolProperty(
+        name="Use EXIF focal length",
+        description="Whether to set the focal length and sensor width of "
+        "new images from the 35mm equivalent focal length in their EXIF data",
+        default=True,
+    )
+
     image_filepath: bpy.props.StringProperty(
         name="Image filepath",
         default="",
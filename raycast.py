@@ -0,0 +1,123 @@
+import bpy
+from mathutils.bvhtree import BVHTree
+
+
+# BVH tree of each model (by name), with the mesh key it was built for. Trees
+# are in the model's object space, so they stay valid when it's moved -
+# they're only rebuilt when its geometry changes.
+model_bvh_trees = {}
+
+
+def get_mesh_key(model):
+    """Get key identifying the current mesh of a model. Catches the model's
+    mesh being replaced, even if no depsgraph update was seen."""
+
+    mesh = model.data
+    return (mesh.name_full, len(mesh.vertices), len(mesh.polygons))
+
+
+def get_model_bvh(model):
+    """Get BVH tree of the model (in object space) - from the cache, if its
+    geometry hasn't changed since it was built"""
+
+    mesh_key = get_mesh_key(model)
+    cached = model_bvh_trees.get(model.name_full)
+    if cached is not None and cached[0] == mesh_key:
+        return cached[1]
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    tree = BVHTree.FromObject(model, depsgraph)
+    model_bvh_trees[model.name_full] = (mesh_key, tree)
+
+    return tree
+
+
+def invalidate_model_bvh(model_name=None):
+    """Remove the cached BVH tree of the given model name (or all trees, if
+    no name is given)"""
+
+    if model_name is None:
+        model_bvh_trees.clear()
+    else:
+        model_bvh_trees.pop(model_name, None)
+
+
+def model_ray_cast(ray_origin, ray_target, model, matrix):
+    """Cast a ray against the model's cached BVH tree. The ray is moved into
+    object space first.
+
+    Args:
+        ray_origin: start of the ray, in world coordinates
+        ray_target: another point along the ray, in world coordinates
+        model: Blender mesh object
+        matrix: world matrix of the model
+
+    Returns:
+        location (in object space), normal and face index of the first hit,
+        or None, None, None if the ray misses the model
+    """
+
+    matrix_inv = matrix.inverted()
+    ray_origin_obj = matrix_inv @ ray_origin
+    ray_target_obj = matrix_inv @ ray_target
+    ray_direction_obj = ray_target_obj - ray_origin_obj
+
+    location, normal, face_index, _ = get_model_bvh(model).ray_cast(
+        ray_origin_obj, ray_direction_obj
+    )
+
+    return location, normal, face_index
+
+
+@bpy.app.handlers.persistent
+def invalidate_on_geometry_update(scene, depsgraph):
+    """Depsgraph handler that removes cached BVH trees of models whose
+    geometry has changed (e.g. after editing or adding modifiers)"""
+
+    if not model_bvh_trees:
+        return
+
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+
+        updated_id = update.id.original
+        if isinstance(updated_id, bpy.types.Object):
+            invalidate_model_bvh(updated_id.name_full)
+        elif isinstance(updated_id, bpy.types.Mesh):
+            for model_name in [
+                name
+                for name, (mesh_key, _) in model_bvh_trees.items()
+                if mesh_key[0] == updated_id.name_full
+            ]:
+                invalidate_model_bvh(model_name)
+
+
+@bpy.app.handlers.persistent
+def invalidate_on_load(*args):
+    """Load handler that removes all cached BVH trees when a new file is
+    opened"""
+
+    invalidate_model_bvh()
+
+
+def register_handlers():
+    """Add handlers that keep the cached BVH trees up to date"""
+
+    handlers = bpy.app.handlers
+    if invalidate_on_geometry_update not in handlers.depsgraph_update_post:
+        handlers.depsgraph_update_post.append(invalidate_on_geometry_update)
+    if invalidate_on_load not in handlers.load_post:
+        handlers.load_post.append(invalidate_on_load)
+
+
+def unregister_handlers():
+    """Remove handlers, and all cached BVH trees"""
+
+    handlers = bpy.app.handlers
+    if invalidate_on_geometry_update in handlers.depsgraph_update_post:
+        handlers.depsgraph_update_post.remove(invalidate_on_geometry_update)
+    if invalidate_on_load in handlers.load_post:
+        handlers.load_post.remove(invalidate_on_load)
+
+    invalidate_model_bvh()
@@ -0,0 +1,1026 @@
+""" Solver functions that only depend on numpy and OpenCV (not bpy), so they
+can be run in worker threads outside of Blender's main thread.
+
+Blender data is passed in as immutable ImageSnapshot / SolverOptions objects
+(created on the main thread), and results are returned as PoseResult /
+CalibrationResult objects to apply back to the scene. """
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+
+import cv2 as cv
+import numpy as np
+
+
+
+# OpenCV PNP solvers that can be chosen from (or raced against each other)
+PNP_SOLVERS = {
+    "SQPNP": cv.SOLVEPNP_SQPNP,
+    "EPNP": cv.SOLVEPNP_EPNP,
+    "IPPE": cv.SOLVEPNP_IPPE,
+    "ITERATIVE": cv.SOLVEPNP_ITERATIVE,
+}
+
+# Solvers that RANSAC can use for its hypotheses (from minimal samples of
+# the points). IPPE only handles planar points, and "BEST" races several
+# solvers, so these fall back to SQPNP.
+RANSAC_PNP_SOLVERS = ("SQPNP", "EPNP", "ITERATIVE")
+
+
+@dataclass(slots=True, frozen=True)
+class ImageSnapshot:
+    """Copy of everything needed to solve / calibrate one image match
+
+    Attributes:
+        name: name of the image match
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        image_size: (width, height) of the image in pixels
+    """
+
+    name: str
+    points_3d_coords: np.ndarray
+    points_2d_coords: np.ndarray
+    camera_intrinsics: np.ndarray
+    distortion_coefficients: np.ndarray
+    image_size: tuple
+
+    @property
+    def npoints(self):
+        return self.points_3d_coords.shape[0]
+
+
+@dataclass(slots=True, frozen=True)
+class SolverOptions:
+    """Options for solving a camera pose - see find_pose and solve_pose.
+
+    rvec_guess / tvec_guess / previous_error are only set when warm-starting
+    from a previous pose. warm_start_tolerance is the relative increase over
+    previous_error a warm-started solve may have and still be accepted - by
+    default 1%, which only allows for numerical noise, so any real increase
+    in error falls back to a global solve."""
+
+    pnp_solver: str = "SQPNP"
+    use_ransac: bool = False
+    ransac_threshold: float = 8.0
+    ransac_iterations: int = 100
+    refine_method: str = "NONE"
+    refine_max_iterations: int = 20
+    refine_epsilon: float = 1e-7
+    rvec_guess: tuple = None
+    tvec_guess: tuple = None
+    previous_error: float = None
+    warm_start_tolerance: float = 0.01
+
+
+@dataclass(slots=True, frozen=True)
+class PoseResult:
+    """Result of solving the camera pose of an image snapshot
+
+    Attributes:
+        name: name of the solved image match
+        success: whether a pose was found
+        rvec: numpy array rotation vector (world to opencv camera)
+        tvec: numpy array translation vector (world to opencv camera)
+        error: reprojection error of the pose (over inliers only)
+        inliers: boolean numpy array, true for each inlier point
+        unrefined_error: reprojection error before refinement
+        solver_name: name of the solver that found the pose
+        solver_timings: dictionary of solver name -> time taken in seconds
+        residuals: numpy array of the reprojection error of every point
+        position_sigma: uncertainty of the camera position (see
+            pose_uncertainty)
+        rotation_sigma: uncertainty of the camera rotation in degrees
+    """
+
+    name: str
+    success: bool
+    rvec: np.ndarray = None
+    tvec: np.ndarray = None
+    error: float = None
+    inliers: np.ndarray = None
+    unrefined_error: float = None
+    solver_name: str = None
+    solver_timings: dict = field(default_factory=dict)
+    residuals: np.ndarray = None
+    position_sigma: float = None
+    rotation_sigma: float = None
+
+
+@dataclass(slots=True, frozen=True)
+class CalibrationResult:
+    """Result of calibrating the camera of one or more image snapshots
+
+    Attributes:
+        error: reprojection error over all views
+        camera_intrinsics: numpy array of calibrated camera intrinsics
+        distortion_coefficients: numpy array of calibrated distortion
+            coefficients
+        rvecs: list of rotation vectors, one per view
+        tvecs: list of translation vectors, one per view
+        residuals: list of numpy arrays of the reprojection error of every
+            point, one per view
+    """
+
+    error: float
+    camera_intrinsics: np.ndarray
+    distortion_coefficients: np.ndarray
+    rvecs: list
+    tvecs: list
+    residuals: list
+
+
+def solve_pnp_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    pnp_solver="SQPNP",
+):
+    """Solve camera pose with OpenCV's PNP solver
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        pnp_solver: name of the OpenCV solver to use (key of PNP_SOLVERS)
+
+    Returns:
+        success - whether the solver found a pose
+        rvec - numpy array rotation vector (world to opencv camera)
+        tvec - numpy array translation vector (world to opencv camera)
+        error - reprojection error of the pose
+    """
+
+    try:
+        ret, rvec, tvec, error = cv.solvePnPGeneric(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            flags=PNP_SOLVERS[pnp_solver],
+        )
+    except cv.error:
+        # Some solvers raise errors for unsupported point configurations
+        # e.g. too few points
+        return False, None, None, None
+
+    if not ret:
+        return False, None, None, None
+
+    return True, rvec[0], tvec[0], float(error[0][0])
+
+
+def solve_pnp_race_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    pnp_solvers=tuple(PNP_SOLVERS),
+):
+    """Solve camera pose with several OpenCV PNP solvers in parallel threads,
+    and keep the pose with the lowest reprojection error
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        pnp_solvers: names of the OpenCV solvers to race (keys of PNP_SOLVERS)
+
+    Returns:
+        success, rvec, tvec and error - as for solve_pnp_points
+        solver_name - name of the solver with the lowest error
+        solver_timings - dictionary of solver name -> time taken in seconds
+    """
+
+    def timed_solve(pnp_solver):
+        start_time = time.perf_counter()
+        result = solve_pnp_points(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            pnp_solver,
+        )
+        return pnp_solver, result, time.perf_counter() - start_time
+
+    with ThreadPoolExecutor(max_workers=len(pnp_solvers)) as executor:
+        outcomes = list(executor.map(timed_solve, pnp_solvers))
+
+    solver_timings = {
+        pnp_solver: elapsed_time for pnp_solver, _, elapsed_time in outcomes
+    }
+    successful = [
+        (pnp_solver, result)
+        for pnp_solver, result, _ in outcomes
+        if result[0]
+    ]
+
+    if not successful:
+        return False, None, None, None, None, solver_timings
+
+    solver_name, result = min(successful, key=lambda outcome: outcome[1][3])
+    return (*result, solver_name, solver_timings)
+
+
+def solve_pnp_global_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    pnp_solver="SQPNP",
+):
+    """Solve camera pose from scratch with the chosen solver - either one of
+    PNP_SOLVERS, or "BEST" to race all of them.
+
+    Returns:
+        success, rvec, tvec, error, solver_name and solver_timings - as for
+        solve_pnp_race_points
+    """
+
+    if pnp_solver == "BEST":
+        return solve_pnp_race_points(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+        )
+
+    start_time = time.perf_counter()
+    result = solve_pnp_points(
+        points_3d_coords,
+        points_2d_coords,
+        camera_intrinsics,
+        distortion_coefficients,
+        pnp_solver,
+    )
+    solver_timings = {pnp_solver: time.perf_counter() - start_time}
+
+    return (*result, pnp_solver, solver_timings)
+
+
+def solve_pnp_warm_start_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    rvec_guess,
+    tvec_guess,
+):
+    """Solve camera pose with OpenCV's iterative PNP solver, starting from
+    a previous pose. This is much faster than a global solve when the pose
+    has only changed slightly.
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        rvec_guess: rotation vector of the previous pose
+        tvec_guess: translation vector of the previous pose
+
+    Returns:
+        success, rvec, tvec and error - as for solve_pnp_points
+    """
+
+    ret, rvec, tvec, error = cv.solvePnPGeneric(
+        points_3d_coords,
+        points_2d_coords,
+        camera_intrinsics,
+        distortion_coefficients,
+        useExtrinsicGuess=True,
+        flags=cv.SOLVEPNP_ITERATIVE,
+        rvec=np.array(rvec_guess, dtype="double").reshape(3, 1),
+        tvec=np.array(tvec_guess, dtype="double").reshape(3, 1),
+    )
+
+    if not ret:
+        return False, None, None, None
+
+    return True, rvec[0], tvec[0], float(error[0][0])
+
+
+def reprojection_residuals(
+    points_3d_coords,
+    points_2d_coords,
+    rvec,
+    tvec,
+    camera_intrinsics,
+    distortion_coefficients,
+):
+    """Calculate the reprojection error of every 2D-3D point pair for the
+    given camera pose
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        rvec: numpy array rotation vector (world to opencv camera)
+        tvec: numpy array translation vector (world to opencv camera)
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+
+    Returns:
+        Numpy array with the distance (in pixels) between each 2D point and
+        its projected 3D point
+    """
+
+    if points_3d_coords.shape[0] == 0:
+        return np.zeros(0)
+
+    projected_points, _ = cv.projectPoints(
+        points_3d_coords,
+        rvec,
+        tvec,
+        camera_intrinsics,
+        distortion_coefficients,
+    )
+
+    return np.linalg.norm(
+        projected_points.reshape(-1, 2) - points_2d_coords, axis=1
+    )
+
+
+def pose_uncertainty(
+    points_3d_coords,
+    points_2d_coords,
+    rvec,
+    tvec,
+    camera_intrinsics,
+    distortion_coefficients,
+):
+    """Estimate the uncertainty of a solved camera pose from the jacobian of
+    the point projections. The 6-DoF pose covariance is the inverse of the
+    (Gauss-Newton) information matrix J^T J, scaled by the residual variance.
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        rvec: numpy array rotation vector (world to opencv camera)
+        tvec: numpy array translation vector (world to opencv camera)
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+
+    Returns:
+        position_sigma - standard deviation of the camera position (in scene
+            units) along its least constrained direction
+        rotation_sigma - standard deviation of the camera rotation (in
+            degrees) around its least constrained axis
+    """
+
+    npoints = points_3d_coords.shape[0]
+    if npoints < 4:
+        return float("inf"), float("inf")
+
+    projected_points, jacobian = cv.projectPoints(
+        points_3d_coords,
+        rvec,
+        tvec,
+        camera_intrinsics,
+        distortion_coefficients,
+    )
+    residuals = projected_points.reshape(-1) - points_2d_coords.reshape(-1)
+
+    # Only the first 6 columns are for the pose (rvec then tvec) - the rest
+    # are intrinsics
+    pose_jacobian = jacobian[:, :6]
+    variance = np.sum(np.square(residuals)) / max(2 * npoints - 6, 1)
+    try:
+        covariance = variance * np.linalg.inv(pose_jacobian.T @ pose_jacobian)
+    except np.linalg.LinAlgError:
+        return float("inf"), float("inf")
+
+    # Camera position is -R^T t, so propagate the covariance through its
+    # jacobian with respect to rvec and tvec
+    rmat, rodrigues_jacobian = cv.Rodrigues(rvec)
+    rodrigues_jacobian = rodrigues_jacobian.reshape(3, 3, 3)
+    position_jacobian = np.hstack(
+        [
+            -np.einsum("kji,j->ik", rodrigues_jacobian, np.ravel(tvec)),
+            -rmat.T,
+        ]
+    )
+    position_covariance = position_jacobian @ covariance @ position_jacobian.T
+
+    position_sigma = np.sqrt(np.max(np.linalg.eigvalsh(position_covariance)))
+    rotation_sigma = np.sqrt(np.max(np.linalg.eigvalsh(covariance[:3, :3])))
+
+    return float(position_sigma), float(np.degrees(rotation_sigma))
+
+
+def summarise_residuals(residuals):
+    """Get the root mean square and maximum of the given reprojection
+    residuals"""
+
+    if len(residuals) == 0:
+        return 0.0, 0.0
+
+    return (
+        float(np.sqrt(np.mean(np.square(residuals)))),
+        float(np.max(residuals)),
+    )
+
+
+def pnp_reprojection_error(residuals):
+    """Get reprojection error from per-point residuals, defined the same way
+    as the error returned by cv.solvePnPGeneric"""
+
+    if len(residuals) == 0:
+        return 0.0
+
+    return float(np.sqrt(np.sum(np.square(residuals)) / (2 * len(residuals))))
+
+
+def refine_pose_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    rvec,
+    tvec,
+    refine_method="LM",
+    refine_max_iterations=20,
+    refine_epsilon=1e-7,
+):
+    """Refine a solved camera pose by minimising its reprojection error with
+    OpenCV's Levenberg-Marquardt (LM) or virtual visual servoing (VVS)
+    refinement
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        rvec: rotation vector of the pose to refine
+        tvec: translation vector of the pose to refine
+        refine_method: "LM" or "VVS"
+        refine_max_iterations: maximum number of refinement iterations
+        refine_epsilon: stop once the change in parameters is smaller than this
+
+    Returns:
+        rvec, tvec and reprojection error of the refined pose
+    """
+
+    criteria = (
+        cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_COUNT,
+        refine_max_iterations,
+        refine_epsilon,
+    )
+
+    if refine_method == "VVS":
+        rvec, tvec = cv.solvePnPRefineVVS(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            rvec.copy(),
+            tvec.copy(),
+            criteria=criteria,
+        )
+    else:
+        rvec, tvec = cv.solvePnPRefineLM(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            rvec.copy(),
+            tvec.copy(),
+            criteria=criteria,
+        )
+
+    residuals = reprojection_residuals(
+        points_3d_coords,
+        points_2d_coords,
+        rvec,
+        tvec,
+        camera_intrinsics,
+        distortion_coefficients,
+    )
+
+    return rvec, tvec, pnp_reprojection_error(residuals)
+
+
+def solve_pnp_ransac_points(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    ransac_threshold=8.0,
+    ransac_iterations=100,
+    pnp_solver="SQPNP",
+):
+    """Robustly solve camera pose with OpenCV's RANSAC PNP solver. Points
+    further than ransac_threshold from their re-projection are classed as
+    outliers, and the final pose is solved from the inliers only.
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        ransac_threshold: maximum re-projection error (in pixels) of an inlier
+        ransac_iterations: number of RANSAC iterations
+        pnp_solver: solver for the RANSAC hypotheses (if in
+            RANSAC_PNP_SOLVERS, otherwise SQPNP) and the final pose (see
+            solve_pnp_global_points)
+
+    Returns:
+        success - whether the solver found a pose
+        rvec - numpy array rotation vector (world to opencv camera)
+        tvec - numpy array translation vector (world to opencv camera)
+        error - reprojection error of the pose (over inliers only)
+        inliers - boolean numpy array, true for each inlier point
+        solver_name - name of the solver used for the final pose
+        solver_timings - dictionary of solver name -> time taken in seconds
+    """
+
+    npoints = points_3d_coords.shape[0]
+    inliers = np.zeros(npoints, dtype=bool)
+
+    ransac_solver = pnp_solver if pnp_solver in RANSAC_PNP_SOLVERS else "SQPNP"
+    ret, _, _, inlier_indices = cv.solvePnPRansac(
+        points_3d_coords,
+        points_2d_coords,
+        camera_intrinsics,
+        distortion_coefficients,
+        iterationsCount=ransac_iterations,
+        reprojectionError=ransac_threshold,
+        flags=PNP_SOLVERS[ransac_solver],
+    )
+
+    if not ret or inlier_indices is None or len(inlier_indices) < 4:
+        return False, None, None, None, inliers, None, {}
+
+    inliers[inlier_indices.ravel()] = True
+
+    # Re-solve from all inliers, to get the final pose + its error
+    (
+        ret,
+        rvec,
+        tvec,
+        error,
+        solver_name,
+        solver_timings,
+    ) = solve_pnp_global_points(
+        points_3d_coords[inliers],
+        points_2d_coords[inliers],
+        camera_intrinsics,
+        distortion_coefficients,
+        pnp_solver,
+    )
+
+    return ret, rvec, tvec, error, inliers, solver_name, solver_timings
+
+
+def find_pose(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    pnp_solver="SQPNP",
+    use_ransac=False,
+    ransac_threshold=8.0,
+    ransac_iterations=100,
+    rvec_guess=None,
+    tvec_guess=None,
+    previous_error=None,
+    warm_start_tolerance=0.01,
+):
+    """Find initial camera pose with the chosen solver options
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        pnp_solver: name of the OpenCV solver to use (key of PNP_SOLVERS), or
+            "BEST" to race all of them and keep the lowest error pose
+        use_ransac: whether to use the robust RANSAC solver
+        ransac_threshold: maximum re-projection error (in pixels) of an inlier
+        ransac_iterations: number of RANSAC iterations
+        rvec_guess: rotation vector of the previous pose. If given (and not
+            using RANSAC), the solve is warm-started from the previous pose
+        tvec_guess: translation vector of the previous pose
+        previous_error: reprojection error of the previous pose, before
+            refinement. If the warm-started solve's error is worse than this,
+            a global solve is run too, and the best of both kept.
+        warm_start_tolerance: relative increase over previous_error that is
+            still accepted, to allow for numerical noise
+
+    Returns:
+        success, rvec, tvec, error, inliers, solver_name and solver_timings -
+        as for solve_pnp_ransac_points. Without RANSAC, all points are
+        inliers.
+    """
+
+    if use_ransac:
+        return solve_pnp_ransac_points(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            ransac_threshold,
+            ransac_iterations,
+            pnp_solver,
+        )
+
+    inliers = np.ones(points_3d_coords.shape[0], dtype=bool)
+
+    warm_start_result = None
+    warm_start_timings = {}
+    if rvec_guess is not None and tvec_guess is not None:
+        start_time = time.perf_counter()
+        warm_start_result = solve_pnp_warm_start_points(
+            points_3d_coords,
+            points_2d_coords,
+            camera_intrinsics,
+            distortion_coefficients,
+            rvec_guess,
+            tvec_guess,
+        )
+        warm_start_timings["WARM_START"] = time.perf_counter() - start_time
+        success, _, _, error = warm_start_result
+
+        if success and (
+            previous_error is None
+            or error <= previous_error * (1 + warm_start_tolerance)
+        ):
+            return (
+                *warm_start_result,
+                inliers,
+                "WARM_START",
+                warm_start_timings,
+            )
+
+    # Fall back to a global solve
+    *result, solver_name, solver_timings = solve_pnp_global_points(
+        points_3d_coords,
+        points_2d_coords,
+        camera_intrinsics,
+        distortion_coefficients,
+        pnp_solver,
+    )
+    solver_timings.update(warm_start_timings)
+
+    if (
+        warm_start_result is not None
+        and warm_start_result[0]
+        and (not result[0] or warm_start_result[3] < result[3])
+    ):
+        result = warm_start_result
+        solver_name = "WARM_START"
+
+    return (*result, inliers, solver_name, solver_timings)
+
+
+def solve_pose(
+    points_3d_coords,
+    points_2d_coords,
+    camera_intrinsics,
+    distortion_coefficients,
+    refine_method="NONE",
+    refine_max_iterations=20,
+    refine_epsilon=1e-7,
+    **find_pose_options,
+):
+    """Solve camera pose with the chosen solver options, followed by an
+    optional refinement stage
+
+    Args:
+        points_3d_coords: numpy array of 3D point coordinates
+        points_2d_coords: numpy array of 2D point coordinates
+        camera_intrinsics: numpy array of camera intrinsics
+        distortion_coefficients: numpy array of camera distortion coefficients
+        refine_method: "NONE", "LM" or "VVS" - see refine_pose_points
+        refine_max_iterations: maximum number of refinement iterations
+        refine_epsilon: stop refining once the change in parameters is
+            smaller than this
+        find_pose_options: further options for find_pose
+
+    Returns:
+        success, rvec, tvec, error and inliers - as for find_pose
+        unrefined_error - reprojection error before refinement (same as
+            error if no refinement)
+        solver_name and solver_timings - as for find_pose
+    """
+
+    (
+        success,
+        rvec,
+        tvec,
+        error,
+        inliers,
+        solver_name,
+        solver_timings,
+    ) = find_pose(
+        points_3d_coords,
+        points_2d_coords,
+        camera_intrinsics,
+        distortion_coefficients,
+        **find_pose_options,
+    )
+    unrefined_error = error
+
+    if success and refine_method != "NONE":
+        # Only refine using inliers
+        rvec, tvec, error = refine_pose_points(
+            points_3d_coords[inliers],
+            points_2d_coords[inliers],
+            camera_intrinsics,
+            distortion_coefficients,
+            rvec,
+            tvec,
+            refine_method,
+            refine_max_iterations,
+            refine_epsilon,
+        )
+
+    return (
+        success,
+        rvec,
+        tvec,
+        error,
+        inliers,
+        unrefined_error,
+        solver_name,
+        solver_timings,
+    )
+
+
+def solve_image(snapshot, options):
+    """Solve the camera pose of a single image
+
+    Args:
+        snapshot: ImageSnapshot of the image to solve
+        options: SolverOptions to solve with
+
+    Returns:
+        PoseResult for the image
+    """
+
+    (
+        success,
+        rvec,
+        tvec,
+        error,
+        inliers,
+        unrefined_error,
+        solver_name,
+        solver_timings,
+    ) = solve_pose(
+        snapshot.points_3d_coords,
+        snapshot.points_2d_coords,
+        snapshot.camera_intrinsics,
+        snapshot.distortion_coefficients,
+        refine_method=options.refine_method,
+        refine_max_iterations=options.refine_max_iterations,
+        refine_epsilon=options.refine_epsilon,
+        pnp_solver=options.pnp_solver,
+        use_ransac=options.use_ransac,
+        ransac_threshold=options.ransac_threshold,
+        ransac_iterations=options.ransac_iterations,
+        rvec_guess=options.rvec_guess,
+        tvec_guess=options.tvec_guess,
+        previous_error=options.previous_error,
+        warm_start_tolerance=options.warm_start_tolerance,
+    )
+
+    if not success:
+        return PoseResult(
+            snapshot.name,
+            False,
+            inliers=inliers,
+            solver_timings=solver_timings,
+        )
+
+    residuals = reprojection_residuals(
+        snapshot.points_3d_coords,
+        snapshot.points_2d_coords,
+        rvec,
+        tvec,
+        snapshot.camera_intrinsics,
+        snapshot.distortion_coefficients,
+    )
+    position_sigma, rotation_sigma = pose_uncertainty(
+        snapshot.points_3d_coords[inliers],
+        snapshot.points_2d_coords[inliers],
+        rvec,
+        tvec,
+        snapshot.camera_intrinsics,
+        snapshot.distortion_coefficients,
+    )
+
+    return PoseResult(
+        snapshot.name,
+        True,
+        rvec,
+        tvec,
+        error,
+        inliers,
+        unrefined_error,
+        solver_name,
+        solver_timings,
+        residuals,
+        position_sigma,
+        rotation_sigma,
+    )
+
+
+def solve_image_sequence(snapshots, options):
+    """Solve the camera pose of a sequence of images (e.g. the frames of a
+    video), warm-starting each from the pose of the last solved one.
+
+    Snapshots are only read one at a time, so they can be generated lazily
+    to avoid holding every frame's points in memory.
+
+    Args:
+        snapshots: iterable of ImageSnapshots, in order
+        options: SolverOptions for the first snapshot. Later snapshots use
+            the same options, warm-started from the previous pose.
+
+    Yields:
+        PoseResult for each snapshot. Snapshots with fewer than 4 points are
+        not solved (success is False)
+    """
+
+    frame_options = options
+    for snapshot in snapshots:
+        if snapshot.npoints < 4:
+            yield PoseResult(snapshot.name, False)
+            continue
+
+        result = solve_image(snapshot, frame_options)
+        if result.success:
+            frame_options = replace(
+                options,
+                rvec_guess=tuple(np.ravel(result.rvec)),
+                tvec_guess=tuple(np.ravel(result.tvec)),
+                previous_error=result.unrefined_error,
+            )
+
+        yield result
+
+
+def calibration_flags(
+    focal_length=True,
+    principal_point=False,
+    distortion_k1=False,
+    distortion_k2=False,
+    distortion_k3=False,
+):
+    """Get OpenCV calibration flags that only refine the given intrinsics.
+    Aspect ratio is always fixed, and tangential distortion always zero (as
+    Blender's cameras don't support them)."""
+
+    return (
+        cv.CALIB_USE_INTRINSIC_GUESS
+        + cv.CALIB_FIX_ASPECT_RATIO
+        + cv.CALIB_ZERO_TANGENT_DIST
+        + (cv.CALIB_FIX_PRINCIPAL_POINT if not principal_point else 0)
+        + (cv.CALIB_FIX_FOCAL_LENGTH if not focal_length else 0)
+        + (cv.CALIB_FIX_K1 if not distortion_k1 else 0)
+        + (cv.CALIB_FIX_K2 if not distortion_k2 else 0)
+        + (cv.CALIB_FIX_K3 if not distortion_k3 else 0)
+    )
+
+
+def calibrate_camera_points(
+    views_points_3d_coords,
+    views_points_2d_coords,
+    image_size,
+    camera_intrinsics,
+    distortion_coefficients,
+    flags,
+):
+    """Calibrate camera intrinsics with OpenCV, from one or more views taken
+    with the same camera
+
+    Args:
+        views_points_3d_coords: list of numpy arrays of 3D point coordinates,
+            one per view
+        views_points_2d_coords: list of numpy arrays of 2D point coordinates,
+            one per view
+        image_size: (width, height) of the images in pixels
+        camera_intrinsics: numpy array of initial camera intrinsics
+        distortion_coefficients: numpy array of initial camera distortion
+            coefficients
+        flags: OpenCV calibration flags
+
+    Returns:
+        error - reprojection error over all views
+        camera_intrinsics - numpy array of calibrated camera intrinsics
+        distortion_coefficients - numpy array of calibrated distortion
+            coefficients
+        rvecs - list of rotation vectors, one per view
+        tvecs - list of translation vectors, one per view
+    """
+
+    (
+        error,
+        camera_intrinsics,
+        distortion_coefficients,
+        rvecs,
+        tvecs,
+    ) = cv.calibrateCamera(
+        [np.asarray(view, dtype="float32") for view in views_points_3d_coords],
+        [np.asarray(view, dtype="float32") for view in views_points_2d_coords],
+        tuple(image_size),
+        camera_intrinsics,
+        distortion_coefficients,
+        flags=flags,
+    )
+
+    return (
+        error,
+        camera_intrinsics,
+        np.ravel(distortion_coefficients),
+        rvecs,
+        tvecs,
+    )
+
+
+def calibrate_images(snapshots, flags):
+    """Calibrate the camera shared by one or more images. The first
+    snapshot's intrinsics / distortion are used as the initial guess.
+
+    Args:
+        snapshots: list of ImageSnapshots, all with the same image size
+        flags: OpenCV calibration flags
+
+    Returns:
+        CalibrationResult for the images (one view per snapshot)
+    """
+
+    (
+        error,
+        camera_intrinsics,
+        distortion_coefficients,
+        rvecs,
+        tvecs,
+    ) = calibrate_camera_points(
+        [snapshot.points_3d_coords for snapshot in snapshots],
+        [snapshot.points_2d_coords for snapshot in snapshots],
+        snapshots[0].image_size,
+        snapshots[0].camera_intrinsics,
+        snapshots[0].distortion_coefficients,
+        flags,
+    )
+
+    residuals = [
+        reprojection_residuals(
+            snapshot.points_3d_coords,
+            snapshot.points_2d_coords,
+            rvec,
+            tvec,
+            camera_intrinsics,
+            distortion_coefficients,
+        )
+        for snapshot, rvec, tvec in zip(snapshots, rvecs, tvecs)
+    ]
+
+    return CalibrationResult(
+        error,
+        camera_intrinsics,
+        distortion_coefficients,
+        rvecs,
+        tvecs,
+        residuals,
+    )
+
+
+def create_executor(max_workers=None):
+    """Create a pool to run solver jobs in parallel. Threads are used rather
+    than processes, as forking Blender isn't safe (and isn't possible on
+    macOS / Windows) - OpenCV releases the GIL while solving, so threads
+    still run in parallel.
+    """
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def solve_image_batch(snapshots, options):
+    """Solve the camera pose of many images in parallel
+
+    Args:
+        snapshots: list of ImageSnapshots to solve
+        options: list of SolverOptions, one per snapshot
+
+    Returns:
+        List of PoseResults (in the same order as snapshots)
+    """
+
+    if len(snapshots) <= 1:
+        return list(map(solve_image, snapshots, options))
+
+    max_workers = min(len(snapshots), os.cpu_count() or 1)
+
+    with create_executor(max_workers) as executor:
+        return list(executor.map(solve_image, snapshots, options))
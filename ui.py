@@ -1,4 +1,5 @@
 import bpy
+from . import props
 
 
 def current_image_initialised(context):
@@ -36,6 +37,16 @@ class POINT_UL_UI(bpy.types.UIList):
         col.enabled = False
         col.prop(point, "is_point_3d_initialised", text="3D")
 
+        col = layout.column()
+        if point.reprojection_error >= 0:
+            col.label(text="%.1f px" % point.reprojection_error)
+
+        col = layout.column()
+        if point.is_predicted:
+            col.label(text="Predicted", icon="QUESTION")
+        elif not point.is_inlier:
+            col.label(text="Outlier", icon="ERROR")
+
         col = layout.column()
         if point.is_point_2d_initialised:
             col.enabled = True
@@ -74,7 +85,10 @@ class IMAGE_UL_UI(bpy.types.UIList):
         swap_operator.image_name = image.name
 
         col = layout.column()
-        col.label(text=image.name)
+        if props.is_weakly_constrained(settings, image):
+            col.label(text=image.name, icon="ERROR")
+        else:
+            col.label(text=image.name)
 
 
 class ImagePanel(bpy.types.Panel):
@@ -97,6 +111,23 @@ class ImagePanel(bpy.types.Panel):
         row = layout.row()
         row.operator("imagematches.add_image")
 
+        row = layout.row()
+        row.operator(
+            "imagematches.add_images",
+            text="Add images from folder",
+            icon="FILE_FOLDER",
+        )
+
+        row = layout.row()
+        row.prop(settings, "use_exif_focal_length")
+
+        col = layout.column(align=True)
+        col.prop(settings, "use_proxies")
+        if settings.use_proxies:
+            col.prop(settings, "proxy_size")
+            col.prop(settings, "proxy_min_size")
+        col.operator("imagematches.update_proxies", text="Update proxies")
+
         row = layout.row()
         row.label(text="Loaded images:")
 
@@ -158,7 +189,7 @@ class PointsPanel(bpy.types.Panel):
         )
 
         row = layout.row()
-        current_image = settings.image_matches[settings.current_image_name]
+        current_image = props.get_current_image_match(settings)
         row.template_list(
             "POINT_UL_UI",
             "Point_List",
@@ -169,6 +200,91 @@ class PointsPanel(bpy.types.Panel):
         )
 
 
+class PropagatePanel(bpy.types.Panel):
+    """Panel to propagate points from overlapping, already matched images"""
+
+    bl_label = "Propagate Points"
+    bl_idname = "CLIP_PT_PropagatePoints"
+    bl_space_type = "CLIP_EDITOR"
+    bl_region_type = "TOOLS"
+    bl_category = "Image Match"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(self, context):
+        return current_image_initialised(context)
+
+    def draw(self, context):
+        layout = self.layout
+        settings = context.scene.match_settings
+
+        col = layout.column(align=True)
+        col.prop(settings, "feature_detector")
+        col.prop(settings, "feature_max_count")
+        col.prop(settings, "propagate_method")
+        col.prop(settings, "propagate_threshold")
+        col.prop(settings, "propagate_min_inliers")
+        col.prop(settings, "propagate_max_neighbours")
+        col.prop(settings, "propagate_merge_distance")
+
+        row = layout.row()
+        row.operator(
+            "imagematches.propagate_points", text="Propagate Points"
+        )
+
+        if settings.propagate_msg != "":
+            row = layout.row()
+            row.label(text=settings.propagate_msg)
+
+
+class GuidedMatchingPanel(bpy.types.Panel):
+    """Panel to predict points from the current image's solved camera pose"""
+
+    bl_label = "Guided Matching"
+    bl_idname = "CLIP_PT_GuidedMatching"
+    bl_space_type = "CLIP_EDITOR"
+    bl_region_type = "TOOLS"
+    bl_category = "Image Match"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(self, context):
+        return current_image_initialised(context)
+
+    def draw(self, context):
+        layout = self.layout
+        settings = context.scene.match_settings
+        current_image = props.get_current_image_match(settings)
+
+        col = layout.column(align=True)
+        col.prop(settings, "guided_source")
+        col.prop(settings, "guided_min_spacing")
+        col.prop(settings, "guided_max_candidates")
+        col.prop(settings, "guided_merge_distance")
+        col.prop(settings, "guided_check_occlusion")
+        row = col.row()
+        row.active = settings.guided_check_occlusion
+        row.prop(settings, "guided_occlusion_tolerance")
+
+        row = layout.row()
+        row.enabled = current_image.is_pose_solved
+        row.operator("imagematches.predict_points", text="Predict Points")
+
+        row = layout.row(align=True)
+        row.operator(
+            "imagematches.accept_predicted_points",
+            text="Accept",
+            icon="CHECKMARK",
+        )
+        row.operator(
+            "imagematches.reject_predicted_points", text="Reject", icon="X"
+        )
+
+        if settings.guided_msg != "":
+            row = layout.row()
+            row.label(text=settings.guided_msg)
+
+
 class CurrentCameraSettings(bpy.types.Panel):
     """Collapsable sub-panel for current tracking camera settings"""
 
@@ -185,7 +301,7 @@ class CurrentCameraSettings(bpy.types.Panel):
         layout = self.layout
 
         settings = context.scene.match_settings
-        current_image = settings.image_matches[settings.current_image_name]
+        current_image = props.get_current_image_match(settings)
         camera = current_image.movie_clip.tracking.camera
 
         col = layout.column()
@@ -254,6 +370,11 @@ class CalibratePanel(bpy.types.Panel):
         row.prop(settings, "calibrate_distortion_k2", text="K2")
         row.prop(settings, "calibrate_distortion_k3", text="K3 Distortion")
 
+        current_image = props.get_current_image_match(settings)
+        col = layout.column(align=True)
+        col.prop(current_image, "camera_group")
+        col.prop(settings, "calibrate_camera_group", text="Calibrate Group")
+
         col = layout.column(align=True)
         col.operator("pnp.calibrate_camera", text="Calibrate Camera")
 
@@ -281,15 +402,74 @@ class SolvePanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         settings = context.scene.match_settings
-        current_image = settings.image_matches[settings.current_image_name]
+        current_image = props.get_current_image_match(settings)
+
+        col = layout.column(align=True)
+        col.prop(settings, "pnp_solver")
+        col.prop(settings, "use_incremental_solve")
+        col.prop(settings, "use_ransac")
+        if settings.use_ransac:
+            col.prop(settings, "ransac_threshold", text="Threshold")
+            col.prop(settings, "ransac_iterations", text="Iterations")
+
+        col = layout.column(align=True)
+        col.prop(settings, "refine_method")
+        if settings.refine_method != "NONE":
+            col.prop(settings, "refine_max_iterations", text="Iterations")
+            col.prop(settings, "refine_epsilon", text="Epsilon")
 
         row = layout.row()
         row.operator("pnp.solve_pnp", text="Solve Camera Pose")
         row.scale_y = 2.0
 
+        row = layout.row(align=True)
+        row.prop(settings, "use_live_solve")
+        if settings.use_live_solve:
+            row.prop(settings, "live_solve_delay", text="Delay")
+
         row = layout.row()
         row.label(text=settings.pnp_solve_msg)
 
+        row = layout.row()
+        row.label(
+            text="Point error RMS: %.2f px, Max: %.2f px"
+            % (current_image.reprojection_rms, current_image.reprojection_max)
+        )
+
+        if current_image.pose_solver != "":
+            col = layout.column(align=True)
+            col.label(text=f"Solver: {current_image.pose_solver}")
+            col.label(text=current_image.pose_solver_timings)
+
+        if current_image.is_pose_solved:
+            col = layout.column(align=True)
+            col.label(
+                text="Position sigma: %.3f, Rotation sigma: %.2f deg"
+                % (current_image.position_sigma, current_image.rotation_sigma),
+                icon=(
+                    "ERROR"
+                    if props.is_weakly_constrained(settings, current_image)
+                    else "NONE"
+                ),
+            )
+            row = col.row(align=True)
+            row.prop(settings, "max_position_sigma", text="Max position")
+            row.prop(settings, "max_rotation_sigma", text="Max rotation")
+
+        row = layout.row()
+        row.operator("pnp.solve_pnp_all", text="Solve All Images")
+        if settings.pnp_solve_all_msg != "":
+            row = layout.row()
+            row.label(text=settings.pnp_solve_all_msg)
+
+        # Only movie clips with more than one frame can be solved per frame
+        if current_image.movie_clip.frame_duration > 1:
+            row = layout.row()
+            row.operator("pnp.solve_pnp_video", text="Solve Every Frame")
+            if settings.pnp_solve_video_msg != "":
+                row = layout.row()
+                row.label(text=settings.pnp_solve_video_msg)
+
         row = layout.row()
         row.operator(
             "imagematches.toggle_camera",
@@ -321,6 +501,40 @@ class SolvePanel(bpy.types.Panel):
         )
 
 
+class BundlePanel(bpy.types.Panel):
+    """Panel for bundle adjustment of all solved images"""
+
+    bl_label = "PNP - Bundle Adjust"
+    bl_idname = "CLIP_PT_PNP_Bundle"
+    bl_space_type = "CLIP_EDITOR"
+    bl_region_type = "TOOLS"
+    bl_category = "Image Match"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(self, context):
+        return current_image_initialised(context)
+
+    def draw(self, context):
+        layout = self.layout
+        settings = context.scene.match_settings
+
+        col = layout.column(align=True)
+        col.prop(settings, "bundle_merge_distance")
+        col.prop(settings, "bundle_refine_intrinsics")
+        col.prop(settings, "bundle_refine_points")
+        if settings.bundle_refine_points:
+            col.prop(settings, "bundle_point_weight")
+        col.prop(settings, "bundle_max_iterations", text="Iterations")
+
+        row = layout.row()
+        row.operator("pnp.bundle_adjust", text="Bundle Adjust")
+
+        if settings.pnp_bundle_msg != "":
+            row = layout.row()
+            row.label(text=settings.pnp_bundle_msg)
+
+
 class ExportPanel(bpy.types.Panel):
     """Panel for all image match export settings"""
 